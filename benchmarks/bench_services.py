@@ -0,0 +1,368 @@
+"""
+Нагрузочный бенчмарк line_provider и bet_maker в одном процессе.
+
+Оба приложения (line_provider/main.py:app и bet_maker/main.py:app)
+запускаются в текущем процессе и вызываются через ASGI-транспорт httpx,
+без сети. RabbitMQ заменяется in-memory брокером (memory_broker), БД
+bet_maker — SQLite-файлом во временном каталоге либо PostgreSQL
+(--database-url postgresql+asyncpg://...).
+
+Сценарии:
+- poll: опрос GET /events и GET /event/{id} (в т.ч. с If-None-Match) и GET /events bet_maker;
+- bet_burst: создание событий и пачка одновременных ставок POST /bet;
+- finish_storm: одновременное завершение всех событий и время расчёта ставок;
+- mixed: опрос, ставки и изменения коэффициентов одновременно в течение --duration секунд.
+
+По каждому эндпоинту выводятся количество запросов, ошибки, ops/s,
+p50 и p99 задержки в JSON (stdout или --output), сводная таблица — в stderr.
+Запуск из корня репозитория:
+
+    python -m benchmarks.bench_services --output bench.json
+"""
+import argparse
+import asyncio
+import importlib
+import json
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from pathlib import Path
+from types import ModuleType
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+import httpx
+
+from benchmarks.memory_broker import MemoryBroker
+
+ROOT = Path(__file__).resolve().parent.parent
+SCENARIOS = ("poll", "bet_burst", "finish_storm", "mixed")
+
+
+def load_service(name: str) -> Dict[str, ModuleType]:
+    """
+    Импортирует main.py сервиса из его каталога.
+
+    Оба сервиса содержат модули с одинаковыми именами (main, schemas), поэтому
+    после импорта модули сервиса убираются из sys.modules: приложение продолжает
+    ссылаться на них, а следующий сервис импортирует свои.
+
+    :param name: Каталог сервиса (line_provider или bet_maker).
+    :return: Модули сервиса по имени.
+    """
+    service_dir = str(ROOT / name)
+    sys.path.insert(0, service_dir)
+    try:
+        importlib.import_module("main")
+    finally:
+        sys.path.remove(service_dir)
+    modules = {
+        module_name: module
+        for module_name, module in list(sys.modules.items())
+        if (getattr(module, "__file__", None) or "").startswith(service_dir + os.sep)
+    }
+    for module_name in modules:
+        del sys.modules[module_name]
+    return modules
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """Перцентиль q (0..1) отсортированного списка (nearest-rank)."""
+    return sorted_values[max(0, math.ceil(q * len(sorted_values)) - 1)]
+
+
+class Recorder:
+    """Задержки и ошибки запросов по эндпоинтам одного сценария."""
+
+    def __init__(self, scenario: str) -> None:
+        self.scenario = scenario
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.started = time.perf_counter()
+
+    async def call(
+        self,
+        endpoint: str,
+        request: Awaitable[httpx.Response],
+        expected: tuple = (200,),
+    ) -> Optional[httpx.Response]:
+        """
+        Выполняет запрос и записывает его задержку.
+
+        :param endpoint: Имя эндпоинта в отчёте.
+        :param request: Корутина запроса.
+        :param expected: Коды ответа, считающиеся успешными.
+        :return: Ответ или None при исключении.
+        """
+        started = time.perf_counter()
+        try:
+            response = await request
+        except Exception:
+            self.errors[endpoint] += 1
+            return None
+        self.record(endpoint, time.perf_counter() - started, response.status_code in expected)
+        # Ответ из кэша приходит без единого переключения задач (сети нет),
+        # поэтому клиент явно уступает цикл событий, иначе он вытеснит остальных
+        await asyncio.sleep(0)
+        return response
+
+    def record(self, endpoint: str, seconds: float, ok: bool = True) -> None:
+        self.latencies[endpoint].append(seconds * 1000)
+        if not ok:
+            self.errors[endpoint] += 1
+
+    def results(self) -> List[Dict[str, Any]]:
+        """Сводка по эндпоинтам: count, errors, ops/s, p50 и p99 (мс)."""
+        elapsed = time.perf_counter() - self.started
+        results = []
+        for endpoint, latencies in sorted(self.latencies.items()):
+            latencies.sort()
+            results.append({
+                "scenario": self.scenario,
+                "endpoint": endpoint,
+                "count": len(latencies),
+                "errors": self.errors[endpoint],
+                "ops_per_sec": round(len(latencies) / elapsed, 1),
+                "p50_ms": round(percentile(latencies, 0.50), 3),
+                "p99_ms": round(percentile(latencies, 0.99), 3),
+            })
+        return results
+
+
+class Harness:
+    """Оба приложения, брокер и HTTP-клиенты к ним."""
+
+    def __init__(self, line: Dict[str, ModuleType], bet: Dict[str, ModuleType]) -> None:
+        self.line = line
+        self.bet = bet
+        self.broker = MemoryBroker()
+        line_app = line["main"].app
+        bet_app = bet["main"].app
+        self.line_client = httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=line_app), base_url="http://line_provider"
+        )
+        self.bet_client = httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=bet_app), base_url="http://bet_maker"
+        )
+        line["main"].connect_robust = self.broker.connect_robust
+        bet["main"].connect_robust = self.broker.connect_robust
+        bet["events_replica"].replica.transport = httpx.ASGITransport(app=line_app)
+
+    async def start(self) -> None:
+        await self.line["main"].app.router.startup()
+        await self.bet["main"].app.router.startup()
+        await self.wait_for(lambda: self.bet["events_replica"].replica.ready)
+
+    async def stop(self) -> None:
+        await self.bet["main"].app.router.shutdown()
+        await self.line["main"].app.router.shutdown()
+        await self.line_client.aclose()
+        await self.bet_client.aclose()
+
+    @staticmethod
+    async def wait_for(condition: Callable[[], bool], timeout: float = 60.0) -> None:
+        deadline = time.monotonic() + timeout
+        while not condition():
+            if time.monotonic() > deadline:
+                raise TimeoutError("Condition not reached in benchmark")
+            await asyncio.sleep(0.01)
+
+    async def settled_count(self, event_ids: List[str]) -> int:
+        """Количество рассчитанных событий из event_ids (по таблице settlements)."""
+        from sqlalchemy import func, select
+
+        Settlement = self.bet["models"].Settlement
+        async with self.bet["db"].SessionLocal() as session:
+            return await session.scalar(
+                select(func.count()).select_from(Settlement)
+                .where(Settlement.event_id.in_(event_ids))
+            )
+
+
+async def run_clients(count: int, client: Callable[[int], Awaitable[None]]) -> None:
+    await asyncio.gather(*(client(i) for i in range(count)))
+
+
+async def create_events(h: Harness, rec: Recorder, event_ids: List[str], concurrency: int) -> None:
+    """Создаёт события через PUT /event и ждёт, пока они попадут в реплику bet_maker."""
+    queue = iter(event_ids)
+
+    async def client(_: int) -> None:
+        for event_id in queue:
+            await rec.call("PUT /event", h.line_client.put("/event", json={
+                "event_id": event_id,
+                "coefficient": "1.50",
+                "deadline": int(time.time()) + 3600,
+                "state": "NEW",
+            }))
+
+    await run_clients(concurrency, client)
+    replica = h.bet["events_replica"].replica
+    await h.wait_for(lambda: all(event_id in replica.events for event_id in event_ids))
+
+
+async def scenario_poll(h: Harness, args: argparse.Namespace, event_ids: List[str]) -> Recorder:
+    rec = Recorder("poll")
+    counter = iter(range(args.polls))
+
+    async def client(_: int) -> None:
+        etag = None
+        for i in counter:
+            event_id = event_ids[i % len(event_ids)]
+            await rec.call("line GET /events", h.line_client.get("/events"))
+            await rec.call("line GET /event/{id}", h.line_client.get(f"/event/{event_id}"))
+            resp = await rec.call(
+                "line GET /events (If-None-Match)",
+                h.line_client.get("/events", headers={"If-None-Match": etag} if etag else {}),
+                expected=(200, 304),
+            )
+            if resp is not None:
+                etag = resp.headers.get("ETag")
+            await rec.call("bet GET /events", h.bet_client.get("/events"))
+
+    await run_clients(args.concurrency, client)
+    return rec
+
+
+async def scenario_bet_burst(h: Harness, args: argparse.Namespace, event_ids: List[str]) -> Recorder:
+    rec = Recorder("bet_burst")
+    counter = iter(range(args.bets))
+
+    async def client(_: int) -> None:
+        for i in counter:
+            await rec.call("bet POST /bet", h.bet_client.post("/bet", json={
+                "event_id": event_ids[i % len(event_ids)],
+                "amount": "10.00",
+            }))
+
+    await run_clients(args.concurrency, client)
+    return rec
+
+
+async def scenario_finish_storm(h: Harness, args: argparse.Namespace, event_ids: List[str]) -> Recorder:
+    rec = Recorder("finish_storm")
+    queue = iter(enumerate(event_ids))
+
+    async def client(_: int) -> None:
+        for i, event_id in queue:
+            state = "FINISHED_WIN" if i % 2 else "FINISHED_LOSE"
+            await rec.call("line PUT /event (finish)", h.line_client.put(
+                "/event", json={"event_id": event_id, "state": state}
+            ))
+
+    started = time.perf_counter()
+    await run_clients(args.concurrency, client)
+    while await h.settled_count(event_ids) < len(event_ids):
+        await asyncio.sleep(0.01)
+    # Одна запись на всё событие: время от первого завершения до расчёта последнего
+    rec.record("settlement (all events)", time.perf_counter() - started)
+    return rec
+
+
+async def scenario_mixed(h: Harness, args: argparse.Namespace, event_ids: List[str]) -> Recorder:
+    rec = Recorder("mixed")
+    deadline = time.monotonic() + args.duration
+    rnd = random.Random(0)
+
+    async def poller(_: int) -> None:
+        etag = None
+        while time.monotonic() < deadline:
+            resp = await rec.call(
+                "line GET /events (If-None-Match)",
+                h.line_client.get("/events", headers={"If-None-Match": etag} if etag else {}),
+                expected=(200, 304),
+            )
+            if resp is not None:
+                etag = resp.headers.get("ETag")
+            await rec.call("bet GET /events", h.bet_client.get("/events"))
+
+    async def bettor(_: int) -> None:
+        while time.monotonic() < deadline:
+            await rec.call("bet POST /bet", h.bet_client.post("/bet", json={
+                "event_id": rnd.choice(event_ids), "amount": "5.00",
+            }))
+
+    async def updater(_: int) -> None:
+        while time.monotonic() < deadline:
+            await rec.call("line PUT /event (coefficient)", h.line_client.put("/event", json={
+                "event_id": rnd.choice(event_ids),
+                "coefficient": f"{rnd.uniform(1.1, 3.0):.2f}",
+            }))
+            await asyncio.sleep(0.01)
+
+    await asyncio.gather(
+        run_clients(args.concurrency, poller),
+        run_clients(args.concurrency, bettor),
+        run_clients(max(1, args.concurrency // 10), updater),
+    )
+    return rec
+
+
+async def main(args: argparse.Namespace) -> List[Dict[str, Any]]:
+    line = load_service("line_provider")
+    bet = load_service("bet_maker")
+    h = Harness(line, bet)
+    await h.start()
+
+    results: List[Dict[str, Any]] = []
+    run_id = f"{int(time.time())}"
+    try:
+        # События ставок и завершения свои у каждого прогона, чтобы не пересекаться с БД
+        bet_events = [f"bench-{run_id}-{i}" for i in range(args.events)]
+        mixed_events = [f"bench-{run_id}-mixed-{i}" for i in range(args.events)]
+        setup = Recorder("setup")
+        await create_events(h, setup, bet_events + mixed_events, args.concurrency)
+        results += setup.results()
+
+        for scenario in args.scenarios:
+            if scenario == "poll":
+                rec = await scenario_poll(h, args, bet_events)
+            elif scenario == "bet_burst":
+                rec = await scenario_bet_burst(h, args, bet_events)
+            elif scenario == "finish_storm":
+                rec = await scenario_finish_storm(h, args, bet_events)
+            else:
+                rec = await scenario_mixed(h, args, mixed_events)
+            results += rec.results()
+    finally:
+        await h.stop()
+    return results
+
+
+def print_table(results: List[Dict[str, Any]]) -> None:
+    line = "{:<14} {:<36} {:>8} {:>6} {:>10} {:>10} {:>10}"
+    print(line.format("scenario", "endpoint", "count", "err", "ops/s", "p50 ms", "p99 ms"), file=sys.stderr)
+    for r in results:
+        print(line.format(
+            r["scenario"], r["endpoint"], r["count"], r["errors"],
+            r["ops_per_sec"], r["p50_ms"], r["p99_ms"],
+        ), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--database-url", help="URL БД bet_maker (по умолчанию SQLite во временном каталоге)")
+    parser.add_argument("--events", type=int, default=50, help="Количество событий")
+    parser.add_argument("--bets", type=int, default=2000, help="Ставок в bet_burst")
+    parser.add_argument("--polls", type=int, default=2000, help="Итераций опроса в poll")
+    parser.add_argument("--duration", type=float, default=5.0, help="Длительность mixed в секундах")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--output", help="Файл для JSON с результатами (по умолчанию stdout)")
+    args = parser.parse_args()
+
+    # Настройки приложений читаются при импорте, поэтому задаются до load_service
+    tmp_dir = tempfile.mkdtemp(prefix="bench_services_")
+    os.environ["DATABASE_URL"] = args.database_url or f"sqlite+aiosqlite:///{tmp_dir}/bets.db"
+    os.environ.setdefault("LINE_PROVIDER_URL", "http://line_provider")
+
+    results = asyncio.run(main(args))
+    print_table(results)
+    report = json.dumps({"config": vars(args), "results": results}, indent=2)
+    if args.output:
+        Path(args.output).write_text(report + "\n")
+    else:
+        print(report)
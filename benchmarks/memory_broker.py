@@ -0,0 +1,229 @@
+"""
+In-memory замена RabbitMQ для бенчмарков.
+
+Реализует подмножество API aio-pika, которое используют line_provider
+и bet_maker: connect_robust, channel.set_qos, declare_exchange (topic),
+declare_queue, default_exchange, queue.bind / unbind / consume,
+exchange.publish и ack / nack / reject входящих сообщений.
+
+Все соединения одного MemoryBroker видят одни и те же обменники и очереди,
+поэтому оба приложения в одном процессе обмениваются сообщениями так же,
+как через настоящий брокер. Публикация подтверждается сразу (как publisher
+confirm), prefetch ограничивает количество неподтверждённых сообщений канала.
+"""
+import asyncio
+import itertools
+import re
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from aio_pika import Message
+
+Consumer = Callable[["MemoryIncomingMessage"], Awaitable[Any]]
+
+
+def _topic_pattern(binding_key: str) -> "re.Pattern[str]":
+    """Регулярное выражение для ключа привязки topic-обменника (* и #)."""
+    words = []
+    for word in binding_key.split("."):
+        if word == "#":
+            words.append(r"[^.]*(?:\.[^.]*)*")
+        elif word == "*":
+            words.append(r"[^.]+")
+        else:
+            words.append(re.escape(word))
+    return re.compile(r"\.".join(words) + "$")
+
+
+class MemoryIncomingMessage:
+    """Доставленное сообщение (аналог aio_pika.IncomingMessage)."""
+
+    def __init__(self, message: Message, routing_key: str, queue: "MemoryQueue") -> None:
+        self.body: bytes = message.body
+        self.headers: Dict[str, Any] = dict(message.headers or {})
+        self.content_type: Optional[str] = message.content_type
+        self.message_id: Optional[str] = message.message_id
+        self.routing_key = routing_key
+        self.delivery_tag: int = 0
+        self._message = message
+        self._queue = queue
+        self._channel: Optional["MemoryChannel"] = None
+
+    async def ack(self, multiple: bool = False) -> None:
+        if self._channel is not None:
+            self._channel._settle(self.delivery_tag, multiple)
+
+    async def nack(self, multiple: bool = False, requeue: bool = True) -> None:
+        if self._channel is not None:
+            for message in self._channel._settle(self.delivery_tag, multiple):
+                if requeue:
+                    message._queue.put(message._message, message.routing_key)
+
+    async def reject(self, requeue: bool = False) -> None:
+        await self.nack(requeue=requeue)
+
+
+class MemoryQueue:
+    """Очередь: сообщения раздаются потребителям по кругу."""
+
+    def __init__(self, broker: "MemoryBroker", name: str) -> None:
+        self.broker = broker
+        self.name = name
+        self._messages: "asyncio.Queue[Tuple[Message, str]]" = asyncio.Queue()
+        self._consumers: List[asyncio.Task] = []
+
+    def __len__(self) -> int:
+        return self._messages.qsize()
+
+    def put(self, message: Message, routing_key: str) -> None:
+        self._messages.put_nowait((message, routing_key))
+
+    async def bind(self, exchange: "MemoryExchange", routing_key: str = "#") -> None:
+        exchange.bindings.append((_topic_pattern(routing_key), self))
+
+    async def unbind(self, exchange: "MemoryExchange", routing_key: str = "#") -> None:
+        exchange.bindings = [
+            (pattern, queue) for pattern, queue in exchange.bindings
+            if not (queue is self and pattern.pattern == _topic_pattern(routing_key).pattern)
+        ]
+
+    async def consume(self, callback: Consumer, no_ack: bool = False) -> str:
+        channel = self.broker.channel_of(self)
+        self._consumers.append(asyncio.create_task(channel._deliver(self, callback, no_ack)))
+        return f"ctag.{self.name}.{len(self._consumers)}"
+
+    async def get_message(self) -> Tuple[Message, str]:
+        return await self._messages.get()
+
+    def close(self) -> None:
+        for task in self._consumers:
+            task.cancel()
+
+
+class MemoryExchange:
+    """Обменник: topic по ключам привязки или default (по имени очереди)."""
+
+    def __init__(self, broker: "MemoryBroker", name: str) -> None:
+        self.broker = broker
+        self.name = name
+        self.bindings: List[Tuple["re.Pattern[str]", MemoryQueue]] = []
+
+    async def publish(self, message: Message, routing_key: str, **kwargs: Any) -> None:
+        self.broker.published += 1
+        if not self.name:
+            queue = self.broker.queues.get(routing_key)
+            if queue is not None:
+                queue.put(message, routing_key)
+            return
+        for queue in {q for pattern, q in self.bindings if pattern.match(routing_key)}:
+            queue.put(message, routing_key)
+
+
+class MemoryChannel:
+    """Канал с prefetch и учётом неподтверждённых сообщений."""
+
+    def __init__(self, broker: "MemoryBroker") -> None:
+        self.broker = broker
+        self.default_exchange = broker.default_exchange
+        self._prefetch: int = 0
+        self._tags = itertools.count(1)
+        self._unacked: "OrderedDict[int, MemoryIncomingMessage]" = OrderedDict()
+        self._credit = asyncio.Condition()
+        self._queues: Set[MemoryQueue] = set()
+
+    async def set_qos(self, prefetch_count: int = 0, **kwargs: Any) -> None:
+        self._prefetch = prefetch_count
+
+    async def declare_exchange(self, name: str, type: Any = None, **kwargs: Any) -> MemoryExchange:
+        exchange = self.broker.exchanges.get(name)
+        if exchange is None:
+            exchange = self.broker.exchanges[name] = MemoryExchange(self.broker, name)
+        return exchange
+
+    async def declare_queue(self, name: Optional[str] = None, **kwargs: Any) -> MemoryQueue:
+        name = name or f"amq.gen-{next(self.broker.queue_ids)}"
+        queue = self.broker.queues.get(name)
+        if queue is None:
+            queue = self.broker.queues[name] = MemoryQueue(self.broker, name)
+        self._queues.add(queue)
+        self.broker.channels[queue] = self
+        return queue
+
+    async def close(self) -> None:
+        for queue in self._queues:
+            queue.close()
+
+    async def _deliver(self, queue: MemoryQueue, callback: Consumer, no_ack: bool) -> None:
+        """Доставляет сообщения очереди потребителю с учётом prefetch канала."""
+        while True:
+            message, routing_key = await queue.get_message()
+            incoming = MemoryIncomingMessage(message, routing_key, queue)
+            if not no_ack:
+                async with self._credit:
+                    await self._credit.wait_for(
+                        lambda: not self._prefetch or len(self._unacked) < self._prefetch
+                    )
+                incoming.delivery_tag = next(self._tags)
+                incoming._channel = self
+                self._unacked[incoming.delivery_tag] = incoming
+            # Как и aio-pika, колбэк каждого сообщения выполняется отдельной задачей
+            asyncio.create_task(callback(incoming))
+
+    def _settle(self, delivery_tag: int, multiple: bool) -> List[MemoryIncomingMessage]:
+        """Убирает подтверждённые сообщения из неподтверждённых и освобождает prefetch."""
+        if multiple:
+            tags = [tag for tag in self._unacked if tag <= delivery_tag]
+        else:
+            tags = [delivery_tag] if delivery_tag in self._unacked else []
+        settled = [self._unacked.pop(tag) for tag in tags]
+        asyncio.create_task(self._notify())
+        return settled
+
+    async def _notify(self) -> None:
+        async with self._credit:
+            self._credit.notify_all()
+
+
+class MemoryConnection:
+    """Соединение (аналог aio_pika.RobustConnection)."""
+
+    def __init__(self, broker: "MemoryBroker") -> None:
+        self.broker = broker
+        self.reconnect_callbacks: Set[Callable[..., Any]] = set()
+        self._channels: List[MemoryChannel] = []
+
+    async def channel(self, **kwargs: Any) -> MemoryChannel:
+        channel = MemoryChannel(self.broker)
+        self._channels.append(channel)
+        return channel
+
+    async def close(self) -> None:
+        for channel in self._channels:
+            await channel.close()
+
+
+class MemoryBroker:
+    """
+    Общее состояние брокера: обменники и очереди.
+
+    - published: Количество опубликованных сообщений.
+    """
+
+    def __init__(self) -> None:
+        self.exchanges: Dict[str, MemoryExchange] = {}
+        self.queues: Dict[str, MemoryQueue] = {}
+        self.channels: Dict[MemoryQueue, MemoryChannel] = {}
+        self.default_exchange = MemoryExchange(self, "")
+        self.queue_ids = itertools.count(1)
+        self.published: int = 0
+
+    def channel_of(self, queue: MemoryQueue) -> MemoryChannel:
+        return self.channels[queue]
+
+    async def connect_robust(self, *args: Any, **kwargs: Any) -> MemoryConnection:
+        """Замена aio_pika.connect_robust."""
+        return MemoryConnection(self)
+
+    def pending(self) -> int:
+        """Количество сообщений, ожидающих доставки во всех очередях."""
+        return sum(len(queue) for queue in self.queues.values())
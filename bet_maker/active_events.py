@@ -0,0 +1,122 @@
+"""
+Модуль in-process кэша идентификаторов активных событий
+(событий, по которым есть хотя бы одна ставка в статусе "NEW").
+
+Кэш обновляется точечно: при создании ставки событие добавляется,
+при расчёте события — удаляется. Ограниченный срок жизни (TTL)
+защищает от расхождений с изменениями, сделанными другими
+экземплярами bet_maker.
+
+Для GET /events кэш хранит готовый JSON ответа (event_id отсортированы)
+и его ETag — хэш JSON, поэтому экземпляры bet_maker с одинаковым множеством
+событий отдают одинаковый ETag.
+"""
+import asyncio
+import os
+import time
+from typing import Awaitable, Callable, Iterable, List, Optional, Set, Tuple
+
+import orjson
+
+from http_cache import content_etag
+
+#: Срок жизни кэша активных событий в секундах
+ACTIVE_EVENTS_CACHE_TTL: float = float(os.getenv("ACTIVE_EVENTS_CACHE_TTL", "5"))
+
+
+class ActiveEventsCache:
+    """
+    Кэш множества активных event_id.
+
+    Загрузка из БД выполняется одним запросом на все конкурентные промахи.
+    Если во время загрузки кэш был изменён, результат загрузки не
+    сохраняется (он мог устареть).
+    """
+
+    def __init__(self, ttl: float = ACTIVE_EVENTS_CACHE_TTL) -> None:
+        """
+        :param ttl: Срок жизни загруженного множества в секундах.
+        """
+        self.ttl = ttl
+        self._event_ids: Optional[Set[str]] = None
+        self._expires_at: float = 0.0
+        self._version: int = 0
+        self._lock = asyncio.Lock()
+        self._json: Optional[bytes] = None
+        self._etag: Optional[str] = None
+
+    def _is_valid(self) -> bool:
+        return self._event_ids is not None and time.monotonic() < self._expires_at
+
+    async def get(self, load: Callable[[], Awaitable[Iterable[str]]]) -> List[str]:
+        """
+        Возвращает активные event_id, при необходимости загружая их.
+
+        :param load: Корутина-функция загрузки активных event_id из БД.
+        :return: Список активных event_id.
+        """
+        if self._is_valid():
+            return list(self._event_ids)
+
+        async with self._lock:
+            if self._is_valid():
+                return list(self._event_ids)
+
+            version = self._version
+            event_ids = set(await load())
+            if version == self._version:
+                if event_ids != self._event_ids:
+                    self._content_changed()
+                self._event_ids = event_ids
+                self._expires_at = time.monotonic() + self.ttl
+            return list(event_ids)
+
+    async def get_json(
+        self, load: Callable[[], Awaitable[Iterable[str]]]
+    ) -> Tuple[bytes, Optional[str]]:
+        """
+        Возвращает готовый JSON ответа GET /events и его ETag.
+
+        :param load: Корутина-функция загрузки активных event_id из БД.
+        :return: Пара (JSON, ETag); ETag равен None, если загруженный
+            результат не попал в кэш (кэш менялся во время загрузки).
+        """
+        event_ids = await self.get(load)
+        if not self._is_valid():
+            return orjson.dumps({"active_events": event_ids}), None
+        if self._json is None:
+            self._json = orjson.dumps({"active_events": sorted(self._event_ids)})
+            self._etag = content_etag(self._json)
+        return self._json, self._etag
+
+    def _content_changed(self) -> None:
+        self._json = None
+
+    def add(self, event_id: str) -> None:
+        """
+        Отмечает событие активным (создана ставка в статусе "NEW").
+
+        :param event_id: Идентификатор события.
+        """
+        # Пока кэш действителен, загрузка не идёт, и уже известное событие ничего не меняет
+        if self._is_valid() and event_id in self._event_ids:
+            return
+        self._version += 1
+        if self._event_ids is not None and event_id not in self._event_ids:
+            self._event_ids.add(event_id)
+            self._content_changed()
+
+    def discard(self, event_ids: Iterable[str]) -> None:
+        """
+        Убирает рассчитанные события из активных.
+
+        :param event_ids: Идентификаторы рассчитанных событий.
+        """
+        self._version += 1
+        if self._event_ids is not None and not self._event_ids.isdisjoint(event_ids):
+            self._event_ids.difference_update(event_ids)
+            self._content_changed()
+
+
+#: Кэш активных событий, используемый приложением
+active_events_cache = ActiveEventsCache()
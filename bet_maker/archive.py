@@ -0,0 +1,285 @@
+"""
+Модуль архивации рассчитанных ставок.
+
+Горячая таблица bets нужна запросам активных событий, записи ставок и
+расчёту (UPDATE ... WHERE status = 'NEW'); рассчитанные ставки (WIN/LOSE)
+им не нужны, но занимают место в таблице и её индексах. BetArchiver
+периодически переносит ставки, рассчитанные и созданные раньше
+archive_after секунд назад, в таблицу bets_archive пачками по batch_size.
+
+В PostgreSQL обе таблицы секционированы по created_at по месяцам
+(см. migrations/versions/0002_partition_bets.py). Задача архивации также
+обслуживает секции:
+- создаёт секции текущего и следующих months_ahead месяцев, пока в них
+  не начали писать (иначе строки попадут в секцию по умолчанию);
+- удаляет опустевшие секции bets за прошедшие месяцы: новые ставки
+  пишутся только в секцию текущего месяца, поэтому прошедший месяц,
+  из которого всё перенесено в архив, больше не заполнится.
+
+Заодно удаляются ключи идемпотентности POST /bet старше idempotency_key_ttl
+(см. idempotency.py).
+"""
+import asyncio
+import logging
+import re
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional, Tuple
+
+from sqlalchemy import delete, insert, select, text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+from db import engine as default_engine
+from metrics import METRICS_ENABLED, Counter
+from models import Bet, BetArchive, BetIdempotencyKey
+
+logger = logging.getLogger("bet_maker")
+
+#: Секционированные по месяцам таблицы
+PARTITIONED_TABLES: Tuple[str, ...] = ("bets", "bets_archive")
+#: Ключ advisory-блокировки обслуживания секций (один экземпляр за раз)
+PARTITIONS_LOCK_KEY: int = 7_240_018
+
+BETS_ARCHIVED = Counter("bets_archived_total", "Рассчитанные ставки, перенесённые в bets_archive")
+
+_MOVE_SETTLED_PG = text(
+    """
+    WITH moved AS (
+        DELETE FROM bets AS b
+        USING (
+            SELECT id, created_at FROM bets
+            WHERE status <> 'NEW' AND created_at < :cutoff
+            ORDER BY created_at
+            LIMIT :batch_size
+            FOR UPDATE SKIP LOCKED
+        ) AS settled
+        WHERE b.id = settled.id AND b.created_at = settled.created_at
+        RETURNING b.id, b.event_id, b.amount, b.coefficient, b.status, b.created_at
+    )
+    INSERT INTO bets_archive (id, event_id, amount, coefficient, status, created_at)
+    SELECT id, event_id, amount, coefficient, status, created_at FROM moved
+    """
+)
+
+
+def month_start(moment: datetime, shift: int = 0) -> datetime:
+    """
+    Начало месяца (UTC), сдвинутого на shift месяцев относительно moment.
+
+    :param moment: Момент времени (с часовым поясом).
+    :param shift: Сдвиг в месяцах.
+    :return: Полночь первого числа месяца.
+    """
+    months = moment.year * 12 + moment.month - 1 + shift
+    return datetime(months // 12, months % 12 + 1, 1, tzinfo=timezone.utc)
+
+
+def partition_name(table: str, start: datetime) -> str:
+    """Имя месячной секции таблицы: bets_p202610."""
+    return f"{table}_p{start:%Y%m}"
+
+
+class BetArchiver:
+    """
+    Фоновая задача переноса рассчитанных ставок в bets_archive
+    и обслуживания месячных секций.
+    """
+
+    def __init__(
+        self,
+        interval: float = 60.0,
+        archive_after: float = 3600.0,
+        batch_size: int = 5000,
+        months_ahead: int = 2,
+        idempotency_key_ttl: Optional[float] = None,
+        engine: AsyncEngine = default_engine,
+    ) -> None:
+        """
+        :param interval: Пауза между циклами архивации в секундах.
+        :param archive_after: Минимальный возраст (по created_at) переносимой ставки в секундах.
+        :param batch_size: Максимальное количество ставок, переносимых одной транзакцией.
+        :param months_ahead: На сколько месяцев вперёд создаются секции.
+        :param idempotency_key_ttl: Время хранения ключей идемпотентности в секундах
+            (None — не удалять).
+        :param engine: Асинхронный движок SQLAlchemy.
+        """
+        self.interval = interval
+        self.archive_after = archive_after
+        self.batch_size = batch_size
+        self.months_ahead = months_ahead
+        self.idempotency_key_ttl = idempotency_key_ttl
+        self._engine = engine
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        """Запускает фоновую задачу."""
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Останавливает фоновую задачу (текущая транзакция откатывается)."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        """Цикл: обслуживание секций, перенос ставок, пауза."""
+        while True:
+            try:
+                await self.run_once()
+            except Exception:
+                logger.exception("Bet archiving cycle failed.")
+            await asyncio.sleep(self.interval)
+
+    async def run_once(self) -> int:
+        """
+        Один цикл архивации.
+
+        :return: Количество перенесённых ставок.
+        """
+        now = datetime.now(timezone.utc)
+        postgres = self._engine.dialect.name == "postgresql"
+        if postgres:
+            await self.ensure_partitions(now)
+
+        cutoff = now - timedelta(seconds=self.archive_after)
+        moved_total = 0
+        while True:
+            moved = await self.move_settled(cutoff)
+            moved_total += moved
+            if moved < self.batch_size:
+                break
+
+        if postgres and moved_total:
+            await self.drop_empty_partitions(now)
+        if moved_total:
+            logger.info("Archived %d settled bets.", moved_total)
+        if self.idempotency_key_ttl is not None:
+            await self.purge_idempotency_keys(now - timedelta(seconds=self.idempotency_key_ttl))
+        return moved_total
+
+    async def purge_idempotency_keys(self, cutoff: datetime) -> int:
+        """
+        Удаляет ключи идемпотентности, созданные до cutoff.
+
+        :param cutoff: Граница по created_at.
+        :return: Количество удалённых ключей.
+        """
+        async with self._engine.begin() as conn:
+            result = await conn.execute(
+                delete(BetIdempotencyKey).where(BetIdempotencyKey.created_at < cutoff)
+            )
+        if result.rowcount:
+            logger.info("Purged %d expired idempotency keys.", result.rowcount)
+        return result.rowcount
+
+    async def move_settled(self, cutoff: datetime) -> int:
+        """
+        Переносит одну пачку рассчитанных ставок, созданных до cutoff,
+        из bets в bets_archive (удаление и вставка в одной транзакции).
+
+        В PostgreSQL строки выбираются с FOR UPDATE SKIP LOCKED, поэтому
+        несколько экземпляров приложения могут архивировать одновременно.
+
+        :param cutoff: Граница по created_at.
+        :return: Количество перенесённых ставок.
+        """
+        async with self._engine.begin() as conn:
+            if self._engine.dialect.name == "postgresql":
+                result = await conn.execute(
+                    _MOVE_SETTLED_PG, {"cutoff": cutoff, "batch_size": self.batch_size}
+                )
+                moved = result.rowcount
+            else:
+                # SQLite: запись сериализована, поэтому достаточно двух выражений
+                ids = (
+                    await conn.execute(
+                        select(Bet.id)
+                        .where(Bet.status != "NEW", Bet.created_at < cutoff)
+                        .order_by(Bet.created_at)
+                        .limit(self.batch_size)
+                    )
+                ).scalars().all()
+                if ids:
+                    columns = [Bet.id, Bet.event_id, Bet.amount, Bet.coefficient, Bet.status, Bet.created_at]
+                    await conn.execute(
+                        insert(BetArchive).from_select(
+                            [c.key for c in columns], select(*columns).where(Bet.id.in_(ids))
+                        )
+                    )
+                    await conn.execute(delete(Bet).where(Bet.id.in_(ids)))
+                moved = len(ids)
+
+        if METRICS_ENABLED and moved:
+            BETS_ARCHIVED.inc(amount=moved)
+        return moved
+
+    async def ensure_partitions(self, now: datetime) -> None:
+        """
+        Создаёт месячные секции bets и bets_archive на текущий
+        и следующие months_ahead месяцев (если не существуют).
+
+        Если строки нужного месяца уже попали в секцию по умолчанию,
+        PostgreSQL не даст создать секцию — это логируется, строки
+        остаются в секции по умолчанию.
+
+        :param now: Текущее время.
+        """
+        for shift in range(self.months_ahead + 1):
+            start, end = month_start(now, shift), month_start(now, shift + 1)
+            for table in PARTITIONED_TABLES:
+                name = partition_name(table, start)
+                try:
+                    async with self._engine.begin() as conn:
+                        if not await self._try_lock(conn):
+                            return
+                        await conn.execute(text(
+                            f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {table} "
+                            f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+                        ))
+                except DBAPIError:
+                    logger.warning("Failed to create partition %s.", name, exc_info=True)
+
+    async def drop_empty_partitions(self, now: datetime) -> List[str]:
+        """
+        Удаляет пустые секции bets за прошедшие месяцы.
+
+        :param now: Текущее время.
+        :return: Имена удалённых секций.
+        """
+        current = partition_name("bets", month_start(now))
+        async with self._engine.connect() as conn:
+            names = (await conn.execute(text(
+                "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+                "WHERE i.inhparent = 'bets'::regclass"
+            ))).scalars().all()
+
+        # Имена bets_pYYYYMM сравниваются как строки: прошедшие месяцы меньше текущего
+        past = sorted(name for name in names if re.fullmatch(r"bets_p\d{6}", name) and name < current)
+        dropped = []
+        for name in past:
+            try:
+                async with self._engine.begin() as conn:
+                    if not await self._try_lock(conn):
+                        break
+                    # Не задерживать запросы к bets дольше секунды ради удаления секции
+                    await conn.execute(text("SET LOCAL lock_timeout = '1s'"))
+                    if (await conn.execute(text(f"SELECT 1 FROM {name} LIMIT 1"))).first():
+                        continue
+                    await conn.execute(text(f"DROP TABLE {name}"))
+                dropped.append(name)
+            except DBAPIError:
+                logger.warning("Failed to drop partition %s.", name, exc_info=True)
+        if dropped:
+            logger.info("Dropped empty bets partitions: %s", ", ".join(dropped))
+        return dropped
+
+    @staticmethod
+    async def _try_lock(conn: AsyncConnection) -> bool:
+        """Берёт advisory-блокировку обслуживания секций до конца транзакции."""
+        return bool((await conn.execute(
+            text("SELECT pg_try_advisory_xact_lock(:key)"), {"key": PARTITIONS_LOCK_KEY}
+        )).scalar())
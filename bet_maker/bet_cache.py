@@ -0,0 +1,176 @@
+"""
+Модуль in-process кэша ставок для GET /bet/{id} и GET /bets?event_id=.
+
+Ставка после создания меняется только при расчёте события (статус NEW ->
+WIN/LOSE), а список ставок события — ещё и при создании новой ставки.
+Поэтому кэш сбрасывается точечно, по event_id: при расчёте — ставки
+и список события, при создании ставки — только список события.
+Ограниченный срок жизни (TTL) защищает от расхождений с изменениями,
+сделанными другими экземплярами bet_maker. Размер кэша ограничен
+суммарным количеством ставок во всех записях (запись ставки — одна строка,
+список ставок события — по строке на ставку, до BETS_MAX_PAGE_SIZE + 1),
+а не количеством записей: вытесняются давно не читавшиеся записи (LRU).
+
+Конкурентные промахи по одному ключу загружаются одним запросом к БД.
+Если событие было сброшено во время загрузки, результат загрузки
+возвращается ожидающим, но не сохраняется (он мог устареть).
+"""
+import asyncio
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from metrics import METRICS_ENABLED, Counter, Gauge
+from schemas import BetDB
+
+#: Срок жизни записи кэша ставок в секундах
+BET_CACHE_TTL: float = float(os.getenv("BET_CACHE_TTL", "5"))
+#: Максимальное количество ставок во всех записях (ставок и списков ставок событий)
+BET_CACHE_MAX_ROWS: int = int(os.getenv("BET_CACHE_MAX_ROWS", "100000"))
+
+#: Ключ записи: ("bet", id) или ("event", event_id)
+CacheKey = Tuple[str, Any]
+#: Запись: (срок годности, event_id, значение, количество ставок в значении)
+CacheEntry = Tuple[float, str, Any, int]
+
+BET_CACHE_REQUESTS = Counter(
+    "bet_cache_requests_total", "Обращения к кэшу ставок по виду и результату", ("kind", "result"),
+)
+
+
+class BetLookupCache:
+    """
+    Кэш ставок по id и списков ставок по event_id.
+
+    Для точечного сброса хранится индекс event_id -> ключи записей.
+    Промах по ставке (ставки с таким id нет) не кэшируется: ставка может
+    быть создана позже.
+    """
+
+    def __init__(self, ttl: float = BET_CACHE_TTL, max_rows: int = BET_CACHE_MAX_ROWS) -> None:
+        """
+        :param ttl: Срок жизни записи в секундах.
+        :param max_rows: Максимальное количество ставок во всех записях;
+            список больше этого не кэшируется.
+        """
+        self.ttl = ttl
+        self.max_rows = max_rows
+        #: Количество ставок во всех записях
+        self.rows: int = 0
+        self._entries: "OrderedDict[CacheKey, CacheEntry]" = OrderedDict()
+        self._keys_by_event: Dict[str, Set[CacheKey]] = {}
+        self._inflight: Dict[CacheKey, "asyncio.Task[Any]"] = {}
+        # Номер последнего сброса события; ведётся, только пока идут загрузки
+        self._invalidation: int = 0
+        self._invalidated_at: Dict[str, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    async def get_bet(
+        self, bet_id: int, load: Callable[[], Awaitable[Optional[BetDB]]]
+    ) -> Optional[BetDB]:
+        """
+        Возвращает ставку по id, при необходимости загружая её.
+
+        :param bet_id: Идентификатор ставки.
+        :param load: Корутина-функция загрузки ставки из БД.
+        :return: Ставка или None, если её нет.
+        """
+        return await self._get(("bet", bet_id), None, load)
+
+    async def get_event_bets(
+        self, event_id: str, load: Callable[[], Awaitable[List[BetDB]]]
+    ) -> List[BetDB]:
+        """
+        Возвращает ставки события, при необходимости загружая их.
+
+        :param event_id: Идентификатор события.
+        :param load: Корутина-функция загрузки ставок события из БД.
+        :return: Ставки события (список не копируется и не должен изменяться).
+        """
+        return await self._get(("event", event_id), event_id, load)
+
+    async def _get(
+        self, key: CacheKey, event_id: Optional[str], load: Callable[[], Awaitable[Any]]
+    ) -> Any:
+        entry = self._entries.get(key)
+        if entry is not None:
+            if time.monotonic() < entry[0]:
+                self._entries.move_to_end(key)
+                self._count(key, "hit")
+                return entry[2]
+            self._remove(key)
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self._count(key, "coalesced")
+            return await asyncio.shield(task)
+
+        self._count(key, "miss")
+        task = asyncio.create_task(load())
+        self._inflight[key] = task
+        started = self._invalidation
+        task.add_done_callback(lambda done: self._finish(key, event_id, started, done))
+        return await asyncio.shield(task)
+
+    def _finish(self, key: CacheKey, event_id: Optional[str], started: int, task: "asyncio.Task[Any]") -> None:
+        """Убирает ключ из загружаемых и сохраняет результат, если он не устарел."""
+        del self._inflight[key]
+        if not task.cancelled() and task.exception() is None and task.result() is not None:
+            value = task.result()
+            if event_id is None:
+                event_id = value.event_id
+            if self._invalidated_at.get(event_id, -1) < started:
+                self._store(key, event_id, value)
+        if not self._inflight:
+            self._invalidated_at.clear()
+
+    def _store(self, key: CacheKey, event_id: str, value: Any) -> None:
+        rows = len(value) if isinstance(value, list) else 1
+        if rows > self.max_rows:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (time.monotonic() + self.ttl, event_id, value, rows)
+        self.rows += rows
+        self._keys_by_event.setdefault(event_id, set()).add(key)
+        while self.rows > self.max_rows:
+            self._remove(next(iter(self._entries)))
+
+    def _remove(self, key: CacheKey) -> None:
+        _, event_id, _, rows = self._entries.pop(key)
+        self.rows -= rows
+        keys = self._keys_by_event[event_id]
+        keys.discard(key)
+        if not keys:
+            del self._keys_by_event[event_id]
+
+    def invalidate_events(self, event_ids: Iterable[str], bets: bool = True) -> None:
+        """
+        Сбрасывает записи событий.
+
+        :param event_ids: Идентификаторы событий.
+        :param bets: Сбрасывать ли и ставки событий (при расчёте), а не только
+            их списки (при создании ставки).
+        """
+        self._invalidation += 1
+        for event_id in event_ids:
+            if self._inflight:
+                self._invalidated_at[event_id] = self._invalidation
+            for key in list(self._keys_by_event.get(event_id, ())):
+                if bets or key[0] == "event":
+                    self._remove(key)
+
+    @staticmethod
+    def _count(key: CacheKey, result: str) -> None:
+        if METRICS_ENABLED:
+            BET_CACHE_REQUESTS.inc(key[0], result)
+
+
+#: Кэш ставок, используемый приложением
+bet_cache = BetLookupCache()
+
+Gauge("bet_cache_entries", "Количество записей в кэше ставок", lambda: len(bet_cache))
+Gauge("bet_cache_rows", "Количество ставок во всех записях кэша ставок", lambda: bet_cache.rows)
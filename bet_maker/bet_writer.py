@@ -0,0 +1,170 @@
+"""
+Модуль записи ставок в базу данных.
+
+Содержит два варианта записи:
+- insert_bet: одна ставка — одна сессия, commit и refresh (исходный путь).
+- BetBatchWriter: групповая запись (group commit). Конкурентные запросы
+  собираются в пачку в течение короткого окна (или до достижения
+  максимального размера) и вставляются одним многострочным
+  INSERT ... RETURNING в одной транзакции.
+
+В обоих вариантах агрегаты ставок по событиям (event_exposure) обновляются
+в той же транзакции, что и запись ставок.
+"""
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import insert
+from sqlalchemy.orm import sessionmaker
+
+from db import SessionLocal
+from exposure import add_bets_to_exposure
+from models import Bet
+from schemas import BetDB
+
+logger = logging.getLogger("bet_maker")
+
+_PendingBet = Tuple[Dict[str, Any], "asyncio.Future[BetDB]"]
+
+
+async def insert_bet(values: Dict[str, Any]) -> BetDB:
+    """
+    Записывает одну ставку в отдельной сессии.
+
+    :param values: Значения колонок ставки (event_id, amount, coefficient, status).
+    :return: Созданная ставка (BetDB).
+    """
+    new_bet = Bet(**values)
+    async with SessionLocal() as session:
+        session.add(new_bet)
+        await add_bets_to_exposure(session, [values])
+        await session.commit()
+        await session.refresh(new_bet)
+    return BetDB.from_orm(new_bet)
+
+
+class BetBatchWriter:
+    """
+    Групповая запись ставок.
+
+    Каждый вызов submit ставит ставку в очередь и ждёт future. Фоновая задача
+    дожидается первой ставки, затем ещё batch_window секунд (или пока в очереди
+    не наберётся max_batch_size ставок) и записывает накопленное одним запросом.
+    Пока пачка пишется в БД, следующая продолжает накапливаться.
+    """
+
+    def __init__(
+        self,
+        max_batch_size: int = 500,
+        batch_window: float = 0.002,
+        session_factory: sessionmaker = SessionLocal,
+    ) -> None:
+        """
+        :param max_batch_size: Максимальное количество ставок в одном INSERT.
+        :param batch_window: Время накопления пачки в секундах.
+        :param session_factory: Фабрика асинхронных сессий.
+        """
+        self.max_batch_size = max_batch_size
+        self.batch_window = batch_window
+        self._session_factory = session_factory
+        self._pending: List[_PendingBet] = []
+        self._has_pending = asyncio.Event()
+        self._batch_full = asyncio.Event()
+        self._stopping = False
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        """Запускает фоновую задачу записи пачек."""
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """
+        Останавливает фоновую задачу: она дописывает текущую пачку и все
+        ставки, оставшиеся в очереди, без ожидания окна накопления.
+        """
+        self._stopping = True
+        if self._task is not None:
+            # Флаг _has_pending при остановке не сбрасывается, поэтому цикл
+            # не заснёт, пока не опустошит очередь; _batch_full прерывает
+            # уже начатое ожидание окна накопления
+            self._has_pending.set()
+            self._batch_full.set()
+            await self._task
+            self._task = None
+        while self._pending:
+            await self._flush(self._take_batch())
+
+    async def submit(self, values: Dict[str, Any]) -> BetDB:
+        """
+        Ставит ставку в очередь на запись и ждёт её результата.
+
+        :param values: Значения колонок ставки (event_id, amount, coefficient, status).
+        :return: Созданная ставка (BetDB).
+        """
+        future: "asyncio.Future[BetDB]" = asyncio.get_running_loop().create_future()
+        self._pending.append((values, future))
+        self._has_pending.set()
+        if len(self._pending) >= self.max_batch_size:
+            self._batch_full.set()
+        return await future
+
+    def _take_batch(self) -> List[_PendingBet]:
+        """Забирает из очереди не более max_batch_size ставок."""
+        batch = self._pending[:self.max_batch_size]
+        self._pending = self._pending[self.max_batch_size:]
+        if len(self._pending) < self.max_batch_size:
+            self._batch_full.clear()
+        if not self._pending and not self._stopping:
+            self._has_pending.clear()
+        return batch
+
+    async def _run(self) -> None:
+        """Цикл накопления и записи пачек."""
+        while True:
+            await self._has_pending.wait()
+            if not self._pending:
+                # Остановка (stop), очередь пуста
+                return
+            if not self._batch_full.is_set() and not self._stopping:
+                try:
+                    await asyncio.wait_for(self._batch_full.wait(), self.batch_window)
+                except asyncio.TimeoutError:
+                    pass
+            await self._flush(self._take_batch())
+
+    async def _flush(self, batch: List[_PendingBet]) -> None:
+        """
+        Записывает пачку ставок одним INSERT ... RETURNING и разрешает
+        future каждого запроса его собственной ставкой. Если запись не удалась
+        или была отменена, future пачки завершаются с ошибкой.
+
+        :param batch: Пачка ставок с их future.
+        """
+        try:
+            async with self._session_factory() as session:
+                result = await session.execute(
+                    insert(Bet).returning(
+                        Bet.id, Bet.event_id, Bet.amount, Bet.coefficient, Bet.status,
+                        sort_by_parameter_order=True,
+                    ),
+                    [values for values, _ in batch],
+                )
+                rows = result.mappings().all()
+                await add_bets_to_exposure(session, [values for values, _ in batch])
+                await session.commit()
+        except asyncio.CancelledError:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(RuntimeError("Bet batch writer was cancelled"))
+            raise
+        except Exception as exc:
+            logger.exception("Failed to write batch of %d bets.", len(batch))
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(exc)
+            return
+
+        for (_, future), row in zip(batch, rows):
+            if not future.done():
+                future.set_result(BetDB(**row))
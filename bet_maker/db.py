@@ -1,14 +1,37 @@
 """
 Модуль для инициализации соединения с базой данных PostgreSQL 
 с использованием SQLAlchemy (асинхронный вариант).
+
+Схема PostgreSQL управляется миграциями Alembic (alembic.ini, migrations/),
+которые применяются при старте приложения в init_db.
+
+Для бенчмарков и локального запуска без PostgreSQL можно задать
+DATABASE_URL вида sqlite+aiosqlite:///path.db: запросы, использующие
+возможности PostgreSQL, строятся через функции upsert и update_status
+с учётом диалекта.
+
+Пул соединений и кэш подготовленных выражений asyncpg настраиваются
+переменными окружения DB_* (см. _engine_options). При DB_PGBOUNCER=true
+подготовленные выражения не кэшируются и получают уникальные имена —
+это совместимо с PgBouncer в режиме pool_mode=transaction.
 """
 import os
+import time
+import uuid
 import asyncio
-from typing import NoReturn
+from typing import Any, Dict, NoReturn
 
+from alembic import command
+from alembic.config import Config
+from sqlalchemy import String, case, column, event, text, update, values
+from sqlalchemy.engine import Connection
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncEngine, AsyncSession
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, NullPool, QueuePool
+from sqlalchemy.sql import Insert, Update
 
+from metrics import METRICS_ENABLED, Gauge, Histogram
 from models import Base
 
 POSTGRES_HOST: str = os.getenv("POSTGRES_HOST", "localhost")
@@ -17,13 +40,84 @@ POSTGRES_DB: str = os.getenv("POSTGRES_DB", "betsdb")
 POSTGRES_USER: str = os.getenv("POSTGRES_USER", "betuser")
 POSTGRES_PASSWORD: str = os.getenv("POSTGRES_PASSWORD", "betpassword")
 
-DATABASE_URL: str = (
+DATABASE_URL: str = os.getenv("DATABASE_URL") or (
     f"postgresql+asyncpg://{POSTGRES_USER}:{POSTGRES_PASSWORD}"
     f"@{POSTGRES_HOST}:{POSTGRES_PORT}/{POSTGRES_DB}"
 )
 
+#: Конфигурация Alembic (схема PostgreSQL создаётся миграциями)
+ALEMBIC_INI: str = os.path.join(os.path.dirname(os.path.abspath(__file__)), "alembic.ini")
+#: Ключ advisory-блокировки: миграции применяет только один экземпляр приложения
+MIGRATIONS_LOCK_KEY: int = 7_240_017
+
+# Пул соединений (PostgreSQL); DB_POOL_SIZE=0 — без пула (например, за PgBouncer)
+DB_POOL_SIZE: int = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW: int = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT: float = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+# Через сколько секунд соединение пересоздаётся (-1 — никогда)
+DB_POOL_RECYCLE: int = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING: bool = os.getenv("DB_POOL_PRE_PING", "false").lower() in ("1", "true", "yes")
+# Сколько соединений открывается при старте приложения
+DB_POOL_WARMUP: int = int(os.getenv("DB_POOL_WARMUP", str(DB_POOL_SIZE)))
+# Кэш подготовленных выражений: asyncpg (на соединение) и SQLAlchemy
+DB_STATEMENT_CACHE_SIZE: int = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "500"))
+DB_PGBOUNCER: bool = os.getenv("DB_PGBOUNCER", "false").lower() in ("1", "true", "yes")
+
+DB_POOL_WAIT_SECONDS = Histogram(
+    "db_pool_wait_seconds", "Время от запроса соединения у пула до его выдачи",
+)
+
+
+class WaitTimedQueuePool(AsyncAdaptedQueuePool):
+    """
+    Пул соединений, замеряющий ожидание соединения: от запроса до выдачи,
+    включая ожидание свободного соединения, открытие нового и pre-ping.
+    Используется вместо пула по умолчанию при включённых метриках.
+    """
+
+    def connect(self) -> Any:
+        started = time.perf_counter()
+        try:
+            return super().connect()
+        finally:
+            DB_POOL_WAIT_SECONDS.observe(time.perf_counter() - started)
+
+
+def _engine_options() -> Dict[str, Any]:
+    """Параметры create_async_engine для диалекта DATABASE_URL."""
+    if DATABASE_URL.startswith("sqlite"):
+        # SQLite: ждать освобождения блокировки записи, а не падать сразу
+        return {"connect_args": {"timeout": 30}}
+
+    if DB_PGBOUNCER:
+        # PgBouncer может отдать транзакцию другому серверному соединению,
+        # поэтому именованные подготовленные выражения нельзя переиспользовать
+        connect_args = {
+            "statement_cache_size": 0,
+            "prepared_statement_cache_size": 0,
+            "prepared_statement_name_func": lambda: f"__asyncpg_{uuid.uuid4().hex}__",
+        }
+    else:
+        connect_args = {
+            "statement_cache_size": DB_STATEMENT_CACHE_SIZE,
+            "prepared_statement_cache_size": DB_STATEMENT_CACHE_SIZE,
+        }
+
+    if DB_POOL_SIZE <= 0:
+        return {"poolclass": NullPool, "connect_args": connect_args}
+    return {
+        "poolclass": WaitTimedQueuePool if METRICS_ENABLED else AsyncAdaptedQueuePool,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+        "connect_args": connect_args,
+    }
+
+
 #: Асинхронный движок SQLAlchemy для подключения к БД
-engine: AsyncEngine = create_async_engine(DATABASE_URL, echo=False)
+engine: AsyncEngine = create_async_engine(DATABASE_URL, echo=False, **_engine_options())
 
 #: Фабрика для создания асинхронных сессий
 SessionLocal: sessionmaker = sessionmaker(
@@ -31,11 +125,154 @@ SessionLocal: sessionmaker = sessionmaker(
 )
 
 
+DB_CONNECTION_HOLD_SECONDS = Histogram(
+    "db_connection_hold_seconds", "Время от выдачи соединения из пула до его возврата",
+)
+DB_COMMIT_SECONDS = Histogram("db_commit_seconds", "Время commit сессии (включая flush)")
+
+if METRICS_ENABLED:
+    # Обработчики событий регистрируются только при включённых метриках
+
+    @event.listens_for(engine.sync_engine.pool, "checkout")
+    def _on_checkout(dbapi_connection: Any, record: Any, proxy: Any) -> None:
+        record.info["checked_out_at"] = time.perf_counter()
+
+    @event.listens_for(engine.sync_engine.pool, "checkin")
+    def _on_checkin(dbapi_connection: Any, record: Any) -> None:
+        checked_out_at = record.info.pop("checked_out_at", None)
+        if checked_out_at is not None:
+            DB_CONNECTION_HOLD_SECONDS.observe(time.perf_counter() - checked_out_at)
+
+    @event.listens_for(Session, "before_commit")
+    def _on_before_commit(session: Session) -> None:
+        session.info["commit_started_at"] = time.perf_counter()
+
+    @event.listens_for(Session, "after_commit")
+    def _on_after_commit(session: Session) -> None:
+        started = session.info.pop("commit_started_at", None)
+        if started is not None:
+            DB_COMMIT_SECONDS.observe(time.perf_counter() - started)
+
+
+def pool_stats() -> Dict[str, int]:
+    """
+    Состояние пула соединений.
+
+    :return: size (постоянный размер), checked_in (свободные),
+        checked_out (выданные), overflow (сверх постоянного размера);
+        пустой словарь, если пула нет.
+    """
+    pool = engine.sync_engine.pool
+    if not isinstance(pool, QueuePool):
+        return {}
+    return {
+        "size": pool.size(),
+        "checked_in": pool.checkedin(),
+        "checked_out": pool.checkedout(),
+        "overflow": max(0, pool.overflow()),
+    }
+
+
+for _stat in ("size", "checked_in", "checked_out", "overflow"):
+    Gauge(
+        f"db_pool_{_stat}",
+        f"Пул соединений БД: {_stat}",
+        lambda stat=_stat: pool_stats().get(stat, 0),
+    )
+
+
+async def warm_up_pool(connections: int = DB_POOL_WARMUP) -> int:
+    """
+    Открывает соединения пула заранее, чтобы первые запросы после старта
+    не ждали установки соединения.
+
+    :param connections: Сколько соединений открыть (не больше размера пула).
+    :return: Количество открытых соединений.
+    """
+    if not isinstance(engine.sync_engine.pool, QueuePool):
+        return 0
+    connections = min(connections, DB_POOL_SIZE)
+
+    # Соединения удерживаются одновременно, иначе пул выдаст одно и то же
+    opened = await asyncio.gather(
+        *(engine.connect() for _ in range(connections)), return_exceptions=True
+    )
+    conns = [conn for conn in opened if not isinstance(conn, BaseException)]
+    try:
+        await asyncio.gather(*(conn.execute(text("SELECT 1")) for conn in conns))
+    finally:
+        await asyncio.gather(*(conn.close() for conn in conns))
+    return len(conns)
+
+
+def _run_migrations(connection: Connection) -> None:
+    """Применяет миграции Alembic (до head) на переданном соединении."""
+    config = Config(ALEMBIC_INI)
+    config.set_main_option("script_location", os.path.join(os.path.dirname(ALEMBIC_INI), "migrations"))
+    config.attributes["connection"] = connection
+    command.upgrade(config, "head")
+
+
 async def init_db() -> None:
     """
-    Инициализирует базу данных, создавая необходимые таблицы (если они не существуют).
-    Использует модель Base для отражения таблиц в БД.
+    Инициализирует базу данных.
+
+    - PostgreSQL: применяет миграции Alembic (migrations/) под advisory-блокировкой,
+      чтобы одновременно стартующие экземпляры не применяли их параллельно.
+    - SQLite (бенчмарки, локальный запуск): создаёт таблицы и индексы моделей
+      через create_all (если не существуют); секционирования там нет.
     """
     async with engine.begin() as conn:
+        if engine.dialect.name == "postgresql":
+            await conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": MIGRATIONS_LOCK_KEY})
+            await conn.run_sync(_run_migrations)
+            return
+
         # Создаём таблицы (если не существуют)
         await conn.run_sync(Base.metadata.create_all)
+        # create_all не добавляет новые индексы в уже существующие таблицы
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                await conn.run_sync(index.create, checkfirst=True)
+
+
+def upsert(table: Any) -> Insert:
+    """
+    INSERT с поддержкой ON CONFLICT (on_conflict_do_nothing / on_conflict_do_update)
+    для диалекта текущей БД.
+
+    :param table: ORM-модель или таблица.
+    :return: Конструкция INSERT диалекта PostgreSQL или SQLite.
+    """
+    if engine.dialect.name == "sqlite":
+        return sqlite.insert(table)
+    return postgresql.insert(table)
+
+
+def update_status(model: Any, statuses: Dict[str, str]) -> Update:
+    """
+    UPDATE, проставляющий status строкам модели по их event_id.
+
+    В PostgreSQL значения передаются одной таблицей
+    UPDATE ... FROM (VALUES ...) AS v(event_id, status); SQLite не поддерживает
+    список колонок у VALUES, поэтому там используется CASE по event_id.
+
+    :param model: ORM-модель с колонками event_id и status.
+    :param statuses: Новый статус по event_id.
+    :return: Конструкция UPDATE (условия можно дополнить через .where).
+    """
+    if engine.dialect.name == "sqlite":
+        return (
+            update(model)
+            .where(model.event_id.in_(list(statuses)))
+            .values(status=case(statuses, value=model.event_id))
+        )
+
+    settled = values(
+        column("event_id", String), column("status", String), name="settled"
+    ).data(sorted(statuses.items()))
+    return (
+        update(model)
+        .where(model.event_id == settled.c.event_id)
+        .values(status=settled.c.status)
+    )
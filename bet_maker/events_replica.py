@@ -0,0 +1,130 @@
+"""
+Модуль локальной реплики событий line_provider внутри bet_maker.
+
+Реплика целиком загружается из GET /events line_provider при старте
+(и после переподключения к RabbitMQ), а затем поддерживается в актуальном
+состоянии по сообщениям "event.updated", которые line_provider публикует
+при каждом PUT /event. Благодаря этому проверка ставки выполняется
+обращением к словарю в памяти, без сетевого запроса к line_provider.
+
+Сообщения в двоичном формате содержат время изменения (updated_at):
+изменение, которое старее уже применённого к событию (например, сообщение,
+задержавшееся при повторной публикации), отбрасывается.
+"""
+import time
+import logging
+from typing import Dict, Optional, Set
+
+import httpx
+from fastapi import HTTPException
+
+from schemas import Event
+
+logger = logging.getLogger("bet_maker")
+
+
+class EventsReplica:
+    """
+    In-memory копия словаря events из line_provider.
+
+    - events: Текущее состояние событий по event_id.
+    - ready: Признак того, что начальный снимок уже загружен.
+    - transport: HTTP-транспорт для запросов к line_provider (None — сеть;
+      бенчмарк подставляет ASGI-транспорт приложения в том же процессе).
+    """
+
+    def __init__(self) -> None:
+        self.events: Dict[str, Event] = {}
+        self.ready: bool = False
+        self.transport: Optional[httpx.AsyncBaseTransport] = None
+        # Время последнего применённого изменения события (unix time в наносекундах)
+        self._updated_at: Dict[str, int] = {}
+        # event_id, изменённые сообщениями во время загрузки снимка
+        self._touched: Optional[Set[str]] = None
+
+    def apply(self, event: Event, updated_at: Optional[int] = None) -> bool:
+        """
+        Применяет изменение события, полученное из RabbitMQ.
+
+        :param event: Полное актуальное состояние события.
+        :param updated_at: Время изменения (unix time в наносекундах) или None,
+            если сообщение его не содержит (старый формат).
+        :return: False, если изменение старее уже применённого и отброшено.
+        """
+        if updated_at is not None:
+            if updated_at < self._updated_at.get(event.event_id, 0):
+                return False
+            self._updated_at[event.event_id] = updated_at
+        self.events[event.event_id] = event
+        if self._touched is not None:
+            self._touched.add(event.event_id)
+        return True
+
+    async def load_snapshot(self, base_url: str, timeout: float = 10.0) -> int:
+        """
+        Загружает полный снимок событий из line_provider и заменяет им реплику.
+
+        Сообщения об изменениях, пришедшие во время загрузки, новее снимка,
+        поэтому такие события в снимке не перезаписываются.
+
+        :param base_url: Базовый URL line_provider.
+        :param timeout: Таймаут HTTP-запроса в секундах.
+        :return: Количество событий в реплике после загрузки.
+        """
+        self._touched = set()
+        try:
+            async with httpx.AsyncClient(
+                base_url=base_url, timeout=timeout, transport=self.transport
+            ) as client:
+                resp = await client.get("/events")
+                resp.raise_for_status()
+            snapshot = {
+                item["event_id"]: Event.parse_obj(item) for item in resp.json()
+            }
+            for event_id in self._touched:
+                if event_id in self.events:
+                    snapshot[event_id] = self.events[event_id]
+            self.events = snapshot
+            # Времена изменений событий, которых нет в реплике, больше не нужны
+            self._updated_at = {
+                event_id: value for event_id, value in self._updated_at.items() if event_id in snapshot
+            }
+        finally:
+            self._touched = None
+
+        self.ready = True
+        logger.info("Loaded events snapshot: %d events", len(self.events))
+        return len(self.events)
+
+    def check_bet_allowed(self, event_id: str, now: Optional[int] = None) -> Event:
+        """
+        Проверяет, можно ли принять ставку на событие.
+
+        :param event_id: Идентификатор события.
+        :param now: Текущее время (unix timestamp), по умолчанию time.time().
+        :return: Событие из реплики (с коэффициентом на момент ставки).
+        :raises HTTPException 503: если реплика ещё не загружена.
+        :raises HTTPException 404: если событие не найдено.
+        :raises HTTPException 400: если событие не в статусе NEW, дедлайн истёк
+            или у события нет коэффициента.
+        """
+        if not self.ready:
+            raise HTTPException(status_code=503, detail="Events replica is not ready")
+
+        event = self.events.get(event_id)
+        if event is None:
+            raise HTTPException(status_code=404, detail="Event not found")
+        if event.state != "NEW":
+            raise HTTPException(status_code=400, detail="Event is not open for bets")
+
+        if now is None:
+            now = int(time.time())
+        if not event.deadline or event.deadline <= now:
+            raise HTTPException(status_code=400, detail="Event deadline has passed")
+        if event.coefficient is None:
+            raise HTTPException(status_code=400, detail="Event has no coefficient")
+        return event
+
+
+#: Реплика событий, используемая приложением
+replica = EventsReplica()
@@ -0,0 +1,120 @@
+"""
+Модуль агрегатов ставок по событиям (exposure): количество ставок, сумма
+ставок и сумма возможных выплат.
+
+Агрегаты хранятся в таблице event_exposure и обновляются инкрементально
+в тех же транзакциях, что и запись ставок и расчёт событий, поэтому
+GET /events/{id}/exposure читает одну строку по первичному ключу
+независимо от количества ставок.
+"""
+import decimal
+from typing import Any, Dict, Iterable, List
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from db import SessionLocal, engine, update_status, upsert
+from models import EventExposure
+from schemas import EventExposureDB
+
+_ZERO = decimal.Decimal("0")
+
+
+def _exposure_deltas(bets: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Суммирует ставки по событиям.
+
+    :param bets: Значения колонок ставок (event_id, amount, coefficient).
+    :return: Приращения агрегатов, упорядоченные по event_id (единый порядок
+        блокировки строк в конкурентных транзакциях).
+    """
+    deltas: Dict[str, Dict[str, Any]] = {}
+    for bet in bets:
+        delta = deltas.get(bet["event_id"])
+        if delta is None:
+            delta = deltas[bet["event_id"]] = {
+                "event_id": bet["event_id"],
+                "bet_count": 0,
+                "stake_total": _ZERO,
+                "potential_payout": _ZERO,
+            }
+        delta["bet_count"] += 1
+        delta["stake_total"] += bet["amount"]
+        delta["potential_payout"] += bet["amount"] * (bet.get("coefficient") or _ZERO)
+    return [deltas[event_id] for event_id in sorted(deltas)]
+
+
+async def add_bets_to_exposure(session: AsyncSession, bets: Iterable[Dict[str, Any]]) -> None:
+    """
+    Добавляет ставки в агрегаты их событий (в транзакции вызывающего).
+    Для пачки ставок выполняется один INSERT ... ON CONFLICT DO UPDATE.
+
+    :param session: Сессия, в транзакции которой записываются ставки.
+    :param bets: Значения колонок записанных ставок.
+    """
+    deltas = _exposure_deltas(bets)
+    if not deltas:
+        return
+
+    stmt = upsert(EventExposure).values(deltas)
+    await session.execute(
+        stmt.on_conflict_do_update(
+            index_elements=[EventExposure.event_id],
+            set_={
+                "bet_count": EventExposure.bet_count + stmt.excluded.bet_count,
+                "stake_total": EventExposure.stake_total + stmt.excluded.stake_total,
+                "potential_payout": EventExposure.potential_payout + stmt.excluded.potential_payout,
+            },
+        )
+    )
+
+
+async def settle_exposure(session: AsyncSession, settlements: Dict[str, str]) -> None:
+    """
+    Проставляет статус рассчитанным событиям в агрегатах (в транзакции вызывающего).
+
+    :param session: Сессия, в транзакции которой рассчитываются ставки.
+    :param settlements: Новый статус ставок ("WIN"/"LOSE") по event_id.
+    """
+    await session.execute(
+        update_status(EventExposure, settlements)
+        .execution_options(synchronize_session=False)
+    )
+
+
+async def get_exposure(event_id: str) -> EventExposureDB:
+    """
+    Возвращает агрегат ставок по событию.
+
+    :param event_id: Идентификатор события.
+    :return: Агрегат (нулевой, если ставок на событие нет).
+    """
+    async with SessionLocal() as session:
+        exposure = await session.get(EventExposure, event_id)
+    if exposure is None:
+        return EventExposureDB(event_id=event_id)
+    return EventExposureDB.from_orm(exposure)
+
+
+async def backfill_exposure() -> None:
+    """
+    Заполняет агрегаты по уже существующим ставкам, если таблица
+    event_exposure пуста (например, сразу после её создания).
+    """
+    async with engine.begin() as conn:
+        await conn.execute(text(
+            """
+            INSERT INTO event_exposure (event_id, bet_count, stake_total, potential_payout, status)
+            SELECT event_id, count(*), sum(amount),
+                   sum(amount * coalesce(coefficient, 0)),
+                   CASE WHEN max(CASE WHEN status = 'NEW' THEN 1 ELSE 0 END) = 1 THEN 'NEW' ELSE max(status) END
+            FROM (
+                SELECT event_id, amount, coefficient, status FROM bets
+                UNION ALL
+                SELECT event_id, amount, coefficient, status FROM bets_archive
+            ) AS all_bets
+            WHERE NOT EXISTS (SELECT 1 FROM event_exposure)
+            GROUP BY event_id
+            ON CONFLICT (event_id) DO NOTHING
+            """
+        ))
@@ -0,0 +1,84 @@
+"""
+Модуль условных GET-запросов (ETag / If-None-Match).
+
+ETag строится из содержимого ответа, а не из счётчиков процесса, поэтому
+одинаковые данные получают одинаковый ETag в любом воркере и экземпляре
+сервиса, и 304 возвращается независимо от того, какой процесс ответил.
+"""
+import hashlib
+from typing import Iterable, Optional
+
+from fastapi import Response
+
+
+def digest(body: bytes) -> int:
+    """
+    64-битный хэш содержимого (BLAKE2b).
+
+    :param body: Содержимое.
+    :return: Хэш в виде целого числа.
+    """
+    return int.from_bytes(hashlib.blake2b(body, digest_size=8).digest(), "big")
+
+
+def content_etag(body: bytes) -> str:
+    """
+    Сильный ETag содержимого.
+
+    :param body: Сериализованный ответ.
+    :return: ETag в кавычках.
+    """
+    return digest_etag(digest(body))
+
+
+def digest_etag(value: int) -> str:
+    """
+    Сильный ETag по уже посчитанному хэшу содержимого (digest).
+
+    :param value: Хэш содержимого.
+    :return: ETag в кавычках (тот же, что content_etag для этого содержимого).
+    """
+    return f'"{value:016x}"'
+
+
+def set_etag(digests: Iterable[int]) -> str:
+    """
+    Слабый ETag множества элементов по хэшам их содержимого. Не зависит
+    от порядка элементов: ответ с тем же множеством в другом порядке
+    семантически равен, поэтому ETag слабый.
+
+    :param digests: Хэши элементов (digest); элементы не повторяются.
+    :return: ETag вида W/"...".
+    """
+    combined = 0
+    count = 0
+    for value in digests:
+        combined ^= value
+        count += 1
+    return f'W/"{count:x}-{combined:016x}"'
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """Проверяет, содержит ли If-None-Match данный ETag (слабое сравнение)."""
+    if if_none_match.strip() == "*":
+        return True
+    etag = etag.removeprefix("W/")
+    return any(
+        candidate.strip().removeprefix("W/") == etag for candidate in if_none_match.split(",")
+    )
+
+
+def cached_json_response(body: bytes, etag: Optional[str], if_none_match: Optional[str]) -> Response:
+    """
+    Ответ с готовым JSON и ETag или 304, если клиент уже получил эту версию.
+
+    :param body: Сериализованный JSON.
+    :param etag: ETag версии данных (None — ответ без ETag).
+    :param if_none_match: Значение заголовка If-None-Match запроса.
+    :return: Ответ 200 с телом или 304 без тела.
+    """
+    if etag is None:
+        return Response(content=body, media_type="application/json")
+    if if_none_match is not None and etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(content=body, media_type="application/json", headers={"ETag": etag})
@@ -0,0 +1,215 @@
+"""
+Модуль идемпотентности POST /bet (заголовок Idempotency-Key).
+
+- В БД ключ записывается в таблицу bet_idempotency_keys в одной транзакции
+  со ставкой; первичный ключ по key не даёт создать вторую ставку по тому же
+  ключу, в том числе другим экземплярам bet_maker и после перезапуска.
+- В памяти процесса IdempotencyCache хранит ограниченный LRU недавних ключей,
+  поэтому повтор запроса отвечается без обращения к БД, а одновременные
+  запросы с одним ключом ждут одну и ту же запись в БД.
+
+Повтор ключа с другим телом запроса отклоняется (422).
+
+Повтор отвечает тем же, что и исходный запрос: ставкой в момент создания
+(статус NEW), а не текущей строкой, иначе ответ зависел бы от того, нашёлся
+ключ в памяти или в БД. У ставки после создания меняется только статус,
+поэтому снимок из БД — текущая строка со статусом NEW_BET_STATUS. Текущее
+состояние ставки возвращает GET /bet/{id}.
+"""
+import asyncio
+import hashlib
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+from db import SessionLocal, upsert
+from exposure import add_bets_to_exposure
+from metrics import METRICS_ENABLED, Counter
+from models import Bet, BetArchive, BetIdempotencyKey
+from schemas import BetCreate, BetDB
+
+#: Результат: ставка и признак повтора (ставка создана раньше)
+IdempotentResult = Tuple[BetDB, bool]
+
+#: Статус, с которым создаются ставки (до расчёта события)
+NEW_BET_STATUS: str = "NEW"
+
+IDEMPOTENT_REQUESTS = Counter(
+    "bet_idempotent_requests_total", "Запросы POST /bet с Idempotency-Key по результату", ("result",),
+)
+
+
+def request_hash(bet_data: BetCreate) -> str:
+    """
+    Хэш тела запроса POST /bet (сумма нормализуется: 10.5 и 10.50 совпадают).
+
+    :param bet_data: Данные ставки.
+    :return: Шестнадцатеричный SHA-256.
+    """
+    payload = f"{bet_data.event_id}\x00{bet_data.amount.normalize()}"
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _mismatch() -> HTTPException:
+    return HTTPException(
+        status_code=422, detail="Idempotency-Key has already been used with a different request"
+    )
+
+
+async def load_bet(session: AsyncSession, bet_id: int) -> Optional[BetDB]:
+    """
+    Ставка по id из bets или (если уже перенесена) из bets_archive.
+
+    :param session: Асинхронная сессия.
+    :param bet_id: Идентификатор ставки.
+    :return: Ставка или None, если её нет.
+    """
+    for model in (Bet, BetArchive):
+        row = (
+            await session.execute(
+                select(model.id, model.event_id, model.amount, model.coefficient, model.status)
+                .where(model.id == bet_id)
+            )
+        ).mappings().first()
+        if row is not None:
+            return BetDB(**row)
+    return None
+
+
+async def insert_bet_idempotent(
+    make_values: Callable[[], Dict[str, Any]],
+    key: str,
+    hashed_request: str,
+    session_factory: sessionmaker = SessionLocal,
+) -> IdempotentResult:
+    """
+    Записывает ставку вместе с ключом идемпотентности либо возвращает
+    ставку, уже созданную по этому ключу.
+
+    Ключ вставляется с ON CONFLICT DO NOTHING в транзакции ставки: если его
+    одновременно вставил другой экземпляр, транзакция откатывается
+    и возвращается его ставка.
+
+    :param make_values: Возвращает значения колонок ставки (event_id, amount,
+        coefficient, status); вызывается, только если ключа ещё нет, поэтому
+        повтор отвечается и после закрытия события.
+    :param key: Значение заголовка Idempotency-Key.
+    :param hashed_request: Хэш тела запроса (request_hash).
+    :param session_factory: Фабрика асинхронных сессий.
+    :return: Ставка и признак повтора; при повторе — ставка в момент создания,
+        даже если событие уже рассчитано.
+    :raises HTTPException 422: если ключ использован с другим телом запроса.
+    """
+    async with session_factory() as session:
+        existing = await session.get(BetIdempotencyKey, key)
+        if existing is None:
+            values = make_values()
+            new_bet = Bet(**values)
+            session.add(new_bet)
+            await session.flush()
+            inserted = await session.execute(
+                upsert(BetIdempotencyKey)
+                .values(key=key, bet_id=new_bet.id, request_hash=hashed_request)
+                .on_conflict_do_nothing(index_elements=[BetIdempotencyKey.key])
+                .returning(BetIdempotencyKey.key)
+            )
+            if inserted.first() is not None:
+                await add_bets_to_exposure(session, [values])
+                await session.commit()
+                # Ответ строится из записанной строки, как и при повторе по ключу
+                await session.refresh(new_bet)
+                return BetDB.from_orm(new_bet), False
+
+            await session.rollback()
+            existing = await session.get(BetIdempotencyKey, key)
+
+        if existing.request_hash != hashed_request:
+            raise _mismatch()
+        bet = await load_bet(session, existing.bet_id)
+        if bet is None:
+            raise HTTPException(status_code=409, detail="Bet for this Idempotency-Key no longer exists")
+        return bet.copy(update={"status": NEW_BET_STATUS}), True
+
+
+class IdempotencyCache:
+    """
+    Недавние ключи идемпотентности в памяти процесса (LRU) и запросы,
+    которые выполняются прямо сейчас.
+
+    LRU хранит ставку в момент создания — тот же ответ, что возвращает
+    повтор из БД (insert_bet_idempotent), поэтому ответ не зависит от того,
+    где нашёлся ключ.
+
+    Запись в БД по ключу выполняется отдельной задачей: одновременные запросы
+    с тем же ключом ждут её результата, а отключение клиента, начавшего
+    запись, её не прерывает.
+    """
+
+    def __init__(self, max_size: int = 10000) -> None:
+        """
+        :param max_size: Максимальное количество ключей в LRU.
+        """
+        self.max_size = max_size
+        self._recent: "OrderedDict[str, Tuple[str, BetDB]]" = OrderedDict()
+        self._inflight: Dict[str, Tuple[str, "asyncio.Task[IdempotentResult]"]] = {}
+
+    def __len__(self) -> int:
+        return len(self._recent)
+
+    async def get_or_create(
+        self,
+        key: str,
+        hashed_request: str,
+        create: Callable[[], Awaitable[IdempotentResult]],
+    ) -> IdempotentResult:
+        """
+        Возвращает ставку по ключу из памяти, из выполняющегося запроса
+        с тем же ключом или создаёт её вызовом create.
+
+        :param key: Значение заголовка Idempotency-Key.
+        :param hashed_request: Хэш тела запроса (request_hash).
+        :param create: Запись ставки в БД (insert_bet_idempotent).
+        :return: Ставка и признак повтора.
+        :raises HTTPException 422: если ключ использован с другим телом запроса.
+        """
+        cached = self._recent.get(key)
+        if cached is not None:
+            self._recent.move_to_end(key)
+            if cached[0] != hashed_request:
+                raise _mismatch()
+            self._count("memory")
+            return cached[1], True
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            if inflight[0] != hashed_request:
+                raise _mismatch()
+            self._count("coalesced")
+            bet, _ = await asyncio.shield(inflight[1])
+            return bet, True
+
+        task = asyncio.create_task(create())
+        self._inflight[key] = (hashed_request, task)
+        task.add_done_callback(lambda done: self._finish(key, hashed_request, done))
+        bet, replayed = await asyncio.shield(task)
+        self._count("database" if replayed else "created")
+        return bet, replayed
+
+    def _finish(self, key: str, hashed_request: str, task: "asyncio.Task[IdempotentResult]") -> None:
+        """Убирает ключ из выполняющихся и запоминает результат успешной записи."""
+        self._inflight.pop(key, None)
+        if task.cancelled() or task.exception() is not None:
+            return
+        self._recent[key] = (hashed_request, task.result()[0])
+        self._recent.move_to_end(key)
+        while len(self._recent) > self.max_size:
+            self._recent.popitem(last=False)
+
+    @staticmethod
+    def _count(result: str) -> None:
+        if METRICS_ENABLED:
+            IDEMPOTENT_REQUESTS.inc(result)
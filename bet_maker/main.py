@@ -5,17 +5,33 @@
 - Предоставляет эндпоинты для CRUD-операций со ставками.
 """
 import os
+import time
 import asyncio
 import logging
-from typing import List, Set, Dict, Any
+from typing import List, Dict, Any, Optional, AsyncIterator
 
-from fastapi import FastAPI, HTTPException
-from sqlalchemy import select, update
+from fastapi import FastAPI, Header, HTTPException, Query, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select, union_all
+from sqlalchemy.sql import Select
 from aio_pika import connect_robust, IncomingMessage, ExchangeType
 
-from db import init_db, SessionLocal
-from models import Bet
-from schemas import BetCreate, BetDB
+from db import init_db, pool_stats, warm_up_pool, SessionLocal
+from models import Bet, BetArchive
+from archive import BetArchiver
+from schemas import BetCreate, BetDB, Event, EventExposureDB
+from events_replica import replica
+from bet_writer import BetBatchWriter, insert_bet
+from idempotency import NEW_BET_STATUS, IdempotencyCache, insert_bet_idempotent, load_bet, request_hash
+from active_events import active_events_cache
+from bet_cache import bet_cache
+from http_cache import cached_json_response
+from exposure import backfill_exposure, get_exposure
+from settlement import (
+    SETTLEMENT_MESSAGE_SECONDS, SettlementEngine, SettlementRetrier, parse_finish_message, settle_events,
+)
+import metrics
+import protocol
 
 # Логгер
 logger = logging.getLogger("bet_maker")
@@ -25,80 +41,377 @@ RABBITMQ_HOST: str = os.getenv("RABBITMQ_HOST", "rabbitmq")
 RABBITMQ_PORT: int = int(os.getenv("RABBITMQ_PORT", "5672"))
 EXCHANGE_NAME: str = "events_exchange"
 QUEUE_NAME: str = "events.finished"
+DEAD_LETTER_QUEUE_NAME: str = "events.finished.dlq"
 ROUTING_KEY: str = "event.finished"
+UPDATED_ROUTING_KEY: str = "event.updated"
+ENVELOPE_ROUTING_KEY: str = "event.finished.v1"
+ENVELOPE_UPDATED_ROUTING_KEY: str = "event.updated.v1"
+ENVELOPE_CLOSED_ROUTING_KEY: str = "event.closed.v1"
+# Формат сообщений line_provider, на которые подписывается bet_maker:
+# legacy ("event_id:STATE" и JSON) или envelope (двоичные конверты, protocol.py).
+# По умолчанию legacy: его line_provider публикует всегда, а при envelope очередь
+# отвязывается от event.finished — включать его можно, только когда line_provider
+# уже публикует конверты, иначе сообщения о завершении будут потеряны
+EVENT_MESSAGE_FORMAT: str = os.getenv("EVENT_MESSAGE_FORMAT", "legacy")
+LINE_PROVIDER_URL: str = os.getenv("LINE_PROVIDER_URL", "http://line_provider:8000")
+
+# Размер страницы /bets по умолчанию и его верхняя граница
+BETS_PAGE_SIZE: int = int(os.getenv("BETS_PAGE_SIZE", "100"))
+BETS_MAX_PAGE_SIZE: int = int(os.getenv("BETS_MAX_PAGE_SIZE", "1000"))
+# Сколько строк за раз вычитывается из серверного курсора в режиме стриминга
+BETS_STREAM_CHUNK: int = int(os.getenv("BETS_STREAM_CHUNK", "1000"))
+
+# Групповая запись ставок (POST /bet): включается явно
+BET_BATCHING_ENABLED: bool = os.getenv("BET_BATCHING_ENABLED", "false").lower() in ("1", "true", "yes")
+BET_BATCH_WINDOW_MS: float = float(os.getenv("BET_BATCH_WINDOW_MS", "2"))
+BET_BATCH_MAX_SIZE: int = int(os.getenv("BET_BATCH_MAX_SIZE", "500"))
+
+# Перенос рассчитанных ставок в bets_archive (см. archive.py)
+BETS_ARCHIVE_ENABLED: bool = os.getenv("BETS_ARCHIVE_ENABLED", "true").lower() in ("1", "true", "yes")
+BETS_ARCHIVE_INTERVAL_SECONDS: float = float(os.getenv("BETS_ARCHIVE_INTERVAL_SECONDS", "60"))
+BETS_ARCHIVE_AFTER_SECONDS: float = float(os.getenv("BETS_ARCHIVE_AFTER_SECONDS", "3600"))
+BETS_ARCHIVE_BATCH_SIZE: int = int(os.getenv("BETS_ARCHIVE_BATCH_SIZE", "5000"))
+# На сколько месяцев вперёд создаются секции bets и bets_archive
+BETS_PARTITION_MONTHS_AHEAD: int = int(os.getenv("BETS_PARTITION_MONTHS_AHEAD", "2"))
+
+# Идемпотентность POST /bet (заголовок Idempotency-Key, см. idempotency.py)
+BET_IDEMPOTENCY_CACHE_SIZE: int = int(os.getenv("BET_IDEMPOTENCY_CACHE_SIZE", "10000"))
+# Сколько хранятся ключи в БД (удаляются задачей архивации)
+BET_IDEMPOTENCY_KEY_TTL_SECONDS: float = float(os.getenv("BET_IDEMPOTENCY_KEY_TTL_SECONDS", "86400"))
+
+# Пакетный расчёт ставок по сообщениям event.finished
+SETTLEMENT_PREFETCH: int = int(os.getenv("SETTLEMENT_PREFETCH", "100"))
+SETTLEMENT_BATCH_SIZE: int = int(os.getenv("SETTLEMENT_BATCH_SIZE", str(SETTLEMENT_PREFETCH)))
+SETTLEMENT_BATCH_WINDOW_MS: float = float(os.getenv("SETTLEMENT_BATCH_WINDOW_MS", "10"))
+# Сколько раз повторяется сообщение, прежде чем попасть в dead-letter очередь
+SETTLEMENT_MAX_RETRIES: int = int(os.getenv("SETTLEMENT_MAX_RETRIES", "5"))
+# Задержка перед первым повтором; каждая следующая вдвое больше, но не больше максимальной
+SETTLEMENT_RETRY_DELAY_MS: float = float(os.getenv("SETTLEMENT_RETRY_DELAY_MS", "1000"))
+SETTLEMENT_RETRY_MAX_DELAY_MS: float = float(os.getenv("SETTLEMENT_RETRY_MAX_DELAY_MS", "60000"))
 
 app = FastAPI()
+metrics.install(app)
+
+#: Групповая запись ставок (None, если выключена)
+bet_writer: Optional[BetBatchWriter] = None
+#: Архивация рассчитанных ставок (None, если выключена)
+bet_archiver: Optional[BetArchiver] = None
+#: Недавние ключи идемпотентности POST /bet
+idempotency_cache = IdempotencyCache(max_size=BET_IDEMPOTENCY_CACHE_SIZE)
+#: Повторы и dead-letter для сообщений о завершении (создаётся при подключении к RabbitMQ)
+settlement_retrier: Optional[SettlementRetrier] = None
+#: Пакетный расчёт сообщений о завершении (создаётся при подключении к RabbitMQ)
+settlement_engine: Optional[SettlementEngine] = None
 
 
 @app.on_event("startup")
 async def on_startup() -> None:
     """
     Хук, вызывающийся при старте приложения. 
-    - Инициализирует базу данных.
+    - Инициализирует базу данных и заранее открывает соединения пула.
+    - Запускает групповую запись ставок (если включена).
+    - Запускает архивацию рассчитанных ставок (если включена).
     - Запускает задачу прослушивания очереди RabbitMQ.
     """
+    global bet_writer, bet_archiver
+
     # Инициализация БД
     await init_db()
+    await backfill_exposure()
+    warmed = await warm_up_pool()
+    logger.info("Warmed up %d DB connections, pool: %s", warmed, pool_stats())
+
+    if BET_BATCHING_ENABLED:
+        bet_writer = BetBatchWriter(
+            max_batch_size=BET_BATCH_MAX_SIZE,
+            batch_window=BET_BATCH_WINDOW_MS / 1000,
+        )
+        bet_writer.start()
+
+    if BETS_ARCHIVE_ENABLED:
+        bet_archiver = BetArchiver(
+            interval=BETS_ARCHIVE_INTERVAL_SECONDS,
+            archive_after=BETS_ARCHIVE_AFTER_SECONDS,
+            batch_size=BETS_ARCHIVE_BATCH_SIZE,
+            months_ahead=BETS_PARTITION_MONTHS_AHEAD,
+            idempotency_key_ttl=BET_IDEMPOTENCY_KEY_TTL_SECONDS,
+        )
+        bet_archiver.start()
 
     # Подключение к RabbitMQ + запуск фонового consume
     asyncio.create_task(consume_events())
 
 
+@app.on_event("shutdown")
+async def on_shutdown() -> None:
+    """
+    Хук, вызывающийся при остановке приложения.
+    Рассчитывает накопленные сообщения о завершении, останавливает архивацию
+    и дописывает в БД ставки, накопленные групповой записью.
+    """
+    if settlement_engine is not None:
+        await settlement_engine.stop()
+    if bet_archiver is not None:
+        await bet_archiver.stop()
+    if bet_writer is not None:
+        await bet_writer.stop()
+
+
+async def load_active_events() -> List[str]:
+    """
+    Выбирает из БД идентификаторы событий, у которых есть хотя бы одна
+    ставка в статусе "NEW". Дедупликация выполняется в БД (SELECT DISTINCT)
+    по частичному индексу ix_bets_new_event_id.
+
+    :return: Список ID активных событий.
+    """
+    async with SessionLocal() as session:
+        result = await session.execute(
+            select(Bet.event_id).where(Bet.status == "NEW").distinct()
+        )
+        return list(result.scalars().all())
+
+
 @app.get("/events")
-async def get_active_events() -> Dict[str, List[str]]:
+async def get_active_events(if_none_match: Optional[str] = Header(None)) -> Response:
     """
     Возвращает список событий, у которых есть хотя бы одна ставка 
     в статусе "NEW". (Упрощённая логика определения активных событий.)
 
+    Ответ (готовый JSON) берётся из in-process кэша, который обновляется
+    при создании ставок и расчёте событий; БД запрашивается только при промахе.
+    Ответ содержит ETag; при совпадении If-None-Match возвращается 304 без тела.
+
+    :param if_none_match: ETag ранее полученного ответа.
     :return: Словарь с ключом "active_events" и списком ID событий.
     """
-    async with SessionLocal() as session:
-        # Выбираем события, у которых есть ставки в статусе NEW
-        result = await session.execute(
-            select(Bet.event_id).where(Bet.status == "NEW")
-        )
-        active_event_ids: Set[str] = set(row[0] for row in result.all())
+    body, etag = await active_events_cache.get_json(load_active_events)
+    return cached_json_response(body, etag, if_none_match)
 
-    return {"active_events": list(active_event_ids)}
+
+@app.get("/events/{event_id}/exposure", response_model=EventExposureDB)
+async def get_event_exposure(event_id: str) -> EventExposureDB:
+    """
+    Возвращает агрегат ставок по событию: количество ставок, сумму ставок
+    и сумму возможных выплат. Агрегат поддерживается инкрементально,
+    поэтому запрос не зависит от количества ставок.
+
+    :param event_id: Идентификатор события.
+    :return: Агрегат ставок (EventExposureDB).
+    """
+    return await get_exposure(event_id)
 
 
 @app.post("/bet", response_model=BetDB)
-async def create_bet(bet_data: BetCreate) -> BetDB:
+async def create_bet(
+    bet_data: BetCreate,
+    response: Response,
+    idempotency_key: Optional[str] = Header(None, max_length=255),
+) -> BetDB:
     """
     Создаёт новую ставку (Bet) в базе данных.
+    При BET_BATCHING_ENABLED ставка записывается групповой записью
+    вместе с другими конкурентными запросами.
+
+    С заголовком Idempotency-Key по одному ключу создаётся не больше одной
+    ставки: повтор запроса (в том числе одновременный) возвращает ранее
+    созданную ставку в момент создания (статус NEW, как в исходном ответе)
+    с заголовком Idempotent-Replayed: true. Такие ставки
+    записываются отдельной транзакцией вместе с ключом, минуя групповую запись.
 
     :param bet_data: Данные для создания ставки (event_id, amount).
+    :param response: Ответ (для заголовка Idempotent-Replayed).
+    :param idempotency_key: Ключ идемпотентности клиента.
     :return: Созданная ставка (BetDB).
+    :raises HTTPException: если событие не существует или ставки на него не принимаются;
+        422, если ключ уже использован с другим телом запроса.
     """
-    # Здесь можно добавить дополнительные проверки:
-    # 1) Существует ли такое событие (либо кэш, либо запрос к line_provider).
-    # 2) Не истёк ли дедлайн.
-    # и т.д.
-    new_bet = Bet(
-        event_id=bet_data.event_id,
-        amount=bet_data.amount,
-        status="NEW"
-    )
+    if idempotency_key is not None:
+        hashed_request = request_hash(bet_data)
+        bet, replayed = await idempotency_cache.get_or_create(
+            idempotency_key,
+            hashed_request,
+            lambda: insert_bet_idempotent(
+                lambda: _new_bet_values(bet_data), idempotency_key, hashed_request
+            ),
+        )
+        if replayed:
+            response.headers["Idempotent-Replayed"] = "true"
+        else:
+            active_events_cache.add(bet.event_id)
+            bet_cache.invalidate_events([bet.event_id], bets=False)
+        return bet
 
-    async with SessionLocal() as session:
-        session.add(new_bet)
-        await session.commit()
-        await session.refresh(new_bet)
+    values = _new_bet_values(bet_data)
+    if bet_writer is not None:
+        bet = await bet_writer.submit(values)
+    else:
+        bet = await insert_bet(values)
 
-    return BetDB.from_orm(new_bet)
+    active_events_cache.add(bet.event_id)
+    bet_cache.invalidate_events([bet.event_id], bets=False)
+    return bet
 
 
-@app.get("/bets", response_model=List[BetDB])
-async def get_bets() -> List[BetDB]:
+def _new_bet_values(bet_data: BetCreate) -> Dict[str, Any]:
+    """
+    Значения колонок новой ставки.
+
+    :param bet_data: Данные ставки.
+    :return: Словарь event_id, amount, coefficient, status.
+    :raises HTTPException: если событие не существует или ставки на него не принимаются.
     """
-    Возвращает полную историю всех ставок (Bet) из базы данных.
+    # Событие проверяется по локальной реплике: существует, в статусе NEW,
+    # дедлайн не наступил, коэффициент известен.
+    event = replica.check_bet_allowed(bet_data.event_id)
+
+    return {
+        "event_id": bet_data.event_id,
+        "amount": bet_data.amount,
+        # Коэффициент фиксируется на момент ставки
+        "coefficient": event.coefficient,
+        "status": NEW_BET_STATUS,
+    }
+
+
+@app.get("/bet/{bet_id}", response_model=BetDB)
+async def get_bet(bet_id: int) -> BetDB:
+    """
+    Возвращает ставку по id (в том числе перенесённую в архив).
+    Ставка читается через кэш ставок (bet_cache.py).
+
+    :param bet_id: Идентификатор ставки.
+    :return: Ставка (BetDB).
+    :raises HTTPException 404: если ставки нет.
+    """
+    async def load() -> Optional[BetDB]:
+        async with SessionLocal() as session:
+            return await load_bet(session, bet_id)
+
+    bet = await bet_cache.get_bet(bet_id, load)
+    if bet is None:
+        raise HTTPException(status_code=404, detail="Bet not found")
+    return bet
+
 
-    :return: Список всех ставок в формате BetDB.
+async def load_event_bets(event_id: str) -> List[BetDB]:
     """
+    Выбирает первые BETS_MAX_PAGE_SIZE + 1 ставок события (по id):
+    этого достаточно для первой страницы GET /bets?event_id= любого размера
+    и признака следующей страницы.
+
+    :param event_id: Идентификатор события.
+    :return: Список ставок.
+    """
+    stmt = _bets_query(None, event_id, None).limit(BETS_MAX_PAGE_SIZE + 1)
     async with SessionLocal() as session:
-        result = await session.execute(select(Bet))
-        bets = result.scalars().all()
-    return [BetDB.from_orm(b) for b in bets]
+        rows = (await session.execute(stmt)).mappings().all()
+    return [BetDB(**row) for row in rows]
+
+
+def _bets_query(
+    after_id: Optional[int],
+    event_id: Optional[str],
+    status: Optional[str],
+) -> Select:
+    """
+    Строит запрос к ставкам с keyset-пагинацией по id.
+
+    Выбираются только нужные колонки (без ORM-объектов), строки
+    упорядочены по id, что позволяет продолжать выборку с курсора after_id.
+    Ставки читаются из горячей таблицы bets и из архива bets_archive
+    (UNION ALL); для status=NEW архив не читается — там только рассчитанные ставки.
+    id ставки при архивации не меняется, поэтому курсор остаётся корректным.
+
+    :param after_id: Курсор — id последней полученной ставки (не включительно).
+    :param event_id: Фильтр по идентификатору события.
+    :param status: Фильтр по статусу ставки.
+    :return: SQLAlchemy Select.
+    """
+    tables = [Bet] if status == "NEW" else [Bet, BetArchive]
+    parts = []
+    for table in tables:
+        part = select(table.id, table.event_id, table.amount, table.coefficient, table.status)
+        if after_id is not None:
+            part = part.where(table.id > after_id)
+        if event_id is not None:
+            part = part.where(table.event_id == event_id)
+        if status is not None:
+            part = part.where(table.status == status)
+        parts.append(part)
+
+    if len(parts) == 1:
+        return parts[0].order_by(Bet.id)
+    all_bets = union_all(*parts).subquery("all_bets")
+    return select(all_bets).order_by(all_bets.c.id)
+
+
+async def _stream_bets(stmt: Select) -> AsyncIterator[bytes]:
+    """
+    Генератор NDJSON-строк для потоковой выдачи ставок.
+
+    Использует серверный курсор (session.stream + yield_per), поэтому
+    в памяти одновременно находится не более BETS_STREAM_CHUNK строк.
+
+    :param stmt: Запрос, построенный _bets_query.
+    :return: Асинхронный итератор кусков NDJSON (по одной ставке на строку).
+    """
+    async with SessionLocal() as session:
+        result = await session.stream(
+            stmt.execution_options(yield_per=BETS_STREAM_CHUNK)
+        )
+        async for rows in result.mappings().partitions():
+            yield "".join(BetDB(**row).json() + "\n" for row in rows).encode()
+
+
+@app.get("/bets", response_model=List[BetDB])
+async def get_bets(
+    response: Response,
+    after_id: Optional[int] = Query(None, ge=0, description="Курсор: id последней полученной ставки"),
+    limit: Optional[int] = Query(None, gt=0, le=BETS_MAX_PAGE_SIZE, description="Размер страницы"),
+    event_id: Optional[str] = Query(None, description="Фильтр по событию"),
+    status: Optional[str] = Query(None, regex="^(NEW|WIN|LOSE)$", description="Фильтр по статусу"),
+    stream: bool = Query(False, description="Потоковая выдача в формате NDJSON"),
+) -> Any:
+    """
+    Возвращает историю ставок (Bet) с keyset-пагинацией по id.
+
+    - В обычном режиме отдаёт не более limit ставок (по умолчанию BETS_PAGE_SIZE).
+      Если есть следующая страница, её курсор передаётся в заголовке X-Next-Cursor
+      (значение подставляется в параметр after_id следующего запроса).
+    - При stream=true отдаёт все подходящие ставки потоком NDJSON
+      (application/x-ndjson), limit в этом режиме необязателен.
+    - Первая страница ставок события (только event_id, без курсора и статуса)
+      отдаётся из кэша ставок (bet_cache.py).
+
+    :param after_id: Курсор — id последней полученной ставки.
+    :param limit: Максимальное количество ставок в ответе.
+    :param event_id: Фильтр по идентификатору события.
+    :param status: Фильтр по статусу ставки (NEW, WIN, LOSE).
+    :param stream: Включить потоковую выдачу NDJSON.
+    :return: Список ставок в формате BetDB либо поток NDJSON.
+    """
+    stmt = _bets_query(after_id, event_id, status)
+
+    if stream:
+        if limit is not None:
+            stmt = stmt.limit(limit)
+        return StreamingResponse(_stream_bets(stmt), media_type="application/x-ndjson")
+
+    page_size = limit or BETS_PAGE_SIZE
+    if event_id is not None and after_id is None and status is None:
+        rows = await bet_cache.get_event_bets(event_id, lambda: load_event_bets(event_id))
+        bets = rows[:page_size]
+    else:
+        async with SessionLocal() as session:
+            # Запрашиваем на одну строку больше, чтобы понять, есть ли следующая страница
+            result = await session.execute(stmt.limit(page_size + 1))
+            rows = result.mappings().all()
+        bets = [BetDB(**row) for row in rows[:page_size]]
+
+    if len(rows) > page_size:
+        response.headers["X-Next-Cursor"] = str(bets[-1].id)
+    return bets
 
 
 async def consume_events() -> None:
@@ -106,26 +419,76 @@ async def consume_events() -> None:
     Фоновая задача, подключающаяся к RabbitMQ, создаёт очередь 
     и подписывается на сообщения о завершении событий (event.finished).
 
-    При получении каждого сообщения вызывается колбэк on_event_finished.
+    Сообщения рассчитываются пачками (SettlementEngine), до SETTLEMENT_PREFETCH
+    неподтверждённых сообщений одновременно. Если пачка не прошла, каждое её
+    сообщение обрабатывается колбэком on_event_finished по отдельности.
+    Неудавшиеся сообщения повторяются с экспоненциальной задержкой
+    (от SETTLEMENT_RETRY_DELAY_MS до SETTLEMENT_RETRY_MAX_DELAY_MS); не обработанные
+    за SETTLEMENT_MAX_RETRIES попыток перекладываются в очередь DEAD_LETTER_QUEUE_NAME.
+
+    Также подписывается на изменения событий (event.updated) для локальной
+    реплики и загружает её начальный снимок из line_provider.
     """
+    global settlement_retrier, settlement_engine
+
     try:
         connection = await connect_robust(
             host=RABBITMQ_HOST,
             port=RABBITMQ_PORT
         )
         channel = await connection.channel()
-        await channel.set_qos(prefetch_count=1)
+        await channel.set_qos(prefetch_count=SETTLEMENT_PREFETCH)
 
         # Обменник и очередь
         exchange = await channel.declare_exchange(EXCHANGE_NAME, ExchangeType.TOPIC)
         queue = await channel.declare_queue(QUEUE_NAME, durable=True)
 
-        # Связываем очередь с обменником
-        await queue.bind(exchange, ROUTING_KEY)
+        # Связываем очередь с обменником по ключу выбранного формата. Привязка
+        # другого формата снимается, чтобы после смены формата не получать
+        # каждое событие дважды (сообщения, уже лежащие в очереди, разбираются по content_type).
+        finished_key, stale_key = (
+            (ENVELOPE_ROUTING_KEY, ROUTING_KEY) if EVENT_MESSAGE_FORMAT == "envelope"
+            else (ROUTING_KEY, ENVELOPE_ROUTING_KEY)
+        )
+        await queue.bind(exchange, finished_key)
+        await queue.unbind(exchange, stale_key)
+
+        settlement_retrier = SettlementRetrier(
+            channel,
+            queue_name=QUEUE_NAME,
+            dead_letter_queue=DEAD_LETTER_QUEUE_NAME,
+            max_retries=SETTLEMENT_MAX_RETRIES,
+            retry_delay=SETTLEMENT_RETRY_DELAY_MS / 1000,
+            max_retry_delay=SETTLEMENT_RETRY_MAX_DELAY_MS / 1000,
+        )
+        await settlement_retrier.declare()
 
         # Начинаем потреблять
-        await queue.consume(on_event_finished, no_ack=False)
+        settlement_engine = SettlementEngine(
+            settle_one=on_event_finished,
+            batch_size=SETTLEMENT_BATCH_SIZE,
+            batch_window=SETTLEMENT_BATCH_WINDOW_MS / 1000,
+        )
+        await queue.consume(settlement_engine.on_message, no_ack=False)
+
+        # Очередь изменений событий своя у каждого экземпляра bet_maker.
+        # Подписываемся до загрузки снимка, чтобы не пропустить изменения.
+        updates_queue = await channel.declare_queue(exclusive=True, auto_delete=True)
+        if EVENT_MESSAGE_FORMAT == "envelope":
+            await updates_queue.bind(exchange, ENVELOPE_UPDATED_ROUTING_KEY)
+            # Уведомления "betting closed" (одно на все события, закрытые по дедлайну)
+            await updates_queue.bind(exchange, ENVELOPE_CLOSED_ROUTING_KEY)
+        else:
+            await updates_queue.bind(exchange, UPDATED_ROUTING_KEY)
+        await updates_queue.consume(on_event_updated, no_ack=True)
         logger.info("Started consuming events from RabbitMQ.")
+
+        # Пока соединение было разорвано, изменения могли быть потеряны —
+        # после переподключения реплика перезагружается целиком.
+        connection.reconnect_callbacks.add(
+            lambda *args: asyncio.create_task(load_events_replica())
+        )
+        asyncio.create_task(load_events_replica())
     except Exception as e:
         logger.exception("Failed to connect or consume from RabbitMQ.")
         # Рестартим задачу через какое-то время (простейший механизм повторных попыток)
@@ -135,30 +498,77 @@ async def consume_events() -> None:
 
 async def on_event_finished(message: IncomingMessage) -> None:
     """
-    Колбэк, вызываемый при получении сообщения о завершённом событии.
-    Формат тела сообщения: "event_id:FINISHED_WIN" или "event_id:FINISHED_LOSE".
+    Обработка одного сообщения о завершённых событиях. Используется
+    SettlementEngine для повторного расчёта сообщений неудавшейся пачки.
+    Формат тела — двоичный конверт с одним или несколькими событиями либо
+    "event_id:FINISHED_WIN" / "event_id:FINISHED_LOSE" (см. parse_finish_message).
 
-    - Извлекает event_id и состояние (WIN/LOSE).
-    - Обновляет все ставки с event_id, у которых статус "NEW", на соответствующий ("WIN" или "LOSE").
+    - Извлекает event_id и состояние (WIN/LOSE) каждого события.
+    - Обновляет все ставки с event_id, у которых статус "NEW", на соответствующий ("WIN" или "LOSE"),
+      если событие ещё не было рассчитано (повторные сообщения ничего не меняют).
+    - При ошибке ставит сообщение на повтор; некорректное сообщение
+      и сообщение с исчерпанными попытками уходят в dead-letter очередь.
 
     :param message: Объект сообщения из RabbitMQ.
     """
     try:
-        body: str = message.body.decode()
-        event_id, state_str = body.split(":")
-        logger.info(f"Received event finish: {event_id} - {state_str}")
+        settlements: Dict[str, str] = {}
+        for event_id, new_status in parse_finish_message(message.body, message.content_type):
+            settlements.setdefault(event_id, new_status)
+    except Exception:
+        logger.exception("Malformed finish message. Moving to dead-letter queue.")
+        await settlement_retrier.dead_letter(message)
+        return
 
-        # Определяем новый статус ставок
-        new_status = "WIN" if state_str == "FINISHED_WIN" else "LOSE"
-        async with SessionLocal() as session:
-            await session.execute(
-                update(Bet).
-                where(Bet.event_id == event_id, Bet.status == "NEW").
-                values(status=new_status)
-            )
-            await session.commit()
+    try:
+        logger.info("Received finish of %d events", len(settlements))
+
+        started = time.perf_counter() if metrics.METRICS_ENABLED else 0.0
+        await settle_events(settlements)
+        if metrics.METRICS_ENABLED:
+            SETTLEMENT_MESSAGE_SECONDS.observe(time.perf_counter() - started)
 
         await message.ack()  # Сообщение обработано успешно
     except Exception as e:
-        logger.exception("Error processing message. Will requeue.")
-        await message.nack(requeue=True)  # Чтобы сообщение было переотправлено
+        logger.exception("Error processing message. Will retry.")
+        await settlement_retrier.retry(message)  # Повтор с задержкой и ограниченным числом попыток
+
+
+async def on_event_updated(message: IncomingMessage) -> None:
+    """
+    Колбэк, вызываемый при изменении событий в line_provider.
+    Тело сообщения — двоичный конверт с актуальными состояниями событий
+    (в том числе уведомление о закрытии приёма ставок: события в состоянии CLOSED)
+    либо одно событие (Event) целиком в JSON (старый формат).
+
+    :param message: Объект сообщения из RabbitMQ.
+    """
+    try:
+        if not protocol.is_envelope(message.content_type):
+            replica.apply(Event.parse_raw(message.body))
+            return
+        _, records = protocol.decode(message.body)
+        for record in records:
+            # Изменения старее уже применённого (пришедшие не по порядку) отбрасываются
+            replica.apply(Event(
+                event_id=record.event_id,
+                coefficient=record.coefficient,
+                deadline=record.deadline,
+                state=record.state,
+            ), updated_at=record.updated_at)
+    except Exception:
+        logger.exception("Malformed event update message, skipped.")
+
+
+async def load_events_replica() -> None:
+    """
+    Загружает снимок событий из line_provider в локальную реплику.
+    При недоступности line_provider повторяет попытку через 5 секунд.
+    """
+    while True:
+        try:
+            await replica.load_snapshot(LINE_PROVIDER_URL)
+            return
+        except Exception:
+            logger.exception("Failed to load events snapshot from line_provider.")
+            await asyncio.sleep(5)
@@ -0,0 +1,71 @@
+"""
+Окружение Alembic для bet_maker.
+
+Миграции применяются при старте приложения (db.init_db передаёт готовое
+соединение через config.attributes["connection"]) либо вручную:
+
+    cd bet_maker && alembic upgrade head
+    cd bet_maker && alembic upgrade head --sql   # только вывести SQL
+
+URL базы данных берётся из db.DATABASE_URL (переменные окружения POSTGRES_*
+или DATABASE_URL).
+"""
+import asyncio
+from logging.config import fileConfig
+
+from alembic import context
+from sqlalchemy.engine import Connection
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import NullPool
+
+from db import DATABASE_URL
+from models import Base
+
+config = context.config
+
+if config.config_file_name is not None and config.attributes.get("connection") is None:
+    fileConfig(config.config_file_name)
+
+target_metadata = Base.metadata
+
+
+def run_migrations_offline() -> None:
+    """Выводит SQL миграций без подключения к БД (alembic ... --sql)."""
+    context.configure(
+        url=DATABASE_URL,
+        target_metadata=target_metadata,
+        literal_binds=True,
+        dialect_opts={"paramstyle": "named"},
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def do_run_migrations(connection: Connection) -> None:
+    """Применяет миграции на переданном синхронном соединении."""
+    context.configure(connection=connection, target_metadata=target_metadata)
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+async def run_async_migrations() -> None:
+    """Применяет миграции через отдельный асинхронный движок."""
+    connectable = create_async_engine(DATABASE_URL, poolclass=NullPool)
+    async with connectable.connect() as connection:
+        await connection.run_sync(do_run_migrations)
+    await connectable.dispose()
+
+
+def run_migrations_online() -> None:
+    """Применяет миграции к БД: на соединении приложения, если оно передано."""
+    connection = config.attributes.get("connection")
+    if connection is not None:
+        do_run_migrations(connection)
+    else:
+        asyncio.run(run_async_migrations())
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
@@ -0,0 +1,64 @@
+"""Исходная схема: bets, settlements, event_exposure
+
+Схема, которую до появления миграций создавал Base.metadata.create_all.
+Выражения идемпотентны (IF NOT EXISTS), поэтому миграция применяется
+и к пустой БД, и к БД, созданной предыдущими версиями приложения.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18
+"""
+from alembic import op
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.execute(
+        """
+        CREATE TABLE IF NOT EXISTS bets (
+            id SERIAL PRIMARY KEY,
+            event_id VARCHAR,
+            amount NUMERIC(10, 2),
+            coefficient NUMERIC(10, 2),
+            status VARCHAR
+        )
+        """
+    )
+    # Колонка, добавленная в модель после создания таблицы
+    op.execute("ALTER TABLE bets ADD COLUMN IF NOT EXISTS coefficient NUMERIC(10, 2)")
+    op.execute("CREATE INDEX IF NOT EXISTS ix_bets_id ON bets (id)")
+    op.execute("CREATE INDEX IF NOT EXISTS ix_bets_event_id ON bets (event_id)")
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS ix_bets_new_event_id ON bets (event_id) WHERE status = 'NEW'"
+    )
+
+    op.execute(
+        """
+        CREATE TABLE IF NOT EXISTS settlements (
+            event_id VARCHAR PRIMARY KEY,
+            status VARCHAR NOT NULL,
+            settled_at TIMESTAMP WITH TIME ZONE DEFAULT now()
+        )
+        """
+    )
+    op.execute(
+        """
+        CREATE TABLE IF NOT EXISTS event_exposure (
+            event_id VARCHAR PRIMARY KEY,
+            bet_count INTEGER NOT NULL,
+            stake_total NUMERIC(14, 2) NOT NULL,
+            potential_payout NUMERIC(16, 4) NOT NULL,
+            status VARCHAR NOT NULL
+        )
+        """
+    )
+
+
+def downgrade() -> None:
+    op.execute("DROP TABLE IF EXISTS event_exposure")
+    op.execute("DROP TABLE IF EXISTS settlements")
+    op.execute("DROP TABLE IF EXISTS bets")
@@ -0,0 +1,136 @@
+"""Секционирование bets по created_at и архивная таблица bets_archive
+
+- bets пересоздаётся как секционированная таблица (PARTITION BY RANGE (created_at))
+  с секциями по месяцам bets_pYYYYMM и секцией по умолчанию bets_default;
+  первичный ключ — (id, created_at), последовательность bets_id_seq сохраняется.
+- bets_archive — такая же секционированная таблица для рассчитанных ставок,
+  которые переносит фоновая задача архивации (archive.py).
+- Существующие ставки копируются в новую bets с created_at = now().
+
+Секции на следующие месяцы создаёт задача архивации.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18
+"""
+from datetime import datetime, timezone
+from typing import List, Tuple
+
+from alembic import op
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+#: Колонки ставки, общие для bets и bets_archive
+BET_COLUMNS = "id, event_id, amount, coefficient, status, created_at"
+
+
+def _months(count: int) -> List[Tuple[str, str, str]]:
+    """Суффикс имени секции и границы для текущего и следующих месяцев."""
+    now = datetime.now(timezone.utc)
+    year, month = now.year, now.month
+    bounds = []
+    for _ in range(count):
+        next_year, next_month = (year + 1, 1) if month == 12 else (year, month + 1)
+        bounds.append((
+            f"{year:04d}{month:02d}",
+            f"{year:04d}-{month:02d}-01 00:00:00+00",
+            f"{next_year:04d}-{next_month:02d}-01 00:00:00+00",
+        ))
+        year, month = next_year, next_month
+    return bounds
+
+
+def _create_partitions(table: str) -> None:
+    op.execute(f"CREATE TABLE {table}_default PARTITION OF {table} DEFAULT")
+    for suffix, start, end in _months(2):
+        op.execute(
+            f"CREATE TABLE {table}_p{suffix} PARTITION OF {table} "
+            f"FOR VALUES FROM ('{start}') TO ('{end}')"
+        )
+
+
+def upgrade() -> None:
+    # Старая таблица освобождает имена; последовательность id переживает её удаление
+    op.execute("ALTER TABLE bets RENAME TO bets_legacy")
+    op.execute("ALTER TABLE bets_legacy RENAME CONSTRAINT bets_pkey TO bets_legacy_pkey")
+    op.execute("DROP INDEX IF EXISTS ix_bets_id")
+    op.execute("DROP INDEX IF EXISTS ix_bets_event_id")
+    op.execute("DROP INDEX IF EXISTS ix_bets_new_event_id")
+    op.execute("ALTER SEQUENCE bets_id_seq OWNED BY NONE")
+
+    op.execute(
+        """
+        CREATE TABLE bets (
+            id INTEGER NOT NULL DEFAULT nextval('bets_id_seq'),
+            event_id VARCHAR,
+            amount NUMERIC(10, 2),
+            coefficient NUMERIC(10, 2),
+            status VARCHAR,
+            created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+            PRIMARY KEY (id, created_at)
+        ) PARTITION BY RANGE (created_at)
+        """
+    )
+    op.execute("CREATE INDEX ix_bets_event_id ON bets (event_id)")
+    op.execute("CREATE INDEX ix_bets_new_event_id ON bets (event_id) WHERE status = 'NEW'")
+    op.execute(
+        "CREATE INDEX ix_bets_settled_created_at ON bets (created_at) WHERE status <> 'NEW'"
+    )
+    _create_partitions("bets")
+
+    op.execute(
+        """
+        CREATE TABLE bets_archive (
+            id INTEGER NOT NULL,
+            event_id VARCHAR,
+            amount NUMERIC(10, 2),
+            coefficient NUMERIC(10, 2),
+            status VARCHAR NOT NULL,
+            created_at TIMESTAMP WITH TIME ZONE NOT NULL,
+            archived_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now(),
+            PRIMARY KEY (id, created_at)
+        ) PARTITION BY RANGE (created_at)
+        """
+    )
+    op.execute("CREATE INDEX ix_bets_archive_event_id ON bets_archive (event_id)")
+    _create_partitions("bets_archive")
+
+    op.execute(
+        f"INSERT INTO bets ({BET_COLUMNS}) "
+        "SELECT id, event_id, amount, coefficient, status, now() FROM bets_legacy"
+    )
+    op.execute("DROP TABLE bets_legacy")
+    op.execute("ALTER SEQUENCE bets_id_seq OWNED BY bets.id")
+
+
+def downgrade() -> None:
+    op.execute("ALTER SEQUENCE bets_id_seq OWNED BY NONE")
+    op.execute("ALTER TABLE bets RENAME TO bets_partitioned")
+    op.execute("DROP INDEX IF EXISTS ix_bets_event_id")
+    op.execute("DROP INDEX IF EXISTS ix_bets_new_event_id")
+    op.execute(
+        """
+        CREATE TABLE bets (
+            id INTEGER PRIMARY KEY DEFAULT nextval('bets_id_seq'),
+            event_id VARCHAR,
+            amount NUMERIC(10, 2),
+            coefficient NUMERIC(10, 2),
+            status VARCHAR
+        )
+        """
+    )
+    op.execute(
+        "INSERT INTO bets (id, event_id, amount, coefficient, status) "
+        "SELECT id, event_id, amount, coefficient, status FROM bets_partitioned "
+        "UNION ALL "
+        "SELECT id, event_id, amount, coefficient, status FROM bets_archive"
+    )
+    op.execute("DROP TABLE bets_partitioned")
+    op.execute("DROP TABLE bets_archive")
+    op.execute("ALTER SEQUENCE bets_id_seq OWNED BY bets.id")
+    op.execute("CREATE INDEX ix_bets_id ON bets (id)")
+    op.execute("CREATE INDEX ix_bets_event_id ON bets (event_id)")
+    op.execute("CREATE INDEX ix_bets_new_event_id ON bets (event_id) WHERE status = 'NEW'")
@@ -0,0 +1,32 @@
+"""Ключи идемпотентности POST /bet
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18
+"""
+from alembic import op
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.execute(
+        """
+        CREATE TABLE bet_idempotency_keys (
+            key VARCHAR PRIMARY KEY,
+            bet_id INTEGER NOT NULL,
+            request_hash VARCHAR NOT NULL,
+            created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
+        )
+        """
+    )
+    op.execute(
+        "CREATE INDEX ix_bet_idempotency_keys_created_at ON bet_idempotency_keys (created_at)"
+    )
+
+
+def downgrade() -> None:
+    op.execute("DROP TABLE bet_idempotency_keys")
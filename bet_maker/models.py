@@ -1,8 +1,10 @@
 """
-Модуль содержит ORM-модель Bet для работы с таблицей 'bets' в базе данных.
+Модуль содержит ORM-модели Bet, BetArchive, Settlement, EventExposure и BetIdempotencyKey
+для работы с таблицами 'bets', 'bets_archive', 'settlements', 'event_exposure' и
+'bet_idempotency_keys' в базе данных.
 """
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import Column, Integer, String, Numeric
+from sqlalchemy import Column, Integer, String, Numeric, Index, DateTime, func
 
 Base = declarative_base()
 
@@ -14,11 +16,120 @@ class Bet(Base):
     - id: Первичный ключ (int).
     - event_id: Идентификатор события (str).
     - amount: Сумма ставки (Decimal).
+    - coefficient: Коэффициент события на момент ставки (Decimal).
     - status: Статус ставки (str), может быть NEW, WIN или LOSE.
+    - created_at: Время создания ставки (datetime).
+
+    Частичный индекс ix_bets_new_event_id содержит event_id только нерассчитанных
+    ставок: по нему выполняется выборка активных событий (SELECT DISTINCT).
+    По частичному индексу ix_bets_settled_created_at фоновая задача архивации
+    находит рассчитанные ставки, которые пора перенести в bets_archive.
+
+    В PostgreSQL таблица секционирована по created_at (RANGE, по месяцам) и
+    создаётся миграциями (см. migrations/), первичный ключ — (id, created_at).
     """
     __tablename__ = "bets"
 
-    id = Column(Integer, primary_key=True, index=True)
+    id = Column(Integer, primary_key=True)
     event_id = Column(String, index=True)
     amount = Column(Numeric(10, 2))
+    coefficient = Column(Numeric(10, 2), nullable=True)
     status = Column(String, default="NEW")
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+
+    __table_args__ = (
+        Index(
+            "ix_bets_new_event_id",
+            "event_id",
+            postgresql_where=(status == "NEW"),
+            sqlite_where=(status == "NEW"),
+        ),
+        Index(
+            "ix_bets_settled_created_at",
+            "created_at",
+            postgresql_where=(status != "NEW"),
+            sqlite_where=(status != "NEW"),
+        ),
+        # SQLite без AUTOINCREMENT повторно выдаёт id удалённой (перенесённой в архив) строки
+        {"sqlite_autoincrement": True},
+    )
+
+
+class BetArchive(Base):
+    """
+    ORM-модель архивной (рассчитанной) ставки.
+    Фоновая задача архивации (см. archive.py) переносит сюда ставки
+    в статусе WIN или LOSE из таблицы bets, чтобы горячая таблица и её индексы
+    содержали в основном нерассчитанные ставки.
+    Содержит те же поля, что и Bet, а также:
+    - archived_at: Время переноса в архив (datetime).
+
+    В PostgreSQL таблица секционирована по created_at так же, как bets.
+    """
+    __tablename__ = "bets_archive"
+
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    event_id = Column(String, index=True)
+    amount = Column(Numeric(10, 2))
+    coefficient = Column(Numeric(10, 2), nullable=True)
+    status = Column(String, nullable=False)
+    created_at = Column(DateTime(timezone=True), nullable=False)
+    archived_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now())
+
+
+class Settlement(Base):
+    """
+    ORM-модель записи журнала расчётов (Settlement).
+    Одна запись на рассчитанное событие; наличие записи означает,
+    что ставки события уже рассчитаны и повторное сообщение о завершении
+    ничего не меняет.
+    Содержит поля:
+    - event_id: Идентификатор события (str), первичный ключ.
+    - status: Статус, присвоенный ставкам события (str): WIN или LOSE.
+    - settled_at: Время расчёта (datetime).
+    """
+    __tablename__ = "settlements"
+
+    event_id = Column(String, primary_key=True)
+    status = Column(String, nullable=False)
+    settled_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class EventExposure(Base):
+    """
+    ORM-модель агрегата ставок по событию (EventExposure).
+    Обновляется инкрементально: при записи ставок и при расчёте события,
+    поэтому чтение не зависит от количества ставок.
+    Содержит поля:
+    - event_id: Идентификатор события (str), первичный ключ.
+    - bet_count: Количество ставок (int).
+    - stake_total: Сумма ставок (Decimal).
+    - potential_payout: Сумма возможных выплат — amount * coefficient по всем ставкам (Decimal).
+    - status: Статус ставок события (str): NEW, WIN или LOSE.
+    """
+    __tablename__ = "event_exposure"
+
+    event_id = Column(String, primary_key=True)
+    bet_count = Column(Integer, nullable=False, default=0)
+    stake_total = Column(Numeric(14, 2), nullable=False, default=0)
+    potential_payout = Column(Numeric(16, 4), nullable=False, default=0)
+    status = Column(String, nullable=False, default="NEW")
+
+
+class BetIdempotencyKey(Base):
+    """
+    ORM-модель ключа идемпотентности POST /bet (заголовок Idempotency-Key).
+    Первичный ключ по key гарантирует, что по одному ключу создаётся
+    не больше одной ставки, в том числе при нескольких экземплярах bet_maker.
+    Содержит поля:
+    - key: Значение заголовка Idempotency-Key (str), первичный ключ.
+    - bet_id: Идентификатор созданной ставки (int).
+    - request_hash: Хэш тела запроса (str): повтор ключа с другим телом отклоняется.
+    - created_at: Время создания (datetime); устаревшие ключи удаляет задача архивации.
+    """
+    __tablename__ = "bet_idempotency_keys"
+
+    key = Column(String, primary_key=True)
+    bet_id = Column(Integer, nullable=False)
+    request_hash = Column(String, nullable=False)
+    created_at = Column(DateTime(timezone=True), nullable=False, server_default=func.now(), index=True)
@@ -0,0 +1,175 @@
+"""
+Модуль двоичного формата сообщений о событиях (конверт).
+
+Конверт — версионированное двоичное сообщение, в котором передаётся
+пачка изменений событий (одно или много). Тип содержимого (content_type)
+сообщения — CONTENT_TYPE с параметром версии, например
+"application/vnd.events.batch; v=1"; получатель выбирает декодер по нему,
+а сообщения без него разбирает в старом формате.
+
+Формат (big-endian):
+
+    заголовок: magic b"EV" | version: uint8 | kind: uint8 | count: uint32
+    запись (count раз):
+        len(event_id): uint16 | event_id: utf-8
+        flags: uint8 (бит 0 — есть deadline)
+        state: uint8 (0 — нет, 1 — NEW, 2 — FINISHED_WIN, 3 — FINISHED_LOSE, 4 — CLOSED)
+        len(coefficient): uint8 | coefficient: ascii (десятичная строка, 0 — нет)
+        deadline: int64 | updated_at: int64 (unix time в наносекундах)
+
+Записи не зависят от заголовка, поэтому конверты одного вида
+объединяются в один конкатенацией записей (merge).
+"""
+import struct
+from decimal import Decimal
+from typing import Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+#: Тип содержимого конверта (без параметра версии)
+CONTENT_TYPE: str = "application/vnd.events.batch"
+#: Текущая версия формата
+PROTOCOL_VERSION: int = 1
+
+#: Вид конверта: актуальные состояния событий
+KIND_UPDATED: int = 1
+#: Вид конверта: завершённые события
+KIND_FINISHED: int = 2
+#: Вид конверта: события, приём ставок на которые закрыт по дедлайну
+KIND_CLOSED: int = 3
+
+_MAGIC = b"EV"
+_HEADER = struct.Struct(">2sBBI")
+_ID_LENGTH = struct.Struct(">H")
+_FLAGS = struct.Struct(">BBB")
+_TAIL = struct.Struct(">qq")
+_HAS_DEADLINE = 0x01
+
+_STATES: Tuple[Optional[str], ...] = (None, "NEW", "FINISHED_WIN", "FINISHED_LOSE", "CLOSED")
+_STATE_CODES = {state: code for code, state in enumerate(_STATES)}
+
+
+class EventRecord(NamedTuple):
+    """
+    Изменение события в конверте.
+
+    - event_id: Идентификатор события.
+    - state: Состояние (NEW, FINISHED_WIN, FINISHED_LOSE, CLOSED) или None.
+    - coefficient: Коэффициент или None.
+    - deadline: Временная метка приёма ставок или None.
+    - updated_at: Время изменения (unix time в наносекундах).
+    """
+    event_id: str
+    state: Optional[str]
+    coefficient: Optional[Decimal]
+    deadline: Optional[int]
+    updated_at: int
+
+
+def content_type(version: int = PROTOCOL_VERSION) -> str:
+    """Значение content_type конверта версии version."""
+    return f"{CONTENT_TYPE}; v={version}"
+
+
+def is_envelope(message_content_type: Optional[str]) -> bool:
+    """
+    Проверяет, что сообщение — конверт (любой версии).
+
+    :param message_content_type: content_type сообщения.
+    """
+    return bool(message_content_type) and message_content_type.split(";")[0].strip() == CONTENT_TYPE
+
+
+def _encode_record(record: EventRecord) -> bytes:
+    event_id = record.event_id.encode()
+    coefficient = b"" if record.coefficient is None else str(record.coefficient).encode()
+    if len(event_id) > 0xFFFF or len(coefficient) > 0xFF:
+        raise ValueError(f"Event {record.event_id!r} does not fit the envelope format")
+    flags = _HAS_DEADLINE if record.deadline is not None else 0
+    return b"".join((
+        _ID_LENGTH.pack(len(event_id)),
+        event_id,
+        _FLAGS.pack(flags, _STATE_CODES[record.state], len(coefficient)),
+        coefficient,
+        _TAIL.pack(record.deadline or 0, record.updated_at),
+    ))
+
+
+def encode(kind: int, records: Iterable[EventRecord]) -> bytes:
+    """
+    Кодирует изменения событий в конверт.
+
+    :param kind: Вид конверта (KIND_UPDATED, KIND_FINISHED или KIND_CLOSED).
+    :param records: Изменения событий.
+    :return: Тело сообщения.
+    :raises ValueError: если событие не помещается в формат.
+    """
+    body = [_encode_record(record) for record in records]
+    return _HEADER.pack(_MAGIC, PROTOCOL_VERSION, kind, len(body)) + b"".join(body)
+
+
+def _read_header(body: bytes) -> Tuple[int, int]:
+    if len(body) < _HEADER.size:
+        raise ValueError("Envelope is too short")
+    magic, version, kind, count = _HEADER.unpack_from(body)
+    if magic != _MAGIC:
+        raise ValueError("Not an event envelope")
+    if version != PROTOCOL_VERSION:
+        raise ValueError(f"Unsupported envelope version {version}")
+    return kind, count
+
+
+def decode(body: bytes) -> Tuple[int, List[EventRecord]]:
+    """
+    Декодирует конверт.
+
+    :param body: Тело сообщения.
+    :return: Вид конверта и изменения событий.
+    :raises ValueError: если тело не является корректным конвертом поддерживаемой версии.
+    """
+    kind, count = _read_header(body)
+    records = []
+    offset = _HEADER.size
+    try:
+        for _ in range(count):
+            (id_length,) = _ID_LENGTH.unpack_from(body, offset)
+            offset += _ID_LENGTH.size
+            event_id = body[offset:offset + id_length].decode()
+            offset += id_length
+            flags, state, coefficient_length = _FLAGS.unpack_from(body, offset)
+            offset += _FLAGS.size
+            coefficient = body[offset:offset + coefficient_length].decode()
+            offset += coefficient_length
+            deadline, updated_at = _TAIL.unpack_from(body, offset)
+            offset += _TAIL.size
+            records.append(EventRecord(
+                event_id=event_id,
+                state=_STATES[state],
+                coefficient=Decimal(coefficient) if coefficient else None,
+                deadline=deadline if flags & _HAS_DEADLINE else None,
+                updated_at=updated_at,
+            ))
+    except (struct.error, IndexError, ArithmeticError, UnicodeDecodeError) as e:
+        raise ValueError(f"Malformed envelope: {e}") from e
+    if offset != len(body):
+        raise ValueError("Trailing bytes after envelope records")
+    return kind, records
+
+
+def merge(bodies: Sequence[bytes]) -> bytes:
+    """
+    Объединяет конверты одного вида в один (записи — в исходном порядке).
+
+    :param bodies: Тела конвертов.
+    :return: Тело объединённого конверта.
+    :raises ValueError: если конверты разного вида или версии.
+    """
+    if len(bodies) == 1:
+        return bodies[0]
+    kind, total = _read_header(bodies[0])
+    for body in bodies[1:]:
+        other_kind, count = _read_header(body)
+        if other_kind != kind:
+            raise ValueError("Cannot merge envelopes of different kinds")
+        total += count
+    return _HEADER.pack(_MAGIC, PROTOCOL_VERSION, kind, total) + b"".join(
+        body[_HEADER.size:] for body in bodies
+    )
@@ -25,12 +25,49 @@ class BetDB(BaseModel):
     - id: Уникальный идентификатор ставки (int).
     - event_id: Идентификатор события (str).
     - amount: Сумма ставки (decimal.Decimal).
+    - coefficient: Коэффициент события на момент ставки (decimal.Decimal).
     - status: Текущий статус ставки (str).
     """
     id: int
     event_id: str
     amount: decimal.Decimal
+    coefficient: Optional[decimal.Decimal] = None
     status: str  # Возможные варианты: "NEW", "WIN", "LOSE"
 
     class Config:
         orm_mode = True
+
+
+class Event(BaseModel):
+    """
+    Копия события из line_provider, хранящаяся в локальной реплике bet_maker.
+    Поля:
+    - event_id: Идентификатор события (str).
+    - coefficient: Коэффициент для расчёта выигрыша (decimal.Decimal).
+    - deadline: Временная метка (int), до которой принимаются ставки.
+    - state: Текущее состояние события (str): NEW, CLOSED, FINISHED_WIN или FINISHED_LOSE.
+    """
+    event_id: str
+    coefficient: Optional[decimal.Decimal] = None
+    deadline: Optional[int] = None
+    state: Optional[str] = None
+
+
+class EventExposureDB(BaseModel):
+    """
+    Схема агрегата ставок по событию.
+    Поля:
+    - event_id: Идентификатор события (str).
+    - bet_count: Количество ставок (int).
+    - stake_total: Сумма ставок (decimal.Decimal).
+    - potential_payout: Сумма возможных выплат (decimal.Decimal).
+    - status: Статус ставок события (str): NEW, WIN или LOSE.
+    """
+    event_id: str
+    bet_count: int = 0
+    stake_total: decimal.Decimal = decimal.Decimal("0")
+    potential_payout: decimal.Decimal = decimal.Decimal("0")
+    status: str = "NEW"
+
+    class Config:
+        orm_mode = True
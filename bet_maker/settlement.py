@@ -0,0 +1,353 @@
+"""
+Модуль пакетного расчёта ставок по сообщениям о завершении событий.
+
+Сообщения event.finished накапливаются в пачки (до batch_size сообщений
+или в течение batch_window секунд). Пачка рассчитывается одним запросом
+UPDATE ... FROM (VALUES ...) и подтверждается одним ack(multiple=True).
+Если пачка не прошла, её сообщения обрабатываются по одному.
+
+Расчёт идемпотентен: рассчитанные события фиксируются в таблице settlements,
+и повторное сообщение о том же событии не меняет ставок. Сообщение, которое
+не удаётся обработать, повторяется ограниченное число раз с экспоненциально
+растущей задержкой (через очереди ожидания с TTL), а затем перекладывается
+в очередь недоставленных сообщений (dead-letter queue).
+"""
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from aio_pika import DeliveryMode, IncomingMessage, Message
+from aio_pika.abc import AbstractChannel
+from sqlalchemy.orm import sessionmaker
+
+from active_events import active_events_cache
+from bet_cache import bet_cache
+from db import SessionLocal, update_status, upsert
+from exposure import settle_exposure
+from metrics import METRICS_ENABLED, Counter, Histogram
+from models import Bet, Settlement
+import protocol
+
+#: Заголовок сообщения с количеством уже сделанных попыток обработки
+RETRY_HEADER: str = "x-settlement-retries"
+#: Заголовок с временем публикации сообщения в line_provider (unix time)
+PUBLISHED_AT_HEADER: str = "x-published-at"
+
+CONSUMER_LAG_SECONDS = Histogram(
+    "settlement_consumer_lag_seconds",
+    "Время от публикации сообщения event.finished до его получения",
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0),
+)
+SETTLEMENT_BATCH_SECONDS = Histogram(
+    "settlement_batch_seconds", "Время расчёта пачки сообщений event.finished",
+)
+SETTLEMENT_MESSAGE_SECONDS = Histogram(
+    "settlement_message_seconds", "Время расчёта одного сообщения в on_event_finished",
+)
+SETTLEMENT_MESSAGES = Counter(
+    "settlement_messages_total", "Обработанные сообщения event.finished", ("result",),
+)
+
+logger = logging.getLogger("bet_maker")
+
+
+#: Статус ставок по состоянию завершённого события
+_SETTLEMENT_STATUSES: Dict[str, str] = {"FINISHED_WIN": "WIN", "FINISHED_LOSE": "LOSE"}
+
+
+def parse_finish_message(body: bytes, content_type: Optional[str] = None) -> List[Tuple[str, str]]:
+    """
+    Разбирает сообщение о завершении событий; формат выбирается по content_type:
+    - двоичный конверт (protocol.py) — одно или много завершённых событий;
+    - иначе старый формат "event_id:FINISHED_WIN" или "event_id:FINISHED_LOSE"
+      (состояние отделяется по последнему двоеточию, event_id может их содержать).
+
+    :param body: Тело сообщения.
+    :param content_type: content_type сообщения.
+    :return: Пары (event_id, новый статус ставок: "WIN" или "LOSE"), хотя бы одна.
+    :raises ValueError: если сообщение некорректно: состояние события не
+        FINISHED_WIN/FINISHED_LOSE или конверт не содержит событий.
+    """
+    if not protocol.is_envelope(content_type):
+        event_id, state = body.decode().rsplit(":", 1)
+        pairs = [(event_id, state)]
+    else:
+        kind, records = protocol.decode(body)
+        if kind != protocol.KIND_FINISHED:
+            raise ValueError(f"Unexpected envelope kind {kind} in finish message")
+        if not records:
+            raise ValueError("Finish message contains no events")
+        pairs = [(record.event_id, record.state) for record in records]
+
+    settlements = []
+    for event_id, state in pairs:
+        status = _SETTLEMENT_STATUSES.get(state)
+        if status is None:
+            raise ValueError(f"Event {event_id!r} is not finished: {state}")
+        settlements.append((event_id, status))
+    return settlements
+
+
+async def settle_events(
+    settlements: Dict[str, str],
+    session_factory: sessionmaker = SessionLocal,
+) -> Set[str]:
+    """
+    Рассчитывает ставки сразу по нескольким событиям в одной транзакции:
+    1) INSERT INTO settlements ... ON CONFLICT DO NOTHING RETURNING event_id —
+       отбирает события, которые ещё не были рассчитаны;
+    2) UPDATE bets SET status = v.status FROM (VALUES ...) AS v(event_id, status)
+       WHERE bets.event_id = v.event_id AND bets.status = 'NEW' — только для них;
+    3) проставляет статус рассчитанных событий в агрегатах event_exposure.
+
+    После фиксации транзакции рассчитанные события убираются из кэша
+    активных событий, а их ставки — из кэша ставок.
+
+    :param settlements: Новый статус ставок ("WIN"/"LOSE") по event_id.
+    :param session_factory: Фабрика асинхронных сессий.
+    :return: event_id, рассчитанные этим вызовом (без уже рассчитанных ранее).
+    """
+    async with session_factory() as session:
+        result = await session.execute(
+            upsert(Settlement)
+            .values([
+                {"event_id": event_id, "status": status}
+                for event_id, status in settlements.items()
+            ])
+            .on_conflict_do_nothing(index_elements=[Settlement.event_id])
+            .returning(Settlement.event_id)
+        )
+        newly_settled = set(result.scalars().all())
+
+        if newly_settled:
+            await session.execute(
+                update_status(Bet, {event_id: settlements[event_id] for event_id in newly_settled})
+                .where(Bet.status == "NEW")
+                .execution_options(synchronize_session=False)
+            )
+            await settle_exposure(
+                session, {event_id: settlements[event_id] for event_id in newly_settled}
+            )
+        await session.commit()
+
+    active_events_cache.discard(settlements)
+    bet_cache.invalidate_events(settlements)
+    return newly_settled
+
+
+class SettlementRetrier:
+    """
+    Ограниченные повторы обработки сообщений event.finished с задержкой.
+
+    Неудавшееся сообщение публикуется с увеличенным счётчиком попыток
+    в заголовке RETRY_HEADER в очередь ожидания своей попытки, а исходное
+    подтверждается. У очереди ожидания n-й попытки нет потребителей, а TTL
+    сообщений равен retry_delay * 2 ** (n - 1) (не больше max_retry_delay):
+    по его истечении брокер возвращает сообщение в основную очередь
+    (dead-letter-exchange по умолчанию). Поэтому кратковременный сбой БД
+    переживается повторами, а не уводит сообщения в dead-letter очередь.
+    После max_retries попыток (или сразу, если сообщение некорректно)
+    сообщение перекладывается в очередь недоставленных сообщений.
+    """
+
+    def __init__(
+        self,
+        channel: AbstractChannel,
+        queue_name: str,
+        dead_letter_queue: str,
+        max_retries: int = 5,
+        retry_delay: float = 1.0,
+        max_retry_delay: float = 60.0,
+    ) -> None:
+        """
+        :param channel: Канал RabbitMQ, через который идут повторные публикации.
+        :param queue_name: Очередь сообщений event.finished.
+        :param dead_letter_queue: Очередь недоставленных сообщений.
+        :param max_retries: Максимальное количество повторов сообщения.
+        :param retry_delay: Задержка перед первым повтором в секундах.
+        :param max_retry_delay: Максимальная задержка перед повтором в секундах.
+        """
+        self.channel = channel
+        self.queue_name = queue_name
+        self.dead_letter_queue = dead_letter_queue
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+
+    def retry_queue(self, attempt: int) -> str:
+        """Имя очереди ожидания попытки attempt (начиная с 1)."""
+        return f"{self.queue_name}.retry.{attempt}"
+
+    def delay(self, attempt: int) -> float:
+        """Задержка перед попыткой attempt (начиная с 1) в секундах."""
+        return min(self.retry_delay * 2 ** (attempt - 1), self.max_retry_delay)
+
+    async def declare(self) -> None:
+        """
+        Объявляет очередь недоставленных сообщений и очереди ожидания повторов.
+        """
+        await self.channel.declare_queue(self.dead_letter_queue, durable=True)
+        for attempt in range(1, self.max_retries + 1):
+            arguments: Dict[str, Any] = {
+                "x-message-ttl": int(self.delay(attempt) * 1000),
+                "x-dead-letter-exchange": "",
+                "x-dead-letter-routing-key": self.queue_name,
+            }
+            await self.channel.declare_queue(self.retry_queue(attempt), durable=True, arguments=arguments)
+
+    async def retry(self, message: IncomingMessage) -> None:
+        """
+        Ставит сообщение на повторную обработку после задержки либо, если
+        попытки исчерпаны, перекладывает его в очередь недоставленных сообщений.
+
+        :param message: Сообщение, обработка которого не удалась.
+        """
+        retries = int((message.headers or {}).get(RETRY_HEADER, 0))
+        if retries >= self.max_retries:
+            logger.error("Message exceeded %d retries, dead-lettering.", self.max_retries)
+            await self._republish(message, self.dead_letter_queue, retries)
+            if METRICS_ENABLED:
+                SETTLEMENT_MESSAGES.inc("dead_lettered")
+        else:
+            await self._republish(message, self.retry_queue(retries + 1), retries + 1)
+            if METRICS_ENABLED:
+                SETTLEMENT_MESSAGES.inc("retried")
+
+    async def dead_letter(self, message: IncomingMessage) -> None:
+        """
+        Сразу перекладывает сообщение в очередь недоставленных сообщений.
+
+        :param message: Некорректное сообщение.
+        """
+        retries = int((message.headers or {}).get(RETRY_HEADER, 0))
+        await self._republish(message, self.dead_letter_queue, retries)
+        if METRICS_ENABLED:
+            SETTLEMENT_MESSAGES.inc("dead_lettered")
+
+    async def _republish(self, message: IncomingMessage, queue_name: str, retries: int) -> None:
+        await self.channel.default_exchange.publish(
+            Message(
+                message.body,
+                content_type=message.content_type,
+                headers={**(message.headers or {}), RETRY_HEADER: retries},
+                delivery_mode=DeliveryMode.PERSISTENT,
+            ),
+            routing_key=queue_name,
+        )
+        await message.ack()
+
+
+class SettlementEngine:
+    """
+    Пакетный обработчик сообщений event.finished.
+
+    Пачки обрабатываются строго по очереди и в порядке доставки, поэтому
+    ack(multiple=True) по последнему сообщению пачки подтверждает
+    ровно сообщения этой пачки.
+    """
+
+    def __init__(
+        self,
+        settle_one: Callable[[IncomingMessage], Awaitable[None]],
+        batch_size: int = 100,
+        batch_window: float = 0.01,
+    ) -> None:
+        """
+        :param settle_one: Обработчик одного сообщения (сам делает ack/nack),
+            используется для повторной обработки неудавшейся пачки.
+        :param batch_size: Максимальное количество сообщений в пачке.
+        :param batch_window: Время накопления неполной пачки в секундах.
+        """
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self._settle_one = settle_one
+        self._buffer: List[IncomingMessage] = []
+        self._lock = asyncio.Lock()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        # Расчёт неполной пачки, запущенный по истечении batch_window
+        self._flush_task: Optional[asyncio.Task] = None
+
+    async def on_message(self, message: IncomingMessage) -> None:
+        """
+        Колбэк потребителя очереди: добавляет сообщение в текущую пачку.
+
+        :param message: Объект сообщения из RabbitMQ.
+        """
+        if METRICS_ENABLED:
+            published_at = (message.headers or {}).get(PUBLISHED_AT_HEADER)
+            if published_at is not None:
+                CONSUMER_LAG_SECONDS.observe(max(0.0, time.time() - float(published_at)))
+        self._buffer.append(message)
+        if len(self._buffer) >= self.batch_size:
+            await self.flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.batch_window, self._on_timer)
+
+    def _on_timer(self) -> None:
+        """Запускает расчёт неполной пачки; ссылка на задачу хранится до её завершения."""
+        self._timer = None
+        task = asyncio.create_task(self.flush())
+        self._flush_task = task
+        task.add_done_callback(self._on_flush_done)
+
+    def _on_flush_done(self, task: "asyncio.Task[None]") -> None:
+        if self._flush_task is task:
+            self._flush_task = None
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Settlement batch flush failed.", exc_info=task.exception())
+
+    async def stop(self) -> None:
+        """
+        Останавливает накопление пачек: отменяет таймер, дожидается начатого
+        расчёта и рассчитывает оставшиеся сообщения.
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._flush_task is not None:
+            await asyncio.wait([self._flush_task])
+        await self.flush()
+
+    async def flush(self) -> None:
+        """Рассчитывает накопленные сообщения пачками по batch_size."""
+        async with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+
+            while self._buffer:
+                batch = self._buffer[:self.batch_size]
+                self._buffer = self._buffer[self.batch_size:]
+                await self._settle_batch(batch)
+
+    async def _settle_batch(self, batch: List[IncomingMessage]) -> None:
+        """
+        Рассчитывает пачку одним UPDATE и подтверждает её одним ack.
+        При ошибке повторяет обработку каждого сообщения по отдельности.
+
+        :param batch: Сообщения пачки в порядке доставки.
+        """
+        started = time.perf_counter() if METRICS_ENABLED else 0.0
+        try:
+            settlements: Dict[str, str] = {}
+            for message in batch:
+                for event_id, status in parse_finish_message(message.body, message.content_type):
+                    # Ставки события рассчитываются первым сообщением, повторные ничего не меняют
+                    settlements.setdefault(event_id, status)
+
+            newly_settled = await settle_events(settlements)
+            await batch[-1].ack(multiple=True)
+            if METRICS_ENABLED:
+                SETTLEMENT_BATCH_SECONDS.observe(time.perf_counter() - started)
+                SETTLEMENT_MESSAGES.inc("batch", amount=len(batch))
+            logger.info(
+                "Settled %d events (%d already settled) from %d messages.",
+                len(newly_settled), len(settlements) - len(newly_settled), len(batch),
+            )
+        except Exception:
+            logger.exception("Batch settlement failed, retrying %d messages one by one.", len(batch))
+            if METRICS_ENABLED:
+                SETTLEMENT_MESSAGES.inc("single", amount=len(batch))
+            for message in batch:
+                await self._settle_one(message)
@@ -0,0 +1,56 @@
+"""
+Тесты кэша ставок: размер ограничен количеством ставок во всех записях,
+а не количеством записей.
+"""
+from decimal import Decimal
+from typing import List
+
+import pytest
+
+from bet_cache import BetLookupCache
+from schemas import BetDB
+
+
+def make_bets(event_id: str, count: int) -> List[BetDB]:
+    return [
+        BetDB(id=i, event_id=event_id, amount=Decimal("10"), coefficient=Decimal("1.5"), status="NEW")
+        for i in range(count)
+    ]
+
+
+async def load_value(value):
+    return value
+
+
+@pytest.mark.asyncio
+async def test_bounded_by_rows() -> None:
+    """Список ставок события занимает по строке на ставку; старые записи вытесняются."""
+    cache = BetLookupCache(ttl=60, max_rows=10)
+    await cache.get_bet(1, lambda: load_value(make_bets("a", 1)[0]))
+    await cache.get_event_bets("b", lambda: load_value(make_bets("b", 6)))
+    assert (len(cache), cache.rows) == (2, 7)
+
+    await cache.get_event_bets("c", lambda: load_value(make_bets("c", 4)))
+    assert (len(cache), cache.rows) == (2, 10)
+    assert ("bet", 1) not in cache._entries
+
+
+@pytest.mark.asyncio
+async def test_oversized_list_not_cached() -> None:
+    """Список больше max_rows возвращается, но не кэшируется."""
+    cache = BetLookupCache(ttl=60, max_rows=5)
+    bets = await cache.get_event_bets("a", lambda: load_value(make_bets("a", 6)))
+    assert len(bets) == 6
+    assert (len(cache), cache.rows) == (0, 0)
+
+
+@pytest.mark.asyncio
+async def test_invalidate_releases_rows() -> None:
+    """Сброс события освобождает строки его записей."""
+    cache = BetLookupCache(ttl=60, max_rows=100)
+    await cache.get_event_bets("a", lambda: load_value(make_bets("a", 3)))
+    await cache.get_bet(7, lambda: load_value(make_bets("a", 8)[7]))
+    cache.invalidate_events(["a"], bets=False)
+    assert (len(cache), cache.rows) == (1, 1)
+    cache.invalidate_events(["a"])
+    assert (len(cache), cache.rows) == (0, 0)
@@ -6,13 +6,51 @@
 Затем, в другом терминале:
     pytest bet_maker/tests/test_bet_maker_integration.py
 """
+import asyncio
 import pytest
 import time
 from decimal import Decimal
-from httpx import AsyncClient
+from typing import Any, Dict, Optional
+from httpx import AsyncClient, Response
 
 
 BET_MAKER_BASE_URL = "http://localhost:8002"
+LINE_PROVIDER_BASE_URL = "http://localhost:8001"
+
+
+async def create_event(event_id: str, **fields: Any) -> None:
+    """
+    Создаёт (или обновляет) событие в line_provider.
+    Изменение попадает в реплику bet_maker асинхронно через RabbitMQ.
+    """
+    event = {
+        "event_id": event_id,
+        "coefficient": "1.50",
+        "deadline": int(time.time()) + 300,
+        "state": "NEW",
+        **fields,
+    }
+    async with AsyncClient(base_url=LINE_PROVIDER_BASE_URL) as ac:
+        resp = await ac.put("/event", json=event)
+        assert resp.status_code == 200, f"Response: {resp.status_code}, {resp.text}"
+
+
+async def post_bet(
+    ac: AsyncClient,
+    bet_data: Dict[str, Any],
+    attempts: int = 50,
+    headers: Optional[Dict[str, str]] = None,
+) -> Response:
+    """
+    Отправляет ставку, повторяя попытку, пока реплика bet_maker
+    не получила только что созданное событие (ответ 404/503).
+    """
+    for _ in range(attempts):
+        resp = await ac.post("/bet", json=bet_data, headers=headers)
+        if resp.status_code not in (404, 503):
+            return resp
+        await asyncio.sleep(0.1)
+    return resp
 
 
 @pytest.mark.asyncio
@@ -25,8 +63,9 @@ async def test_create_bet_integration() -> None:
         "event_id": "test_event_integration",
         "amount": "100.50"
     }
+    await create_event("test_event_integration")
     async with AsyncClient(base_url=BET_MAKER_BASE_URL) as ac:
-        resp = await ac.post("/bet", json=bet_data)
+        resp = await post_bet(ac, bet_data)
         assert resp.status_code == 200, f"Response: {resp.status_code}, {resp.text}"
 
 
@@ -37,10 +76,174 @@ async def test_list_bets_integration() -> None:
     Проверяет, что ответ содержит ранее созданную тестовую ставку.
     """
     async with AsyncClient(base_url=BET_MAKER_BASE_URL) as ac:
-        resp = await ac.get("/bets")
+        resp = await ac.get("/bets", params={"event_id": "test_event_integration"})
         assert resp.status_code == 200, f"Response: {resp.status_code}, {resp.text}"
         bets = resp.json()
         assert isinstance(bets, list)
 
         found = any(b["event_id"] == "test_event_integration" for b in bets)
         assert found, "Нашу тестовую ставку не нашли в списке!"
+
+
+@pytest.mark.asyncio
+async def test_list_bets_pagination_integration() -> None:
+    """
+    Тестирует keyset-пагинацию /bets: вторая страница, полученная по курсору
+    из заголовка X-Next-Cursor, начинается строго после последней ставки первой.
+    Также проверяет потоковую выдачу NDJSON.
+    """
+    bet_data = {
+        "event_id": "test_event_pagination",
+        "amount": "10.00"
+    }
+    await create_event("test_event_pagination")
+    async with AsyncClient(base_url=BET_MAKER_BASE_URL) as ac:
+        for _ in range(3):
+            resp = await post_bet(ac, bet_data)
+            assert resp.status_code == 200, f"Response: {resp.status_code}, {resp.text}"
+
+        resp = await ac.get("/bets", params={"event_id": "test_event_pagination", "limit": 2})
+        assert resp.status_code == 200, f"Response: {resp.status_code}, {resp.text}"
+        first_page = resp.json()
+        assert len(first_page) == 2
+        cursor = resp.headers["X-Next-Cursor"]
+        assert int(cursor) == first_page[-1]["id"]
+
+        resp = await ac.get("/bets", params={
+            "event_id": "test_event_pagination", "limit": 2, "after_id": cursor
+        })
+        second_page = resp.json()
+        assert second_page and second_page[0]["id"] > first_page[-1]["id"]
+
+        resp = await ac.get("/bets", params={"event_id": "test_event_pagination", "stream": "true"})
+        assert resp.headers["content-type"].startswith("application/x-ndjson")
+        lines = resp.text.splitlines()
+        assert len(lines) >= 3
+
+
+@pytest.mark.asyncio
+async def test_create_bet_validation_integration() -> None:
+    """
+    Тестирует проверку события по локальной реплике:
+    ставка на несуществующее событие отклоняется с 404,
+    на завершённое событие — с 400.
+    """
+    async with AsyncClient(base_url=BET_MAKER_BASE_URL) as ac:
+        resp = await ac.post("/bet", json={"event_id": "no_such_event", "amount": "1.00"})
+        assert resp.status_code == 404, f"Response: {resp.status_code}, {resp.text}"
+
+        await create_event("test_event_finished")
+        resp = await post_bet(ac, {"event_id": "test_event_finished", "amount": "1.00"})
+        assert resp.status_code == 200, f"Response: {resp.status_code}, {resp.text}"
+
+        await create_event("test_event_finished", state="FINISHED_LOSE")
+        for _ in range(50):
+            resp = await ac.post("/bet", json={"event_id": "test_event_finished", "amount": "1.00"})
+            if resp.status_code == 400:
+                break
+            await asyncio.sleep(0.1)
+        assert resp.status_code == 400, f"Response: {resp.status_code}, {resp.text}"
+
+
+@pytest.mark.asyncio
+async def test_active_events_integration() -> None:
+    """
+    Тестирует /events: событие со ставкой в статусе NEW сразу
+    попадает в список активных событий.
+    """
+    await create_event("test_event_active")
+    async with AsyncClient(base_url=BET_MAKER_BASE_URL) as ac:
+        resp = await post_bet(ac, {"event_id": "test_event_active", "amount": "5.00"})
+        assert resp.status_code == 200, f"Response: {resp.status_code}, {resp.text}"
+
+        resp = await ac.get("/events")
+        assert resp.status_code == 200, f"Response: {resp.status_code}, {resp.text}"
+        assert "test_event_active" in resp.json()["active_events"]
+
+
+@pytest.mark.asyncio
+async def test_event_exposure_integration() -> None:
+    """
+    Тестирует /events/{id}/exposure: агрегат растёт на каждую ставку,
+    а ставка сохраняет коэффициент события на момент её создания.
+    """
+    event_id = f"test_event_exposure_{int(time.time() * 1000)}"
+    await create_event(event_id, coefficient="2.00")
+    async with AsyncClient(base_url=BET_MAKER_BASE_URL) as ac:
+        resp = await post_bet(ac, {"event_id": event_id, "amount": "10.00"})
+        assert resp.status_code == 200, f"Response: {resp.status_code}, {resp.text}"
+        assert Decimal(str(resp.json()["coefficient"])) == Decimal("2.00")
+
+        resp = await post_bet(ac, {"event_id": event_id, "amount": "5.00"})
+        assert resp.status_code == 200, f"Response: {resp.status_code}, {resp.text}"
+
+        resp = await ac.get(f"/events/{event_id}/exposure")
+        assert resp.status_code == 200, f"Response: {resp.status_code}, {resp.text}"
+        exposure = resp.json()
+        assert exposure["bet_count"] == 2
+        assert Decimal(str(exposure["stake_total"])) == Decimal("15.00")
+        assert Decimal(str(exposure["potential_payout"])) == Decimal("30.00")
+
+
+@pytest.mark.asyncio
+async def test_idempotent_bet_integration() -> None:
+    """
+    Тестирует POST /bet с Idempotency-Key: повторы (в том числе одновременные)
+    возвращают одну и ту же ставку, а ключ с другим телом запроса отклоняется.
+    """
+    event_id = f"test_event_idempotent_{int(time.time() * 1000)}"
+    headers = {"Idempotency-Key": f"{event_id}-key"}
+    bet_data = {"event_id": event_id, "amount": "10.00"}
+    await create_event(event_id)
+    async with AsyncClient(base_url=BET_MAKER_BASE_URL) as ac:
+        first = await post_bet(ac, bet_data, headers=headers)
+        assert first.status_code == 200, f"Response: {first.status_code}, {first.text}"
+
+        replays = await asyncio.gather(*(ac.post("/bet", json=bet_data, headers=headers) for _ in range(5)))
+        for resp in replays:
+            assert resp.status_code == 200, f"Response: {resp.status_code}, {resp.text}"
+            assert resp.json()["id"] == first.json()["id"]
+            assert resp.headers.get("Idempotent-Replayed") == "true"
+
+        resp = await ac.post("/bet", json={**bet_data, "amount": "11.00"}, headers=headers)
+        assert resp.status_code == 422, f"Response: {resp.status_code}, {resp.text}"
+
+        resp = await ac.get(f"/events/{event_id}/exposure")
+        assert resp.json()["bet_count"] == 1
+
+
+@pytest.mark.asyncio
+async def test_bet_lookup_integration() -> None:
+    """
+    Тестирует GET /bet/{id} и GET /bets?event_id=: ставки события видны
+    сразу после создания, а после завершения события — с новым статусом.
+    """
+    event_id = f"test_event_lookup_{int(time.time() * 1000)}"
+    await create_event(event_id)
+    async with AsyncClient(base_url=BET_MAKER_BASE_URL) as ac:
+        first = await post_bet(ac, {"event_id": event_id, "amount": "10.00"})
+        assert first.status_code == 200, f"Response: {first.status_code}, {first.text}"
+        bet_id = first.json()["id"]
+
+        resp = await ac.get(f"/bet/{bet_id}")
+        assert resp.status_code == 200, f"Response: {resp.status_code}, {resp.text}"
+        assert resp.json() == first.json()
+        resp = await ac.get("/bets", params={"event_id": event_id})
+        assert [bet["id"] for bet in resp.json()] == [bet_id]
+
+        second = await post_bet(ac, {"event_id": event_id, "amount": "5.00"})
+        resp = await ac.get("/bets", params={"event_id": event_id})
+        assert [bet["id"] for bet in resp.json()] == [bet_id, second.json()["id"]]
+
+        await create_event(event_id, state="FINISHED_WIN")
+        for _ in range(50):
+            resp = await ac.get(f"/bet/{bet_id}")
+            if resp.json()["status"] != "NEW":
+                break
+            await asyncio.sleep(0.1)
+        assert resp.json()["status"] == "WIN"
+        resp = await ac.get("/bets", params={"event_id": event_id})
+        assert {bet["status"] for bet in resp.json()} == {"WIN"}
+
+        resp = await ac.get("/bet/999999999")
+        assert resp.status_code == 404, f"Response: {resp.status_code}, {resp.text}"
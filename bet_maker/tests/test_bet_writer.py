@@ -0,0 +1,151 @@
+"""
+Тесты групповой записи ставок (BetBatchWriter): пачка закрывается по окну
+накопления или по размеру, каждый вызывающий получает свою ставку, ошибка
+записи пачки передаётся всем её участникам, а stop() дописывает очередь.
+
+БД не нужна: фабрика сессий заменена сессией, которая запоминает
+выполненные INSERT и возвращает строки в порядке параметров.
+"""
+import asyncio
+import decimal
+from typing import Any, Dict, List, Optional
+
+import pytest
+
+import bet_writer
+from bet_writer import BetBatchWriter
+
+
+class FakeResult:
+    def __init__(self, rows: List[Dict[str, Any]]) -> None:
+        self._rows = rows
+
+    def mappings(self) -> "FakeResult":
+        return self
+
+    def all(self) -> List[Dict[str, Any]]:
+        return self._rows
+
+
+class FakeDatabase:
+    """Фабрика сессий: запоминает пачки и выдаёт ставкам последовательные id."""
+
+    def __init__(self, error: Optional[Exception] = None) -> None:
+        self.batches: List[List[Dict[str, Any]]] = []
+        self.commits = 0
+        self.error = error
+        self._next_id = 1
+
+    def __call__(self) -> "FakeDatabase":
+        return self
+
+    async def __aenter__(self) -> "FakeDatabase":
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        return None
+
+    async def execute(self, statement: Any, params: List[Dict[str, Any]]) -> FakeResult:
+        if self.error is not None:
+            raise self.error
+        # INSERT ... RETURNING должен сохранять порядок параметров, иначе
+        # ставки достанутся не тем запросам
+        assert statement._sort_by_parameter_order
+        self.batches.append(params)
+        rows = []
+        for values in params:
+            rows.append({"id": self._next_id, "coefficient": None, **values})
+            self._next_id += 1
+        return FakeResult(rows)
+
+    async def commit(self) -> None:
+        self.commits += 1
+
+
+@pytest.fixture(autouse=True)
+def no_exposure(monkeypatch: pytest.MonkeyPatch) -> None:
+    async def add_bets_to_exposure(session: Any, bets: Any) -> None:
+        return None
+
+    monkeypatch.setattr(bet_writer, "add_bets_to_exposure", add_bets_to_exposure)
+
+
+def bet(event_id: str) -> Dict[str, Any]:
+    return {"event_id": event_id, "amount": decimal.Decimal("1.00"), "status": "NEW"}
+
+
+@pytest.mark.asyncio
+async def test_flush_by_window() -> None:
+    """Неполная пачка записывается одним INSERT по истечении окна накопления."""
+    database = FakeDatabase()
+    writer = BetBatchWriter(max_batch_size=100, batch_window=0.01, session_factory=database)
+    writer.start()
+
+    bets = await asyncio.wait_for(asyncio.gather(*(writer.submit(bet(str(i))) for i in range(3))), 1)
+    assert [b.event_id for b in bets] == ["0", "1", "2"]
+    assert [len(batch) for batch in database.batches] == [3]
+    assert database.commits == 1
+    await writer.stop()
+
+
+@pytest.mark.asyncio
+async def test_flush_by_size() -> None:
+    """Полная пачка записывается сразу, не дожидаясь окна накопления."""
+    database = FakeDatabase()
+    writer = BetBatchWriter(max_batch_size=2, batch_window=60, session_factory=database)
+    writer.start()
+
+    await asyncio.wait_for(asyncio.gather(*(writer.submit(bet(str(i))) for i in range(4))), 1)
+    assert [len(batch) for batch in database.batches] == [2, 2]
+    await writer.stop()
+
+
+@pytest.mark.asyncio
+async def test_each_caller_gets_own_bet() -> None:
+    """Каждый запрос получает строку, созданную по его параметрам, в порядке пачки."""
+    database = FakeDatabase()
+    writer = BetBatchWriter(max_batch_size=3, batch_window=0.01, session_factory=database)
+    writer.start()
+
+    event_ids = [f"event-{i}" for i in range(7)]
+    bets = await asyncio.wait_for(asyncio.gather(*(writer.submit(bet(e)) for e in event_ids)), 1)
+    assert [b.event_id for b in bets] == event_ids
+    assert [b.id for b in bets] == list(range(1, 8))
+    assert [[values["event_id"] for values in batch] for batch in database.batches] == [
+        event_ids[0:3], event_ids[3:6], event_ids[6:7],
+    ]
+    await writer.stop()
+
+
+@pytest.mark.asyncio
+async def test_failed_batch_fails_every_waiter() -> None:
+    """Ошибка записи пачки передаётся каждому её участнику; писатель продолжает работу."""
+    database = FakeDatabase(error=RuntimeError("database is down"))
+    writer = BetBatchWriter(max_batch_size=100, batch_window=0.01, session_factory=database)
+    writer.start()
+
+    results = await asyncio.wait_for(
+        asyncio.gather(*(writer.submit(bet(str(i))) for i in range(3)), return_exceptions=True), 1,
+    )
+    assert [str(r) for r in results] == ["database is down"] * 3
+    assert all(isinstance(r, RuntimeError) for r in results)
+
+    database.error = None
+    assert (await asyncio.wait_for(writer.submit(bet("after")), 1)).event_id == "after"
+    await writer.stop()
+
+
+@pytest.mark.asyncio
+async def test_stop_drains_pending() -> None:
+    """stop() дописывает ставки из очереди, не дожидаясь окна накопления."""
+    database = FakeDatabase()
+    writer = BetBatchWriter(max_batch_size=2, batch_window=60, session_factory=database)
+    writer.start()
+
+    submitted = [asyncio.create_task(writer.submit(bet(str(i)))) for i in range(5)]
+    await asyncio.sleep(0)
+    await asyncio.wait_for(writer.stop(), 1)
+
+    assert all(task.done() for task in submitted)
+    assert [task.result().event_id for task in submitted] == ["0", "1", "2", "3", "4"]
+    assert sum(len(batch) for batch in database.batches) == 5
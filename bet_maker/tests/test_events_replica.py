@@ -0,0 +1,25 @@
+"""
+Тесты локальной реплики событий: изменения, пришедшие не по порядку,
+не перезаписывают более новое состояние события.
+"""
+from schemas import Event
+from events_replica import EventsReplica
+
+
+def test_stale_update_is_dropped() -> None:
+    """Изменение старее применённого отбрасывается, более новое применяется."""
+    replica = EventsReplica()
+    assert replica.apply(Event(event_id="1", state="CLOSED"), updated_at=20)
+    assert not replica.apply(Event(event_id="1", state="NEW"), updated_at=10)
+    assert replica.events["1"].state == "CLOSED"
+
+    assert replica.apply(Event(event_id="1", state="FINISHED_WIN"), updated_at=30)
+    assert replica.events["1"].state == "FINISHED_WIN"
+
+
+def test_update_without_timestamp_is_applied() -> None:
+    """Сообщения старого формата (без времени изменения) применяются как есть."""
+    replica = EventsReplica()
+    replica.apply(Event(event_id="1", state="NEW"), updated_at=20)
+    assert replica.apply(Event(event_id="1", state="CLOSED"))
+    assert replica.events["1"].state == "CLOSED"
@@ -0,0 +1,91 @@
+"""
+Тесты идемпотентности POST /bet: повтор отвечает ставкой в момент создания,
+и ответ не зависит от того, нашёлся ключ в памяти (IdempotencyCache) или
+в БД (insert_bet_idempotent), даже если событие уже рассчитано.
+
+БД не нужна: сессия возвращает сохранённый ключ и текущую строку ставки.
+"""
+from decimal import Decimal
+from typing import Any, Dict, Optional
+
+import pytest
+from fastapi import HTTPException
+
+from idempotency import IdempotencyCache, insert_bet_idempotent
+from models import BetIdempotencyKey
+from schemas import BetDB
+
+CREATED = BetDB(id=7, event_id="1", amount=Decimal("10.00"), coefficient=Decimal("1.50"), status="NEW")
+
+
+class FakeRows:
+    def __init__(self, row: Optional[Dict[str, Any]]) -> None:
+        self._row = row
+
+    def mappings(self) -> "FakeRows":
+        return self
+
+    def first(self) -> Optional[Dict[str, Any]]:
+        return self._row
+
+
+class SettledDatabase:
+    """Фабрика сессий: ключ уже записан, а ставка по нему рассчитана (WIN)."""
+
+    def __init__(self, request_hash: str) -> None:
+        self.key = BetIdempotencyKey(key="key", bet_id=CREATED.id, request_hash=request_hash)
+
+    def __call__(self) -> "SettledDatabase":
+        return self
+
+    async def __aenter__(self) -> "SettledDatabase":
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        return None
+
+    async def get(self, model: Any, key: str) -> BetIdempotencyKey:
+        return self.key
+
+    async def execute(self, statement: Any) -> FakeRows:
+        return FakeRows({**CREATED.dict(), "status": "WIN"})
+
+
+def not_called() -> Dict[str, Any]:
+    raise AssertionError("a replay must not create a bet")
+
+
+@pytest.mark.asyncio
+async def test_database_replay_returns_creation_snapshot() -> None:
+    """Повтор из БД возвращает ставку в момент создания, а не рассчитанную строку."""
+    bet, replayed = await insert_bet_idempotent(not_called, "key", "hash", SettledDatabase("hash"))
+    assert replayed
+    assert bet == CREATED
+
+
+@pytest.mark.asyncio
+async def test_database_replay_rejects_other_request() -> None:
+    """Ключ с другим телом запроса отклоняется и при повторе из БД."""
+    with pytest.raises(HTTPException) as error:
+        await insert_bet_idempotent(not_called, "key", "other", SettledDatabase("hash"))
+    assert error.value.status_code == 422
+
+
+@pytest.mark.asyncio
+async def test_memory_and_database_replays_match() -> None:
+    """
+    Повтор из памяти процесса, создавшего ставку, и повтор другим процессом
+    (ключ только в БД) после расчёта события возвращают одинаковую ставку.
+    """
+    async def create() -> Any:
+        return CREATED, False
+
+    creator = IdempotencyCache()
+    assert await creator.get_or_create("key", "hash", create) == (CREATED, False)
+    from_memory = await creator.get_or_create("key", "hash", create)
+
+    other = IdempotencyCache()
+    from_database = await other.get_or_create(
+        "key", "hash", lambda: insert_bet_idempotent(not_called, "key", "hash", SettledDatabase("hash")),
+    )
+    assert from_memory == from_database == (CREATED, True)
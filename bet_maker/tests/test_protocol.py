@@ -0,0 +1,65 @@
+"""
+Тесты двоичного формата сообщений о событиях (protocol.py): кодирование
+и декодирование, объединение конвертов, проверка версии и разбор
+повреждённых сообщений.
+"""
+from decimal import Decimal
+
+import pytest
+
+import protocol
+from protocol import EventRecord
+
+RECORDS = [
+    EventRecord("1", "NEW", Decimal("1.50"), 1_700_000_000, 1_700_000_000_000_000_001),
+    EventRecord("событие:2", "FINISHED_WIN", None, None, 2),
+    EventRecord("3", None, Decimal("12.345"), 0, 3),
+]
+
+
+def test_round_trip() -> None:
+    """Записи восстанавливаются без потерь, включая пустые поля и не-ASCII event_id."""
+    body = protocol.encode(protocol.KIND_UPDATED, RECORDS)
+    assert protocol.decode(body) == (protocol.KIND_UPDATED, RECORDS)
+    assert protocol.decode(protocol.encode(protocol.KIND_CLOSED, [])) == (protocol.KIND_CLOSED, [])
+
+
+def test_merge_keeps_order() -> None:
+    """Объединённый конверт содержит записи всех конвертов в исходном порядке."""
+    bodies = [protocol.encode(protocol.KIND_FINISHED, [record]) for record in RECORDS]
+    assert protocol.decode(protocol.merge(bodies)) == (protocol.KIND_FINISHED, RECORDS)
+    with pytest.raises(ValueError):
+        protocol.merge([bodies[0], protocol.encode(protocol.KIND_UPDATED, RECORDS)])
+
+
+def test_content_type() -> None:
+    """Конверт распознаётся по content_type любой версии, старый формат — нет."""
+    assert protocol.is_envelope(protocol.content_type())
+    assert protocol.is_envelope("application/vnd.events.batch; v=2")
+    assert not protocol.is_envelope(None)
+    assert not protocol.is_envelope("application/json")
+
+
+def test_unsupported_version() -> None:
+    """Конверт другой версии и чужие данные отклоняются."""
+    body = bytearray(protocol.encode(protocol.KIND_UPDATED, RECORDS))
+    body[2] = protocol.PROTOCOL_VERSION + 1
+    with pytest.raises(ValueError, match="version"):
+        protocol.decode(bytes(body))
+    with pytest.raises(ValueError):
+        protocol.decode(b"{}" + bytes(body[2:]))
+
+
+@pytest.mark.parametrize("cut", range(1, 40))
+def test_truncated_input(cut: int) -> None:
+    """Обрезанный конверт (в любом месте) даёт ValueError, а не другую ошибку."""
+    body = protocol.encode(protocol.KIND_UPDATED, RECORDS)
+    with pytest.raises(ValueError):
+        protocol.decode(body[:-cut])
+
+
+def test_trailing_bytes() -> None:
+    """Лишние байты после записей считаются ошибкой."""
+    body = protocol.encode(protocol.KIND_UPDATED, RECORDS)
+    with pytest.raises(ValueError):
+        protocol.decode(body + b"\x00")
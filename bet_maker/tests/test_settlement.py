@@ -0,0 +1,155 @@
+"""
+Тесты разбора сообщений event.finished, повторов и dead-letter очереди
+(SettlementRetrier). RabbitMQ не нужен: канал и сообщения заменены
+простыми объектами, которые запоминают публикации и подтверждения.
+"""
+from typing import Any, Dict, List, Optional, Tuple
+
+import pytest
+
+import protocol
+from settlement import RETRY_HEADER, SettlementRetrier, parse_finish_message
+
+
+class RecordingExchange:
+    """Обменник по умолчанию: запоминает опубликованные сообщения."""
+
+    def __init__(self) -> None:
+        self.published: List[Tuple[str, Any]] = []
+
+    async def publish(self, message: Any, routing_key: str) -> None:
+        self.published.append((routing_key, message))
+
+
+class RecordingChannel:
+    """Канал: запоминает объявленные очереди и их аргументы."""
+
+    def __init__(self) -> None:
+        self.default_exchange = RecordingExchange()
+        self.queues: Dict[str, Optional[Dict[str, Any]]] = {}
+
+    async def declare_queue(self, name: str, durable: bool = False, arguments: Optional[Dict[str, Any]] = None) -> None:
+        assert durable
+        self.queues[name] = arguments
+
+
+class FakeMessage:
+    """Входящее сообщение с заголовками и признаком подтверждения."""
+
+    def __init__(self, retries: Optional[int] = None) -> None:
+        self.body = b"1:FINISHED_WIN"
+        self.content_type = None
+        self.headers = {} if retries is None else {RETRY_HEADER: retries}
+        self.acked = False
+
+    async def ack(self) -> None:
+        self.acked = True
+
+
+def make_retrier() -> Tuple[SettlementRetrier, RecordingChannel]:
+    channel = RecordingChannel()
+    retrier = SettlementRetrier(
+        channel, "events.finished", "events.finished.dlq",
+        max_retries=4, retry_delay=0.5, max_retry_delay=2.0,
+    )
+    return retrier, channel
+
+
+@pytest.mark.asyncio
+async def test_declare_retry_queues_with_backoff() -> None:
+    """
+    Очереди ожидания возвращают сообщения в основную очередь
+    с экспоненциально растущей (ограниченной сверху) задержкой.
+    """
+    retrier, channel = make_retrier()
+    await retrier.declare()
+
+    assert channel.queues.pop("events.finished.dlq") is None
+    assert {name: args["x-message-ttl"] for name, args in channel.queues.items()} == {
+        "events.finished.retry.1": 500,
+        "events.finished.retry.2": 1000,
+        "events.finished.retry.3": 2000,
+        "events.finished.retry.4": 2000,
+    }
+    for args in channel.queues.values():
+        assert args["x-dead-letter-exchange"] == ""
+        assert args["x-dead-letter-routing-key"] == "events.finished"
+
+
+@pytest.mark.asyncio
+async def test_retry_goes_to_delay_queue() -> None:
+    """Неудавшееся сообщение уходит в очередь ожидания следующей попытки и подтверждается."""
+    retrier, channel = make_retrier()
+    first, second = FakeMessage(), FakeMessage(retries=2)
+
+    await retrier.retry(first)
+    await retrier.retry(second)
+
+    (first_key, first_copy), (second_key, second_copy) = channel.default_exchange.published
+    assert first_key == "events.finished.retry.1"
+    assert first_copy.headers[RETRY_HEADER] == 1
+    assert second_key == "events.finished.retry.3"
+    assert second_copy.headers[RETRY_HEADER] == 3
+    assert first_copy.body == first.body
+    assert first.acked and second.acked
+
+
+@pytest.mark.asyncio
+async def test_retries_exhausted_go_to_dlq() -> None:
+    """После max_retries попыток сообщение перекладывается в dead-letter очередь."""
+    retrier, channel = make_retrier()
+    message = FakeMessage(retries=4)
+
+    await retrier.retry(message)
+
+    [(routing_key, copy)] = channel.default_exchange.published
+    assert routing_key == "events.finished.dlq"
+    assert copy.headers[RETRY_HEADER] == 4
+    assert message.acked
+
+
+@pytest.mark.asyncio
+async def test_dead_letter_skips_retries() -> None:
+    """Некорректное сообщение сразу уходит в dead-letter очередь."""
+    retrier, channel = make_retrier()
+    message = FakeMessage()
+
+    await retrier.dead_letter(message)
+
+    [(routing_key, copy)] = channel.default_exchange.published
+    assert routing_key == "events.finished.dlq"
+    assert copy.headers[RETRY_HEADER] == 0
+    assert message.acked
+
+
+@pytest.mark.parametrize("body, content_type", [
+    (b"1:FINISHED_WNI", None),
+    (b"1:NEW", None),
+    (b"no-state", None),
+    (protocol.encode(protocol.KIND_FINISHED, []), protocol.content_type()),
+    (
+        protocol.encode(protocol.KIND_FINISHED, [protocol.EventRecord("1", "CLOSED", None, None, 1)]),
+        protocol.content_type(),
+    ),
+    (
+        protocol.encode(protocol.KIND_UPDATED, [protocol.EventRecord("1", "FINISHED_WIN", None, None, 1)]),
+        protocol.content_type(),
+    ),
+])
+def test_parse_rejects_invalid_finish_messages(body: bytes, content_type: Optional[str]) -> None:
+    """
+    Неизвестное состояние и пустой конверт — ошибка разбора (сообщение уходит
+    в dead-letter очередь), а не расчёт ставок проигрышем.
+    """
+    with pytest.raises(ValueError):
+        parse_finish_message(body, content_type)
+
+
+def test_parse_finish_messages() -> None:
+    """Оба формата разбираются в пары (event_id, статус ставок)."""
+    assert parse_finish_message(b"a:b:FINISHED_LOSE") == [("a:b", "LOSE")]
+    body = protocol.encode(protocol.KIND_FINISHED, [
+        protocol.EventRecord("1", "FINISHED_WIN", None, None, 1),
+        protocol.EventRecord("2", "FINISHED_LOSE", None, None, 1),
+    ])
+    assert parse_finish_message(body, protocol.content_type()) == [("1", "WIN"), ("2", "LOSE")]
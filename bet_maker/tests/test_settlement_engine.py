@@ -0,0 +1,131 @@
+"""
+Тесты пакетного расчёта сообщений event.finished (SettlementEngine):
+пачки по размеру и по времени, подтверждение пачки одним ack(multiple=True)
+по последнему сообщению и повторная обработка по одному при ошибке пачки.
+
+RabbitMQ и БД не нужны: сообщения — простые объекты, запоминающие
+подтверждения, а settle_events заменяется записью вызовов.
+"""
+import asyncio
+from typing import Dict, List, Optional
+
+import pytest
+
+import settlement
+from settlement import SettlementEngine
+
+
+class FakeMessage:
+    """Входящее сообщение: запоминает подтверждение и его вид."""
+
+    def __init__(self, delivery_tag: int, body: bytes) -> None:
+        self.delivery_tag = delivery_tag
+        self.body = body
+        self.content_type = None
+        self.headers: Dict[str, object] = {}
+        self.acked: Optional[bool] = None
+
+    async def ack(self, multiple: bool = False) -> None:
+        self.acked = multiple
+
+
+def messages(count: int, start: int = 1) -> List[FakeMessage]:
+    return [FakeMessage(tag, f"{tag}:FINISHED_WIN".encode()) for tag in range(start, start + count)]
+
+
+@pytest.fixture
+def settled(monkeypatch: pytest.MonkeyPatch) -> List[Dict[str, str]]:
+    """Вызовы settle_events (по одному словарю settlements на вызов)."""
+    calls: List[Dict[str, str]] = []
+
+    async def settle_events(settlements: Dict[str, str]) -> set:
+        calls.append(dict(settlements))
+        return set(settlements)
+
+    monkeypatch.setattr(settlement, "settle_events", settle_events)
+    return calls
+
+
+async def no_single(message: FakeMessage) -> None:
+    raise AssertionError("batch should not fall back to single messages")
+
+
+@pytest.mark.asyncio
+async def test_batch_by_size(settled: List[Dict[str, str]]) -> None:
+    """Полная пачка рассчитывается сразу и подтверждается ack(multiple=True) последнего сообщения."""
+    engine = SettlementEngine(no_single, batch_size=3, batch_window=60)
+    batch = messages(4)
+    for message in batch:
+        await engine.on_message(message)
+
+    assert settled == [{"1": "WIN", "2": "WIN", "3": "WIN"}]
+    assert [m.acked for m in batch] == [None, None, True, None]
+    await engine.stop()
+    assert settled[-1] == {"4": "WIN"}
+    assert batch[-1].acked is True
+
+
+@pytest.mark.asyncio
+async def test_batch_by_window(settled: List[Dict[str, str]]) -> None:
+    """Неполная пачка рассчитывается по истечении batch_window."""
+    engine = SettlementEngine(no_single, batch_size=100, batch_window=0.01)
+    batch = messages(2)
+    for message in batch:
+        await engine.on_message(message)
+    assert settled == []
+
+    await asyncio.sleep(0.05)
+    assert settled == [{"1": "WIN", "2": "WIN"}]
+    assert [m.acked for m in batch] == [None, True]
+    assert engine._flush_task is None
+
+
+@pytest.mark.asyncio
+async def test_failed_batch_falls_back_to_single(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Если пачка не прошла, каждое её сообщение обрабатывается по отдельности, по порядку."""
+    async def fail(settlements: Dict[str, str]) -> set:
+        raise RuntimeError("database is down")
+
+    monkeypatch.setattr(settlement, "settle_events", fail)
+    single: List[int] = []
+
+    async def settle_one(message: FakeMessage) -> None:
+        single.append(message.delivery_tag)
+
+    engine = SettlementEngine(settle_one, batch_size=3, batch_window=60)
+    batch = messages(3)
+    for message in batch:
+        await engine.on_message(message)
+
+    assert single == [1, 2, 3]
+    assert [m.acked for m in batch] == [None, None, None]
+
+
+@pytest.mark.asyncio
+async def test_malformed_message_falls_back_to_single(settled: List[Dict[str, str]]) -> None:
+    """Некорректное сообщение не рассчитывает пачку, а уходит в обработку по одному."""
+    single: List[int] = []
+
+    async def settle_one(message: FakeMessage) -> None:
+        single.append(message.delivery_tag)
+
+    engine = SettlementEngine(settle_one, batch_size=2, batch_window=60)
+    await engine.on_message(FakeMessage(1, b"1:FINISHED_WIN"))
+    await engine.on_message(FakeMessage(2, b"2:FINISHED_WNI"))
+
+    assert settled == []
+    assert single == [1, 2]
+
+
+@pytest.mark.asyncio
+async def test_stop_cancels_timer_and_flushes(settled: List[Dict[str, str]]) -> None:
+    """stop() отменяет таймер и рассчитывает накопленные сообщения."""
+    engine = SettlementEngine(no_single, batch_size=100, batch_window=60)
+    batch = messages(2)
+    for message in batch:
+        await engine.on_message(message)
+
+    await engine.stop()
+    assert engine._timer is None
+    assert settled == [{"1": "WIN", "2": "WIN"}]
+    assert batch[-1].acked is True
@@ -16,4 +16,4 @@ done
 echo "RabbitMQ is up - starting line_provider"
 
 # Запуск приложения
-exec uvicorn main:app --host 0.0.0.0 --port 8000
\ No newline at end of file
+exec uvicorn main:app --host 0.0.0.0 --port 8000 --workers "${LINE_PROVIDER_WORKERS:-1}"
\ No newline at end of file
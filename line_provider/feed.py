@@ -0,0 +1,131 @@
+"""
+Модуль потоковой рассылки изменений событий (feed) line_provider.
+
+Каждое изменение хранилища получает порядковый номер (seq) и один раз
+сериализуется в JSON. Последние изменения хранятся в кольцевом буфере,
+чтобы переподключившийся подписчик мог продолжить с последнего полученного
+номера, не запрашивая полный снимок.
+
+У каждого подписчика своя ограниченная очередь. Запись в неё не ждёт
+подписчика: если очередь переполнена, она очищается, а подписчик получает
+новый снимок вместо пропущенных изменений. Поэтому медленный подписчик
+не задерживает PUT /event.
+"""
+import asyncio
+import uuid
+from collections import deque
+from typing import Deque, List, Optional, Set, Tuple
+
+from schemas import Event
+from store import event_to_json
+
+#: Изменение: (seq, JSON события)
+FeedItem = Tuple[int, str]
+
+
+class FeedSubscriber:
+    """Ограниченная очередь изменений одного подписчика."""
+
+    def __init__(self, maxsize: int) -> None:
+        """
+        :param maxsize: Максимальное количество неотправленных изменений.
+        """
+        #: Изменения; None означает, что подписчику нужен новый снимок
+        self.queue: "asyncio.Queue[Optional[FeedItem]]" = asyncio.Queue(maxsize)
+
+    def push(self, item: FeedItem) -> None:
+        """Ставит изменение в очередь; при переполнении запрашивает новый снимок."""
+        try:
+            self.queue.put_nowait(item)
+        except asyncio.QueueFull:
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(None)
+
+
+class EventFeed:
+    """
+    Лента изменений событий с номерами и буфером для продолжения.
+
+    Номера уникальны в пределах экземпляра ленты; курсор подписчика включает
+    идентификатор ленты (epoch), поэтому курсор от другого процесса или
+    до перезапуска не принимается, и подписчик получает снимок.
+    """
+
+    def __init__(self, history_size: int = 10000, queue_size: int = 1000) -> None:
+        """
+        :param history_size: Сколько последних изменений хранится для продолжения.
+        :param queue_size: Размер очереди каждого подписчика.
+        """
+        self.queue_size = queue_size
+        self.epoch: str = uuid.uuid4().hex[:8]
+        self.seq: int = 0
+        self._history: Deque[FeedItem] = deque(maxlen=history_size)
+        self._subscribers: Set[FeedSubscriber] = set()
+
+    def __len__(self) -> int:
+        return len(self._subscribers)
+
+    def publish(self, event: Event) -> None:
+        """
+        Добавляет изменение события в ленту и рассылает его подписчикам.
+
+        :param event: Событие после изменения.
+        """
+        self.seq += 1
+        item = (self.seq, event_to_json(event).decode())
+        self._history.append(item)
+        for subscriber in self._subscribers:
+            subscriber.push(item)
+
+    def cursor(self, seq: int) -> str:
+        """Курсор для продолжения после изменения seq (id сообщения SSE)."""
+        return f"{self.epoch}-{seq}"
+
+    def parse_cursor(self, cursor: Optional[str]) -> Optional[int]:
+        """
+        Возвращает seq из курсора этой ленты.
+
+        :param cursor: Курсор, полученный подписчиком ранее.
+        :return: seq или None, если курсор не от этой ленты.
+        """
+        if not cursor:
+            return None
+        epoch, _, seq = cursor.rpartition("-")
+        if epoch != self.epoch or not seq.isdigit() or int(seq) > self.seq:
+            return None
+        return int(seq)
+
+    def since(self, seq: int) -> Optional[List[FeedItem]]:
+        """
+        Изменения после seq из буфера.
+
+        :param seq: Номер последнего полученного подписчиком изменения.
+        :return: Изменения или None, если часть из них уже вытеснена из буфера.
+        """
+        if seq == self.seq:
+            return []
+        if not self._history or self._history[0][0] > seq + 1:
+            return None
+        return [item for item in self._history if item[0] > seq]
+
+    def subscribe(self) -> FeedSubscriber:
+        """Регистрирует подписчика; в его очередь попадут изменения после текущего seq."""
+        subscriber = FeedSubscriber(self.queue_size)
+        self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: FeedSubscriber) -> None:
+        self._subscribers.discard(subscriber)
+
+
+def sse_message(event: str, data: str, cursor: Optional[str] = None) -> bytes:
+    """
+    Кодирует сообщение Server-Sent Events.
+
+    :param event: Тип сообщения ("snapshot" или "update").
+    :param data: Данные (JSON в одну строку).
+    :param cursor: id сообщения (курсор для Last-Event-ID).
+    """
+    header = f"id: {cursor}\n" if cursor else ""
+    return f"{header}event: {event}\ndata: {data}\n\n".encode()
@@ -3,21 +3,55 @@
 которое отвечает за хранение и обновление событий (Event),
 а также рассылку сообщений о завершении (FINISHED) в RabbitMQ.
 """
+import os
 import time
 import decimal
 import asyncio
 import logging
 
-from fastapi import FastAPI, Path, HTTPException
-from typing import Dict, Any
-from aio_pika import connect_robust, Message, ExchangeType
+import orjson
+from fastapi import FastAPI, Header, Path, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from typing import AsyncIterator, Dict, Any, List, Optional
+from aio_pika import connect_robust, ExchangeType
+from pydantic import ValidationError
 
 from schemas import Event, EventState
+from store import EventStore
+from persistence import EventChange, create_persistence
+from outbox import Outbox, OutboxMessage
+from feed import EventFeed, sse_message
+from scheduler import DeadlineScheduler
+from http_cache import cached_json_response
+import protocol
+import metrics
 
 # Локальное in-memory хранилище событий:
-events: Dict[str, Event] = {}
+store = EventStore()
+# Слой персистентности хранилища (журнал + снимки или общая база воркеров,
+# если задан EVENTS_DATA_DIR)
+persistence = create_persistence()
+# Исходящие сообщения в RabbitMQ (публикуются фоновой задачей)
+outbox = Outbox(batch_size=int(os.getenv("OUTBOX_BATCH_SIZE", "100")))
+# Планировщик закрытия событий по дедлайну (работает только у воркера-лидера).
+# max_sleep — период, с которым он догоняет события других воркеров при общем хранилище
+scheduler = DeadlineScheduler(
+    on_due=lambda event_ids: close_expired_events(event_ids),
+    max_sleep=float(os.getenv("DEADLINE_SCHEDULER_MAX_SLEEP", "1")),
+    before_tick=lambda: persistence.refresh(store),
+)
+# Лента изменений событий для GET /events/stream
+feed = EventFeed(
+    history_size=int(os.getenv("FEED_HISTORY_SIZE", "10000")),
+    queue_size=int(os.getenv("FEED_QUEUE_SIZE", "1000")),
+)
 
 app = FastAPI()
+metrics.install(app)
+metrics.Gauge("outbox_pending_messages", "Сообщения outbox, ожидающие подтверждения", lambda: len(outbox))
+metrics.Gauge("feed_subscribers", "Подписчики GET /events/stream", lambda: len(feed))
+metrics.Gauge("events_total", "События в хранилище", lambda: len(store))
+metrics.Gauge("scheduled_deadlines", "События, ожидающие закрытия по дедлайну", lambda: len(scheduler))
 
 # Логгер
 logger = logging.getLogger("line_provider")
@@ -28,77 +62,210 @@ RABBITMQ_HOST: str = "rabbitmq"
 RABBITMQ_PORT: int = 5672
 EXCHANGE_NAME: str = "events_exchange"
 ROUTING_KEY: str = "event.finished"
+UPDATED_ROUTING_KEY: str = "event.updated"
+# Двоичные конверты (protocol.py) публикуются с отдельными ключами маршрутизации,
+# поэтому получатели старого формата их не видят
+ENVELOPE_ROUTING_KEY: str = "event.finished.v1"
+ENVELOPE_UPDATED_ROUTING_KEY: str = "event.updated.v1"
+ENVELOPE_CLOSED_ROUTING_KEY: str = "event.closed.v1"
+ENVELOPE_ROUTING_KEYS: Dict[int, str] = {
+    protocol.KIND_UPDATED: ENVELOPE_UPDATED_ROUTING_KEY,
+    protocol.KIND_FINISHED: ENVELOPE_ROUTING_KEY,
+    protocol.KIND_CLOSED: ENVELOPE_CLOSED_ROUTING_KEY,
+}
+# Публикуемые форматы сообщений: legacy ("event_id:STATE" и JSON) и/или envelope
+EVENT_MESSAGE_FORMATS: List[str] = [
+    f.strip() for f in os.getenv("EVENT_MESSAGE_FORMATS", "legacy,envelope").split(",") if f.strip()
+]
+
+# Максимальное количество событий в одном PUT /events:batch
+EVENTS_BATCH_MAX_SIZE: int = int(os.getenv("EVENTS_BATCH_MAX_SIZE", "10000"))
+
+# Настройки ленты изменений
+FEED_HEARTBEAT_SECONDS: float = float(os.getenv("FEED_HEARTBEAT_SECONDS", "15"))
+FEED_REFRESH_MS: int = int(os.getenv("FEED_REFRESH_MS", "100"))
 
 
 @app.on_event("startup")
 async def startup_event() -> None:
     """
-    При запуске приложения соединяемся с RabbitMQ и создаём обменник.
-    Также создаём несколько тестовых событий в памяти.
+    При запуске приложения восстанавливаем события и неотправленные сообщения
+    из слоя персистентности, соединяемся с RabbitMQ, создаём обменник
+    и запускаем публикатор outbox.
+    Если сохранённых событий нет, воркер-лидер создаёт несколько тестовых событий.
     """
+    persistence.load(store, outbox)
+    persistence.on_leader = start_leader_duties
+    await persistence.start(store, outbox)
+    # Изменения, восстановленные при загрузке, в ленту не попадают
+    store.on_change = on_store_change
+    app.state.feed_refresh_task = asyncio.create_task(refresh_feed())
+    logger.info("Restored %d events and %d outbox messages from storage.", len(store), len(outbox))
+
     app.state.rabbit_connection = await connect_robust(
         host=RABBITMQ_HOST,
         port=RABBITMQ_PORT
     )
     channel = await app.state.rabbit_connection.channel()
     app.state.exchange = await channel.declare_exchange(EXCHANGE_NAME, ExchangeType.TOPIC)
+    outbox.start(app.state.exchange)
     logger.info("Connected to RabbitMQ and declared exchange.")
 
-    # Инициируем несколько тестовых событий в память
-    events["1"] = Event(
-        event_id="1",
-        coefficient=decimal.Decimal("1.20"),
-        deadline=int(time.time()) + 600,
-        state=EventState.NEW
-    )
-    events["2"] = Event(
-        event_id="2",
-        coefficient=decimal.Decimal("1.15"),
-        deadline=int(time.time()) + 60,
-        state=EventState.NEW
-    )
-    events["3"] = Event(
-        event_id="3",
-        coefficient=decimal.Decimal("1.67"),
-        deadline=int(time.time()) + 90,
-        state=EventState.NEW
+    if persistence.is_leader:
+        start_leader_duties()
+
+    if len(store) or not persistence.is_leader:
+        return
+
+    # Инициируем несколько тестовых событий
+    seed_events = [
+        Event(
+            event_id="1",
+            coefficient=decimal.Decimal("1.20"),
+            deadline=int(time.time()) + 600,
+            state=EventState.NEW
+        ),
+        Event(
+            event_id="2",
+            coefficient=decimal.Decimal("1.15"),
+            deadline=int(time.time()) + 60,
+            state=EventState.NEW
+        ),
+        Event(
+            event_id="3",
+            coefficient=decimal.Decimal("1.67"),
+            deadline=int(time.time()) + 90,
+            state=EventState.NEW
+        ),
+    ]
+    await persistence.commit(
+        lambda: [EventChange(*store.upsert(seed_event), []) for seed_event in seed_events]
     )
 
 
+def start_leader_duties() -> None:
+    """
+    Запускает планировщик дедлайнов у воркера-лидера (при старте или когда
+    воркер становится лидером вместо завершившегося). События закрывает один
+    воркер; все известные события планируются сразу.
+    """
+    persistence.refresh(store)
+    for event in list(store.events.values()):
+        scheduler.schedule(event)
+    scheduler.start()
+
+
 @app.on_event("shutdown")
 async def shutdown_event() -> None:
     """
-    При остановке приложения корректно закрываем соединение с RabbitMQ.
+    При остановке приложения останавливаем публикатор outbox, дописываем
+    журнал событий и корректно закрываем соединение с RabbitMQ.
     """
+    app.state.feed_refresh_task.cancel()
+    await scheduler.stop()
+    await outbox.stop()
+    await persistence.stop()
     await app.state.rabbit_connection.close()
     logger.info("Disconnected from RabbitMQ.")
 
 
 @app.get("/events")
-async def get_events() -> Any:
+async def get_events(if_none_match: Optional[str] = Header(None)) -> Response:
     """
     Возвращает список не истёкших событий (deadline ещё не наступил).
 
+    Выборка идёт по индексу дедлайнов хранилища, а готовый JSON
+    переиспользуется, пока хранилище не изменилось. Ответ содержит ETag;
+    при совпадении If-None-Match возвращается 304 без тела.
+
+    :param if_none_match: ETag ранее полученного ответа.
     :return: Список событий (Event), у которых deadline > текущее время.
     """
-    now = int(time.time())
-    active_events = [
-        e for e in events.values() if e.deadline and e.deadline > now
-    ]
-    return active_events
+    persistence.refresh(store)
+    return cached_json_response(
+        store.active_events_json(), store.active_events_etag(), if_none_match
+    )
+
+
+@app.get("/events/stream")
+async def stream_events(
+    since: Optional[str] = Query(None, description="Курсор последнего полученного изменения"),
+    last_event_id: Optional[str] = Header(None),
+) -> StreamingResponse:
+    """
+    Поток изменений событий (Server-Sent Events).
+
+    Первым сообщением ("snapshot") приходит список активных событий, затем
+    сообщения "update" с событием целиком после каждого изменения. id каждого
+    сообщения — курсор: при переподключении с ним (параметр since или заголовок
+    Last-Event-ID) поток продолжается с пропущенных изменений без снимка,
+    если они ещё в буфере ленты.
+
+    :param since: Курсор, с которого продолжить поток.
+    :param last_event_id: Курсор из заголовка Last-Event-ID (переподключение EventSource).
+    :return: Поток text/event-stream.
+    """
+    persistence.refresh(store)
+    seq = feed.parse_cursor(since or last_event_id)
+    backlog = feed.since(seq) if seq is not None else None
+    # Подписка и снимок без await между ними: очередь получит все изменения после снимка
+    subscriber = feed.subscribe()
+    snapshot = store.active_events_json() if backlog is None else None
+    snapshot_seq = feed.seq
+
+    async def stream() -> AsyncIterator[bytes]:
+        last_seq = snapshot_seq
+        try:
+            if snapshot is not None:
+                yield sse_message("snapshot", snapshot.decode(), feed.cursor(snapshot_seq))
+            for item_seq, data in backlog or ():
+                yield sse_message("update", data, feed.cursor(item_seq))
+
+            while True:
+                try:
+                    item = await asyncio.wait_for(subscriber.queue.get(), FEED_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield b": ping\n\n"
+                    continue
+
+                if item is None:
+                    # Подписчик отстал и его очередь сброшена: отправляем новый снимок
+                    last_seq = feed.seq
+                    yield sse_message("snapshot", store.active_events_json().decode(), feed.cursor(last_seq))
+                    continue
+                item_seq, data = item
+                if item_seq > last_seq:
+                    last_seq = item_seq
+                    yield sse_message("update", data, feed.cursor(item_seq))
+        finally:
+            feed.unsubscribe(subscriber)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
 
 @app.get("/event/{event_id}")
-async def get_event(event_id: str = Path(...)) -> Event:
+async def get_event(
+    event_id: str = Path(...),
+    if_none_match: Optional[str] = Header(None),
+) -> Response:
     """
     Получить информацию об одном событии по его event_id.
 
+    Ответ содержит ETag; при совпадении If-None-Match возвращается 304 без тела.
+
     :param event_id: Идентификатор события (строка).
+    :param if_none_match: ETag ранее полученного ответа.
     :return: Объект события (Event).
     :raises HTTPException 404: если событие не найдено.
     """
-    if event_id in events:
-        return events[event_id]
+    persistence.refresh(store)
+    cached = store.event_json(event_id)
+    if cached is not None:
+        return cached_json_response(*cached, if_none_match)
     raise HTTPException(status_code=404, detail="Event not found")
 
 
@@ -109,44 +276,274 @@ async def create_or_update_event(event: Event) -> Dict[str, str]:
 
     - Если событие не существует, оно будет создано.
     - Если обновляется состояние на FINISHED_WIN или FINISHED_LOSE,
-      происходит отправка уведомления в RabbitMQ.
+      в outbox ставится уведомление о завершении для RabbitMQ.
+    - При любом изменении в outbox ставится актуальное состояние события
+      (для реплик событий в bet_maker).
+
+    Изменение применяется слоем персистентности: при нескольких воркерах —
+    поверх последнего общего состояния события. Уведомление о завершении
+    записывается в журнал вместе с изменением события,
+    а публикуется фоновым публикатором outbox, поэтому время ответа
+    не зависит от брокера.
 
     :param event: Объект события (Event).
     :return: Словарь с полем "detail" о результате операции.
     """
-    existed_event = events.get(event.event_id)
+    def mutate() -> List[EventChange]:
+        existed_event, created = store.upsert(event)
+        # Если обновили статус и он FINISHED, отправляем уведомление
+        finished = [existed_event] if is_finished(existed_event, created) else []
+        return [EventChange(existed_event, created, event_messages([existed_event], finished))]
 
-    if not existed_event:
-        # Создаём новое событие
-        events[event.event_id] = event
-        logger.info(f"Created new event: {event}")
+    # Ответ отправляется только после надёжной записи изменения в журнал;
+    # сообщения изменения слой персистентности сам ставит в outbox
+    existed_event, created, _ = (await persistence.commit(mutate))[0]
+
+    if created:
+        logger.info("Created new event: %s", existed_event.event_id)
         return {"detail": "Event created"}
-    else:
-        # Обновляем существующее
-        for field, value in event.dict(exclude_unset=True).items():
-            setattr(existed_event, field, value)
 
-        # Если обновили статус и он FINISHED, отправляем уведомление
-        if existed_event.state in (EventState.FINISHED_WIN, EventState.FINISHED_LOSE):
-            await send_event_finished_notification(existed_event)
+    logger.info("Updated event: %s", existed_event.event_id)
+    return {"detail": "Event updated"}
+
+
+@app.put("/events:batch")
+async def upsert_events_batch(request: Request) -> Dict[str, Any]:
+    """
+    Создать или обновить пачку событий одним запросом.
 
-        logger.info(f"Updated event: {existed_event}")
-        return {"detail": "Event updated"}
+    Тело — JSON-массив событий (как в PUT /event) либо, при
+    Content-Type: application/x-ndjson, по одному событию в строке (NDJSON
+    разбирается по мере получения тела). Все события проверяются до применения;
+    если хотя бы одно некорректно, не применяется ни одно (422).
 
+    Пачка применяется к хранилищу одним изменением слоя персистентности
+    (одна запись журнала или одна транзакция общей базы). В двоичном формате
+    актуальные состояния всех событий публикуются одним конвертом, а уведомления
+    о завершении — другим; в старом формате — по сообщению на событие.
 
-async def send_event_finished_notification(event: Event) -> None:
+    :param request: HTTP-запрос с пачкой событий.
+    :return: Количество созданных и обновлённых событий.
+    :raises HTTPException 413: если событий больше EVENTS_BATCH_MAX_SIZE.
+    :raises HTTPException 422: если тело или одно из событий некорректно.
     """
-    Отправить уведомление о завершённом событии в RabbitMQ.
+    events = await read_events_batch(request)
+
+    def mutate() -> List[EventChange]:
+        changes = [EventChange(*store.upsert(event), []) for event in events]
+        # Событие может встречаться в пачке несколько раз: публикуется его итоговое состояние
+        updated = {change.event.event_id: change.event for change in changes}
+        finished = {
+            change.event.event_id: change.event
+            for change in changes if is_finished(change.event, change.created)
+        }
+        if changes:
+            changes[-1].messages.extend(
+                event_messages(list(updated.values()), list(finished.values()))
+            )
+        return changes
+
+    changes = await persistence.commit(mutate)
+
+    created = sum(1 for change in changes if change.created)
+    logger.info("Applied batch of %d events (%d created).", len(changes), created)
+    return {"detail": "Events applied", "created": created, "updated": len(changes) - created}
+
+
+async def read_events_batch(request: Request) -> List[Event]:
+    """
+    Читает и проверяет события тела PUT /events:batch (JSON-массив или NDJSON).
+
+    :param request: HTTP-запрос.
+    :return: События в порядке следования в теле.
+    :raises HTTPException 413: если событий больше EVENTS_BATCH_MAX_SIZE.
+    :raises HTTPException 422: если тело или одно из событий некорректно.
+    """
+    def parse(index: int, item: Any) -> Event:
+        try:
+            return Event.parse_obj(item)
+        except ValidationError as e:
+            raise HTTPException(status_code=422, detail=[{"index": index, "errors": e.errors()}])
+
+    def check_size(count: int) -> None:
+        if count > EVENTS_BATCH_MAX_SIZE:
+            raise HTTPException(
+                status_code=413, detail=f"Batch exceeds {EVENTS_BATCH_MAX_SIZE} events"
+            )
+
+    try:
+        if request.headers.get("content-type", "").startswith("application/x-ndjson"):
+            events: List[Event] = []
+            buffer = b""
+            async for chunk in request.stream():
+                *lines, buffer = (buffer + chunk).split(b"\n")
+                for line in lines:
+                    if line.strip():
+                        events.append(parse(len(events), orjson.loads(line)))
+                check_size(len(events))
+            if buffer.strip():
+                events.append(parse(len(events), orjson.loads(buffer)))
+        else:
+            items = orjson.loads(await request.body())
+            if not isinstance(items, list):
+                raise HTTPException(status_code=422, detail="Expected a JSON array of events")
+            check_size(len(items))
+            events = [parse(index, item) for index, item in enumerate(items)]
+    except orjson.JSONDecodeError as e:
+        raise HTTPException(status_code=422, detail=f"Invalid JSON: {e}")
+
+    check_size(len(events))
+    return events
+
+
+def on_store_change(event: Event) -> None:
+    """
+    Колбэк хранилища после каждого изменения события: лента изменений
+    и планировщик дедлайнов (у воркера-лидера).
+
+    :param event: Событие после изменения.
+    """
+    feed.publish(event)
+    if persistence.is_leader:
+        scheduler.schedule(event)
+
+
+async def refresh_feed() -> None:
+    """
+    Пока есть подписчики ленты, периодически догоняет изменения других
+    воркеров (при общем хранилище), чтобы они тоже попадали в поток.
+    """
+    while True:
+        await asyncio.sleep(FEED_REFRESH_MS / 1000)
+        if len(feed):
+            persistence.refresh(store)
+
+
+def is_finished(event: Event, created: bool) -> bool:
+    """
+    Нужно ли уведомление о завершении после изменения события.
+
+    :param event: Событие после изменения.
+    :param created: Событие было создано этим изменением.
+    :return: True, если существующее событие переведено в FINISHED_WIN или FINISHED_LOSE.
+    """
+    return not created and event.state in (EventState.FINISHED_WIN, EventState.FINISHED_LOSE)
+
+
+def event_messages(updated: List[Event], finished: List[Event]) -> List[OutboxMessage]:
+    """
+    Сообщения об изменении событий в форматах EVENT_MESSAGE_FORMATS.
+
+    В старом формате — по сообщению на событие; в двоичном — один конверт
+    с актуальными состояниями всех событий и один со всеми завершёнными.
+
+    :param updated: События после применения изменений.
+    :param finished: Только что завершённые события (нужно уведомление о завершении).
+    :return: Сообщения outbox.
+    """
+    messages = []
+    if "legacy" in EVENT_MESSAGE_FORMATS:
+        messages.extend(event_updated_message(event) for event in updated)
+        messages.extend(event_finished_message(event) for event in finished)
+    if "envelope" in EVENT_MESSAGE_FORMATS:
+        messages.append(envelope_message(protocol.KIND_UPDATED, updated))
+        if finished:
+            messages.append(envelope_message(protocol.KIND_FINISHED, finished))
+    return messages
+
+
+def envelope_message(kind: int, events: List[Event]) -> OutboxMessage:
+    """
+    Изменения событий в одном двоичном конверте (protocol.py).
+
+    Outbox объединяет конверты одного вида, попавшие в одну пачку публикации,
+    в одно сообщение. Конверты о завершении и закрытии долговечны (как и сообщение
+    "event_id:STATE"), конверт с актуальным состоянием — нет.
+
+    :param kind: protocol.KIND_UPDATED, protocol.KIND_FINISHED или protocol.KIND_CLOSED.
+    :param events: События после применения изменений.
+    :return: Сообщение outbox.
+    """
+    updated_at = time.time_ns()
+    records = [
+        protocol.EventRecord(
+            event_id=event.event_id,
+            state=event.state.value if event.state is not None else None,
+            coefficient=event.coefficient,
+            deadline=event.deadline,
+            updated_at=updated_at,
+        )
+        for event in events
+    ]
+    return OutboxMessage(
+        routing_key=ENVELOPE_ROUTING_KEYS[kind],
+        body=protocol.encode(kind, records),
+        content_type=protocol.content_type(),
+        durable=kind != protocol.KIND_UPDATED,
+    )
+
+
+async def close_expired_events(event_ids: List[str]) -> None:
+    """
+    Закрывает приём ставок на события с наступившим дедлайном (состояние CLOSED).
+
+    Все события одного пробуждения планировщика закрываются одним изменением
+    хранилища, а уведомление "betting closed" публикуется одним конвертом
+    (event.closed.v1) на все закрытые события. В старом формате закрытие
+    не публикуется: его получатели и так отклоняют ставки по deadline.
+
+    :param event_ids: События, дедлайн которых наступил.
+    """
+    def mutate() -> List[EventChange]:
+        now = int(time.time())
+        changes = []
+        for event_id in event_ids:
+            event = store.get(event_id)
+            # Событие могли изменить после планирования (в том числе другие воркеры)
+            if event is None or event.state != EventState.NEW or not event.deadline or event.deadline > now:
+                continue
+            closed, _ = store.upsert(Event(event_id=event_id, state=EventState.CLOSED))
+            changes.append(EventChange(closed, False, []))
+        if changes and "envelope" in EVENT_MESSAGE_FORMATS:
+            # Уведомление "betting closed": один конверт на все закрытые события
+            changes[-1].messages.append(
+                envelope_message(protocol.KIND_CLOSED, [c.event for c in changes])
+            )
+        return changes
+
+    changes = await persistence.commit(mutate)
+    if changes:
+        logger.info("Closed betting on %d events.", len(changes))
+
+
+def event_finished_message(event: Event) -> OutboxMessage:
+    """
+    Уведомление о завершённом событии для RabbitMQ.
 
     Формат сообщения: "event_id:FINISHED_WIN" или "event_id:FINISHED_LOSE".
 
     :param event: Объект события (Event), у которого статус FINISHED.
+    :return: Долговечное сообщение outbox.
+    """
+    message_body = f"{event.event_id}:{event.state.value}"
+    return OutboxMessage(routing_key=ROUTING_KEY, body=message_body.encode())
+
+
+def event_updated_message(event: Event) -> OutboxMessage:
+    """
+    Актуальное состояние созданного или изменённого события для RabbitMQ.
+
+    Сообщение содержит событие целиком в JSON, поэтому получатель
+    может просто заменить свою копию, не применяя частичных изменений.
+    Сообщение не сохраняется в журнал: после перезапуска реплики
+    в bet_maker всё равно перечитывают события целиком.
+
+    :param event: Объект события (Event) после применения изменений.
+    :return: Недолговечное сообщение outbox.
     """
-    exchange = app.state.exchange
-    message_body = f"{event.event_id}:{event.state}"
-    message = Message(message_body.encode())
-    # Публикуем сообщение в топик-экчендж с routing_key
-    await exchange.publish(message, routing_key=ROUTING_KEY)
-    logger.info(
-        f"Sent finish notification for event {event.event_id} with state {event.state}"
+    return OutboxMessage(
+        routing_key=UPDATED_ROUTING_KEY,
+        body=event.json().encode(),
+        content_type="application/json",
+        durable=False,
     )
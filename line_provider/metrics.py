@@ -0,0 +1,196 @@
+"""
+Модуль метрик в текстовом формате Prometheus.
+
+Метрики включаются переменной окружения METRICS_ENABLED. Когда они
+выключены, эндпоинт /metrics и middleware не регистрируются, а места
+замеров проверяют флаг METRICS_ENABLED до обращения к часам, поэтому
+инструментирование ничего не стоит.
+
+Счётчики и гистограммы — простые структуры в памяти процесса
+(приложение однопоточное, блокировки не нужны).
+"""
+import bisect
+import os
+import time
+from typing import Callable, Dict, List, Sequence, Tuple
+
+from fastapi import FastAPI, Response
+
+#: Включены ли метрики
+METRICS_ENABLED: bool = os.getenv("METRICS_ENABLED", "false").lower() in ("1", "true", "yes")
+
+#: Границы корзин гистограмм задержек по умолчанию (секунды)
+DEFAULT_BUCKETS: Tuple[float, ...] = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+_REGISTRY: List["_Metric"] = []
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        _REGISTRY.append(self)
+
+    def render(self) -> List[str]:
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type_name}",
+        ] + self._samples()
+
+    def _samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class Counter(_Metric):
+    """Монотонный счётчик."""
+
+    type_name = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labelvalues: str, amount: float = 1.0) -> None:
+        self._values[labelvalues] = self._values.get(labelvalues, 0.0) + amount
+
+    def _samples(self) -> List[str]:
+        return [
+            f"{self.name}{_labels(self.labelnames, key)} {value}"
+            for key, value in self._values.items()
+        ]
+
+
+class Gauge(_Metric):
+    """Значение, читаемое функцией в момент запроса /metrics."""
+
+    type_name = "gauge"
+
+    def __init__(self, name: str, documentation: str, read: Callable[[], float]) -> None:
+        super().__init__(name, documentation)
+        self._read = read
+
+    def _samples(self) -> List[str]:
+        return [f"{self.name} {self._read()}"]
+
+
+class Histogram(_Metric):
+    """Гистограмма с фиксированными корзинами."""
+
+    type_name = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        # По ключу меток: [счётчики корзин (+Inf последней)], сумма
+        self._values: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, *labelvalues: str) -> None:
+        entry = self._values.get(labelvalues)
+        if entry is None:
+            entry = self._values[labelvalues] = ([0] * (len(self.buckets) + 1), [0.0])
+        entry[0][bisect.bisect_left(self.buckets, value)] += 1
+        entry[1][0] += value
+
+    def _samples(self) -> List[str]:
+        samples = []
+        for key, (counts, total) in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound}"'
+                samples.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}")
+            samples.append(f"{self.name}_sum{_labels(self.labelnames, key)} {total[0]}")
+            samples.append(f"{self.name}_count{_labels(self.labelnames, key)} {cumulative}")
+        return samples
+
+
+def render() -> str:
+    """Все зарегистрированные метрики в текстовом формате Prometheus."""
+    lines: List[str] = []
+    for metric in _REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "Время обработки HTTP-запроса", ("method", "route", "status"),
+)
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware: время обработки запроса по шаблону маршрута
+    (например, /event/{event_id}), методу и коду ответа.
+    """
+
+    def __init__(self, app: Callable, routes: Callable[[], Dict[Callable, str]]) -> None:
+        self.app = app
+        self._routes = routes
+
+    async def __call__(self, scope: dict, receive: Callable, send: Callable) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = ["500"]
+
+        async def send_with_status(message: dict) -> None:
+            if message["type"] == "http.response.start":
+                status[0] = str(message["status"])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            route = self._routes().get(scope.get("endpoint"), "unmatched")
+            REQUEST_SECONDS.observe(
+                time.perf_counter() - started, scope["method"], route, status[0]
+            )
+
+
+def install(app: FastAPI) -> None:
+    """
+    Регистрирует GET /metrics и middleware замера запросов (если метрики включены).
+
+    :param app: Приложение FastAPI.
+    """
+    if not METRICS_ENABLED:
+        return
+
+    routes: Dict[Callable, str] = {}
+
+    def route_paths() -> Dict[Callable, str]:
+        if not routes:
+            routes.update(
+                (route.endpoint, route.path) for route in app.routes if hasattr(route, "endpoint")
+            )
+        return routes
+
+    @app.get("/metrics", include_in_schema=False)
+    async def metrics() -> Response:
+        return Response(content=render(), media_type="text/plain; version=0.0.4")
+
+    app.add_middleware(MetricsMiddleware, routes=route_paths)
@@ -0,0 +1,236 @@
+"""
+Модуль исходящих сообщений (outbox) line_provider.
+
+Обработчик HTTP не публикует сообщения в RabbitMQ сам: он кладёт их в outbox
+(для долговечных сообщений — после записи в журнал событий вместе с изменением
+события), а фоновый публикатор отправляет их пачками. Сообщения пачки
+публикуются конвейером, без ожидания подтверждения каждого, а из outbox
+удаляются только после publisher confirm от брокера. При ошибке пачка
+повторяется с экспоненциальной задержкой, поэтому доставка — at-least-once.
+
+Двоичные конверты (protocol.py) с одним ключом маршрутизации, оказавшиеся
+в одной пачке, публикуются одним сообщением: при массовом изменении событий
+брокер получает одно сообщение на пачку, а не на каждое событие.
+"""
+import asyncio
+import base64
+import logging
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from aio_pika import DeliveryMode, Message
+from aio_pika.abc import AbstractExchange
+from pydantic import BaseModel, Field
+
+import protocol
+from metrics import METRICS_ENABLED, Counter, Histogram
+
+logger = logging.getLogger("line_provider")
+
+#: Заголовок с временем публикации (unix time) — для замера задержки у потребителей
+PUBLISHED_AT_HEADER: str = "x-published-at"
+
+PUBLISH_SECONDS = Histogram(
+    "outbox_publish_seconds", "Время от публикации пачки outbox до подтверждения брокером",
+)
+PUBLISHED_MESSAGES = Counter(
+    "outbox_messages_total", "Сообщения outbox по результату публикации", ("result",),
+)
+PUBLISHED_FRAMES = Counter(
+    "outbox_published_total", "Сообщения, отправленные брокеру (конверты объединяются)",
+)
+
+
+class OutboxMessage(BaseModel):
+    """
+    Сообщение, ожидающее публикации.
+
+    Поля:
+    - id: Уникальный идентификатор (передаётся брокеру как message_id).
+    - routing_key: Ключ маршрутизации в обменнике событий.
+    - body: Тело сообщения (bytes).
+    - content_type: Тип содержимого тела сообщения.
+    - durable: Сохраняется ли сообщение в журнал событий (переживает перезапуск).
+    """
+    id: str = Field(default_factory=lambda: uuid.uuid4().hex)
+    routing_key: str
+    body: bytes
+    content_type: Optional[str] = None
+    durable: bool = True
+
+    def to_record(self) -> Dict[str, Any]:
+        """Представление для журнала событий (тело в base64)."""
+        return {
+            "id": self.id,
+            "routing_key": self.routing_key,
+            "body": base64.b64encode(self.body).decode(),
+            "content_type": self.content_type,
+        }
+
+    @classmethod
+    def from_record(cls, record: Dict[str, Any]) -> "OutboxMessage":
+        """Восстанавливает сообщение из записи журнала событий."""
+        return cls(
+            id=record["id"],
+            routing_key=record["routing_key"],
+            body=base64.b64decode(record["body"]),
+            content_type=record.get("content_type"),
+        )
+
+
+class Outbox:
+    """
+    Очередь исходящих сообщений с фоновым публикатором.
+
+    Сообщения публикуются в порядке постановки в очередь.
+    """
+
+    def __init__(
+        self,
+        batch_size: int = 100,
+        retry_initial_delay: float = 0.1,
+        retry_max_delay: float = 10.0,
+    ) -> None:
+        """
+        :param batch_size: Сколько сообщений публикуется до ожидания подтверждений.
+        :param retry_initial_delay: Первая задержка перед повтором в секундах.
+        :param retry_max_delay: Максимальная задержка перед повтором в секундах.
+        """
+        self.batch_size = batch_size
+        self.retry_initial_delay = retry_initial_delay
+        self.retry_max_delay = retry_max_delay
+        #: Колбэк с id подтверждённых долговечных сообщений (для журнала событий)
+        self.on_confirmed: Optional[Callable[[List[str]], None]] = None
+        self._pending: "OrderedDict[str, OutboxMessage]" = OrderedDict()
+        self._has_pending = asyncio.Event()
+        self._exchange: Optional[AbstractExchange] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def put(self, messages: Iterable[OutboxMessage]) -> None:
+        """
+        Ставит сообщения в очередь на публикацию.
+
+        :param messages: Сообщения; долговечные должны быть уже записаны в журнал.
+        """
+        for message in messages:
+            self._pending[message.id] = message
+        if self._pending:
+            self._has_pending.set()
+
+    def pending_durable(self) -> List[OutboxMessage]:
+        """Неподтверждённые долговечные сообщения (для снимка журнала)."""
+        return [m for m in self._pending.values() if m.durable]
+
+    def start(self, exchange: AbstractExchange) -> None:
+        """
+        Запускает фоновый публикатор.
+
+        :param exchange: Обменник; канал должен быть открыт с publisher confirms.
+        """
+        self._exchange = exchange
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Останавливает публикатор; неподтверждённые сообщения остаются в журнале."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        """Цикл публикации с экспоненциальной задержкой при ошибках."""
+        delay = self.retry_initial_delay
+        while True:
+            await self._has_pending.wait()
+            if await self._publish_batch():
+                delay = self.retry_initial_delay
+            else:
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.retry_max_delay)
+            if not self._pending:
+                self._has_pending.clear()
+
+    @staticmethod
+    def _frames(batch: List[OutboxMessage]) -> List[Tuple[List[OutboxMessage], bytes]]:
+        """
+        Группирует пачку в сообщения для брокера: конверты с одним ключом
+        маршрутизации объединяются в один, остальные сообщения публикуются как есть.
+
+        :param batch: Сообщения outbox в порядке очереди.
+        :return: Пары (сообщения outbox, тело публикуемого сообщения).
+        """
+        groups: List[List[OutboxMessage]] = []
+        envelopes: Dict[str, List[OutboxMessage]] = {}
+        for message in batch:
+            if not protocol.is_envelope(message.content_type):
+                groups.append([message])
+            elif message.routing_key in envelopes:
+                envelopes[message.routing_key].append(message)
+            else:
+                envelopes[message.routing_key] = [message]
+                groups.append(envelopes[message.routing_key])
+        return [
+            (group, protocol.merge([m.body for m in group]) if len(group) > 1 else group[0].body)
+            for group in groups
+        ]
+
+    async def _publish_batch(self) -> bool:
+        """
+        Публикует очередную пачку и убирает из очереди подтверждённые сообщения.
+
+        :return: True, если подтверждены все сообщения пачки.
+        """
+        batch = [m for _, m in zip(range(self.batch_size), self._pending.values())]
+        frames = self._frames(batch)
+        started = time.perf_counter() if METRICS_ENABLED else 0.0
+        published_at = time.time()
+        results = await asyncio.gather(
+            *(
+                self._exchange.publish(
+                    Message(
+                        body,
+                        message_id=group[0].id,
+                        content_type=group[0].content_type,
+                        headers={PUBLISHED_AT_HEADER: published_at},
+                        delivery_mode=(
+                            DeliveryMode.PERSISTENT if group[0].durable else DeliveryMode.NOT_PERSISTENT
+                        ),
+                    ),
+                    routing_key=group[0].routing_key,
+                )
+                for group, body in frames
+            ),
+            return_exceptions=True,
+        )
+
+        confirmed: List[str] = []
+        failed = 0
+        for (group, _), result in zip(frames, results):
+            if isinstance(result, BaseException):
+                failed += len(group)
+                continue
+            for message in group:
+                self._pending.pop(message.id, None)
+                if message.durable:
+                    confirmed.append(message.id)
+
+        if METRICS_ENABLED:
+            PUBLISH_SECONDS.observe(time.perf_counter() - started)
+            PUBLISHED_FRAMES.inc(amount=len(frames))
+            PUBLISHED_MESSAGES.inc("confirmed", amount=len(batch) - failed)
+            if failed:
+                PUBLISHED_MESSAGES.inc("failed", amount=failed)
+
+        if confirmed and self.on_confirmed is not None:
+            self.on_confirmed(confirmed)
+        if failed:
+            logger.warning("Outbox: %d of %d messages not confirmed, will retry.", failed, len(batch))
+        return not failed
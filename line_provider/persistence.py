@@ -0,0 +1,857 @@
+"""
+Модуль персистентности хранилища событий line_provider.
+
+Слой подключаемый: EventPersistence ничего не сохраняет (поведение по
+умолчанию), FileEventPersistence хранит события на диске в виде:
+- журнала упреждающей записи (WAL): каждое изменение из PUT /event
+  записывается строкой JSON с полным состоянием изменённых событий и
+  порождёнными ими сообщениями outbox (одна строка — одна атомарная запись). Подтверждения
+  публикации сообщений также пишутся в журнал. Журнал разбит на сегменты
+  wal.<N>.log;
+- периодических снимков snapshot.jsonl со всеми событиями и ещё не
+  подтверждёнными сообщениями outbox. После записи снимка сегменты,
+  которые он покрывает, удаляются.
+
+Записи в журнал группируются: все изменения, пришедшие, пока идёт
+предыдущий fsync, записываются следующим одним write + fsync.
+Восстановление читает снимок и только хвост журнала после него.
+
+В обоих вариантах изменения применяются к хранилищу фоновой задачей записи
+непосредственно перед записью пачки и откатываются (EventStore.rollback),
+если запись не удалась. Каждое изменение пачки применяется в своей точке
+сохранения: изменение, которое завершилось ошибкой, откатывается и передаёт
+ошибку только своему вызывающему, а остальные изменения пачки записываются. Сообщения изменений ставятся в outbox самим слоем
+персистентности — после надёжной записи и до того, как задача записи
+продолжит работу (например, сделает снимок), поэтому снимок всегда
+содержит сообщения уже записанных изменений.
+
+SqliteEventPersistence хранит события и outbox в базе SQLite (режим WAL)
+и позволяет нескольким воркерам line_provider работать с общим состоянием:
+хранилище каждого воркера служит кэшем и догоняет изменения других воркеров
+по номеру версии. Каждый воркер публикует сообщения своих изменений сам,
+а лидер периодически забирает неподтверждённые сообщения завершившихся воркеров.
+"""
+import asyncio
+import decimal
+import fcntl
+import json
+import logging
+import os
+import sqlite3
+import time
+import uuid
+from pathlib import Path
+from typing import Any, Callable, Dict, IO, Iterable, List, NamedTuple, Optional, Tuple
+
+from pydantic.json import pydantic_encoder
+
+from outbox import Outbox, OutboxMessage
+from schemas import Event
+from store import EventStore
+
+logger = logging.getLogger("line_provider")
+
+SNAPSHOT_FILE: str = "snapshot.jsonl"
+WAL_PREFIX: str = "wal."
+WAL_SUFFIX: str = ".log"
+
+
+def _json_default(value: Any) -> Any:
+    """Кодирует Decimal строкой, чтобы коэффициент сохранялся без потери точности."""
+    if isinstance(value, decimal.Decimal):
+        return str(value)
+    return pydantic_encoder(value)
+
+
+def serialize_event(event: Event) -> str:
+    """
+    Сериализует событие в одну строку журнала или снимка.
+
+    :param event: Объект события (Event).
+    :return: Строка JSON с переводом строки в конце.
+    """
+    return event.json(encoder=_json_default) + "\n"
+
+
+class EventChange(NamedTuple):
+    """
+    Результат применения изменения к хранилищу.
+    - event: Событие после изменения.
+    - created: True, если событие было создано.
+    - messages: Сообщения outbox, порождённые изменением.
+    """
+    event: Event
+    created: bool
+    messages: List[OutboxMessage]
+
+
+#: Изменение хранилища: применяется слоем персистентности и возвращает результат
+Mutation = Callable[[], List[EventChange]]
+#: Изменение в очереди записи и future его вызывающего
+_Pending = Tuple[Mutation, "asyncio.Future[List[EventChange]]"]
+#: Применённое изменение: future вызывающего, результат и его сериализация для записи
+_Applied = Tuple["asyncio.Future[List[EventChange]]", List[EventChange], Any]
+
+
+def _durable_messages(changes: Iterable[EventChange]) -> List[OutboxMessage]:
+    return [m for change in changes for m in change.messages if m.durable]
+
+
+def _confirmed_record(message_ids: List[str]) -> str:
+    """Строка журнала: подтверждения публикации сообщений outbox."""
+    return json.dumps({"confirmed": message_ids}) + "\n"
+
+
+def _wal_record(changes: List[EventChange]) -> str:
+    """Строка журнала: изменённые события и их долговечные сообщения outbox."""
+    return (
+        '{"events":[' + ",".join(c.event.json(encoder=_json_default) for c in changes)
+        + '],"outbox":' + json.dumps([m.to_record() for m in _durable_messages(changes)])
+        + "}\n"
+    )
+
+
+class EventPersistence:
+    """
+    Базовый слой персистентности: ничего не сохраняет.
+    Используется, если каталог данных не задан.
+    """
+
+    #: Воркер-лидер восстанавливает неотправленные сообщения и создаёт тестовые события
+    is_leader: bool = True
+    #: Колбэк, вызываемый, когда воркер становится лидером после запуска
+    on_leader: Optional[Callable[[], None]] = None
+    _outbox: Optional[Outbox] = None
+
+    def load(self, store: EventStore, outbox: Outbox) -> None:
+        """
+        Восстанавливает сохранённые события и неподтверждённые сообщения outbox.
+
+        :param store: Хранилище, в которое загружаются события.
+        :param outbox: Outbox, в который возвращаются неподтверждённые сообщения.
+        """
+
+    async def start(self, store: EventStore, outbox: Outbox) -> None:
+        """
+        Запускает фоновую запись.
+
+        :param store: Хранилище, снимки которого будут сохраняться.
+        :param outbox: Outbox, в который ставятся сообщения изменений
+            и подтверждения которого записываются в журнал.
+        """
+        self._outbox = outbox
+
+    async def commit(self, mutation: Mutation) -> List[EventChange]:
+        """
+        Применяет изменение к хранилищу и атомарно сохраняет изменённые события
+        вместе с их долговечными сообщениями outbox; возвращается после того,
+        как запись надёжна и сообщения изменения поставлены в outbox.
+        Если запись не удалась, изменение откатывается и исключение
+        передаётся вызывающему.
+
+        :param mutation: Функция, изменяющая хранилище.
+        :return: Результат изменения.
+        """
+        changes = mutation()
+        self._put_messages(changes)
+        return changes
+
+    def _put_messages(self, changes: Iterable[EventChange]) -> None:
+        """Ставит сообщения записанных изменений в outbox."""
+        self._outbox.put(m for change in changes for m in change.messages)
+
+    def _apply_batch(
+        self, batch: List[_Pending], encode: Callable[[List[EventChange]], Any]
+    ) -> List[_Applied]:
+        """
+        Применяет изменения пачки, каждое в своей точке сохранения хранилища.
+        Изменение, завершившееся ошибкой (или не сериализуемое encode), откатывается,
+        а ошибка передаётся только его вызывающему.
+
+        :param batch: Изменения и future их вызывающих.
+        :param encode: Сериализация результата изменения для записи.
+        :return: Принятые изменения: future, результат и его сериализация.
+        """
+        accepted = []
+        for mutation, future in batch:
+            self._store.savepoint()
+            try:
+                changes = mutation()
+                encoded = encode(changes)
+            except Exception as exc:
+                self._store.rollback()
+                if not future.done():
+                    future.set_exception(exc)
+                continue
+            self._store.release()
+            accepted.append((future, changes, encoded))
+        return accepted
+
+    def _resolve(self, accepted: List[_Applied]) -> None:
+        """Ставит сообщения записанных изменений в outbox и будит их вызывающих."""
+        for future, changes, _ in accepted:
+            self._put_messages(changes)
+            if not future.done():
+                future.set_result(changes)
+
+    def refresh(self, store: EventStore) -> None:
+        """
+        Применяет к хранилищу изменения, сделанные другими воркерами.
+
+        :param store: Хранилище текущего воркера.
+        """
+
+    async def stop(self) -> None:
+        """Дописывает накопленные изменения и останавливает фоновую запись."""
+
+
+class FileEventPersistence(EventPersistence):
+    """
+    Журнал упреждающей записи с групповым fsync и периодическими снимками.
+    """
+
+    def __init__(
+        self,
+        data_dir: str,
+        snapshot_every: int = 10000,
+        flush_interval: float = 0.0,
+    ) -> None:
+        """
+        :param data_dir: Каталог для журнала и снимков.
+        :param snapshot_every: Через сколько записей журнала делать снимок.
+        :param flush_interval: Дополнительное время накопления группы записей в секундах.
+        """
+        self.data_dir = Path(data_dir)
+        self.snapshot_every = snapshot_every
+        self.flush_interval = flush_interval
+        self._store: Optional[EventStore] = None
+        self._outbox: Optional[Outbox] = None
+        self._segment: int = 0
+        self._file: Optional[IO[str]] = None
+        self._pending: List[_Pending] = []
+        self._confirmed: List[str] = []
+        self._has_pending = asyncio.Event()
+        self._records_since_snapshot: int = 0
+        self._flush_task: Optional[asyncio.Task] = None
+        self._snapshot_task: Optional[asyncio.Task] = None
+        self._stopping: bool = False
+
+    def _segment_path(self, segment: int) -> Path:
+        return self.data_dir / f"{WAL_PREFIX}{segment}{WAL_SUFFIX}"
+
+    def _segments(self) -> List[int]:
+        """Номера существующих сегментов журнала по возрастанию."""
+        return sorted(
+            int(path.name[len(WAL_PREFIX):-len(WAL_SUFFIX)])
+            for path in self.data_dir.glob(f"{WAL_PREFIX}*{WAL_SUFFIX}")
+        )
+
+    def load(self, store: EventStore, outbox: Outbox) -> None:
+        """
+        Читает снимок, затем сегменты журнала, которые он не покрывает.
+        Недописанная последняя строка сегмента (обрыв при записи) пропускается.
+        """
+        self.data_dir.mkdir(parents=True, exist_ok=True)
+        first_segment = 0
+        pending: Dict[str, OutboxMessage] = {}
+
+        snapshot_path = self.data_dir / SNAPSHOT_FILE
+        if snapshot_path.exists():
+            with open(snapshot_path, encoding="utf-8") as f:
+                header = json.loads(f.readline())
+                first_segment = header["wal_segment"]
+                for record in header.get("outbox", ()):
+                    message = OutboxMessage.from_record(record)
+                    pending[message.id] = message
+                for line in f:
+                    store.upsert(Event.parse_raw(line))
+
+        segments = self._segments()
+        for segment in segments:
+            if segment < first_segment:
+                continue
+            with open(self._segment_path(segment), encoding="utf-8") as f:
+                for line in f:
+                    if not line.endswith("\n"):
+                        continue
+                    self._records_since_snapshot += 1
+                    record = json.loads(line)
+                    for event_record in record.get("events", ()):
+                        store.upsert(Event.parse_obj(event_record))
+                    for message_record in record.get("outbox", ()):
+                        message = OutboxMessage.from_record(message_record)
+                        pending[message.id] = message
+                    for message_id in record.get("confirmed", ()):
+                        pending.pop(message_id, None)
+
+        outbox.put(pending.values())
+        # Новые записи пишутся в новый сегмент, а не после возможного обрыва
+        self._segment = max(segments + [first_segment - 1]) + 1
+
+    async def start(self, store: EventStore, outbox: Outbox) -> None:
+        self._store = store
+        self._outbox = outbox
+        outbox.on_confirmed = self.confirm
+        self.data_dir.mkdir(parents=True, exist_ok=True)
+        self._file = open(self._segment_path(self._segment), "a", encoding="utf-8")
+        self._flush_task = asyncio.create_task(self._run())
+
+    async def commit(self, mutation: Mutation) -> List[EventChange]:
+        future: "asyncio.Future[List[EventChange]]" = asyncio.get_running_loop().create_future()
+        self._pending.append((mutation, future))
+        self._has_pending.set()
+        return await future
+
+    def confirm(self, message_ids: List[str]) -> None:
+        """
+        Записывает в журнал подтверждение публикации сообщений outbox.
+        Не ждёт fsync: потеря подтверждения приводит лишь к повторной доставке.
+
+        :param message_ids: Идентификаторы подтверждённых сообщений.
+        """
+        self._confirmed.extend(message_ids)
+        self._has_pending.set()
+
+    async def stop(self) -> None:
+        if self._flush_task is not None:
+            self._stopping = True
+            self._has_pending.set()
+            await self._flush_task
+            self._flush_task = None
+        if self._snapshot_task is not None:
+            await self._snapshot_task
+
+        # Снимок при остановке ускоряет следующий запуск
+        if self._store is not None and self._records_since_snapshot:
+            await asyncio.to_thread(self._write_snapshot, *self._rotate())
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    async def _run(self) -> None:
+        """Цикл групповой записи журнала; при остановке дописывает остаток."""
+        while not self._stopping:
+            await self._has_pending.wait()
+            if self.flush_interval and not self._stopping:
+                await asyncio.sleep(self.flush_interval)
+            await self._flush()
+
+            if (
+                self._records_since_snapshot >= self.snapshot_every
+                and self._snapshot_task is None
+            ):
+                self._snapshot_task = asyncio.create_task(
+                    self._snapshot(*self._rotate())
+                )
+
+        if self._pending or self._confirmed:
+            await self._flush()
+
+    async def _flush(self) -> None:
+        """
+        Применяет накопленные изменения к хранилищу, записывает их одним
+        write + fsync, ставит их сообщения в outbox и будит ожидающих.
+        Если запись не удалась, изменения откатываются.
+        """
+        batch, self._pending = self._pending, []
+        confirmed, self._confirmed = self._confirmed, []
+        self._has_pending.clear()
+
+        self._store.savepoint()
+        accepted = self._apply_batch(batch, _wal_record)
+        lines = [line for _, _, line in accepted]
+        if confirmed:
+            # Подтверждения пишутся после изменений: сообщение не может
+            # оказаться подтверждённым раньше, чем записанным
+            lines.append(_confirmed_record(confirmed))
+        try:
+            if lines:
+                await asyncio.to_thread(self._write, "".join(lines))
+        except Exception as exc:
+            logger.exception("Failed to write %d changes to event log.", len(accepted))
+            self._store.rollback()
+            self._confirmed[:0] = confirmed
+            for future, _, _ in accepted:
+                if not future.done():
+                    future.set_exception(exc)
+            return
+        self._store.release()
+
+        self._records_since_snapshot += len(lines)
+        self._resolve(accepted)
+
+    def _write(self, data: str) -> None:
+        self._file.write(data)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def _rotate(self) -> Tuple[List[Event], List[OutboxMessage], int]:
+        """
+        Переключает журнал на новый сегмент и фиксирует список событий
+        и неподтверждённых сообщений outbox для снимка.
+
+        Вызывается задачей записи между пачками, поэтому хранилище содержит
+        ровно записанные в журнал изменения, а outbox — их сообщения. События
+        не изменяются на месте, поэтому список не меняется, пока пишется снимок.
+
+        :return: События и сообщения для снимка, первый сегмент после снимка.
+        """
+        self._file.close()
+        self._segment += 1
+        self._file = open(self._segment_path(self._segment), "a", encoding="utf-8")
+        self._records_since_snapshot = 0
+        return (
+            list(self._store.events.values()),
+            self._outbox.pending_durable(),
+            self._segment,
+        )
+
+    async def _snapshot(
+        self, events: List[Event], messages: List[OutboxMessage], wal_segment: int
+    ) -> None:
+        try:
+            await asyncio.to_thread(self._write_snapshot, events, messages, wal_segment)
+        except Exception:
+            logger.exception("Failed to write events snapshot.")
+        finally:
+            self._snapshot_task = None
+
+    def _write_snapshot(
+        self, events: List[Event], messages: List[OutboxMessage], wal_segment: int
+    ) -> None:
+        """
+        Атомарно записывает снимок и удаляет покрытые им сегменты журнала.
+
+        :param events: События для снимка.
+        :param messages: Неподтверждённые сообщения outbox.
+        :param wal_segment: Первый сегмент журнала, не вошедший в снимок.
+        """
+        header = {
+            "wal_segment": wal_segment,
+            "outbox": [m.to_record() for m in messages],
+        }
+        tmp_path = self.data_dir / (SNAPSHOT_FILE + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(json.dumps(header) + "\n")
+            f.writelines(serialize_event(event) for event in events)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.data_dir / SNAPSHOT_FILE)
+
+        dir_fd = os.open(self.data_dir, os.O_RDONLY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+        for segment in self._segments():
+            if segment < wal_segment:
+                self._segment_path(segment).unlink(missing_ok=True)
+        logger.info("Wrote events snapshot: %d events", len(events))
+
+
+class SqliteEventPersistence(EventPersistence):
+    """
+    Общее хранилище событий для нескольких воркеров на одном хосте (SQLite, режим WAL).
+
+    - Таблица events хранит полное состояние каждого события и номер версии
+      последнего изменения; таблица outbox — неподтверждённые сообщения.
+    - Запись: фоновая задача воркера берёт блокировку записи (BEGIN IMMEDIATE),
+      догоняет чужие изменения, применяет накопленные изменения к своему
+      хранилищу и записывает их с новыми версиями одним коммитом.
+    - Чтение: перед обработкой запроса воркер проверяет PRAGMA data_version
+      (не чаще раза в refresh_interval) и при изменениях догоняет версии
+      больше последней применённой.
+    - Outbox: строки таблицы outbox помечены воркером-владельцем, который
+      публикует их сам и держит блокировку файла воркера, пока жив. Лидер раз
+      в outbox_rescan_interval забирает себе строки владельцев, чья блокировка
+      свободна (воркер завершился, не дождавшись подтверждения брокера).
+    """
+
+    def __init__(
+        self,
+        path: str,
+        flush_interval: float = 0.0,
+        leader_retry_interval: float = 5.0,
+        outbox_rescan_interval: float = 5.0,
+        refresh_interval: float = 0.0,
+    ) -> None:
+        """
+        :param path: Путь к файлу базы SQLite (общему для всех воркеров).
+        :param flush_interval: Дополнительное время накопления группы изменений в секундах.
+        :param leader_retry_interval: Как часто воркер, не ставший лидером, пробует
+            взять блокировку лидера (если лидер завершился) в секундах.
+        :param outbox_rescan_interval: Как часто лидер ищет неподтверждённые
+            сообщения завершившихся воркеров в секундах.
+        :param refresh_interval: Как часто refresh проверяет изменения других
+            воркеров в секундах (0 — при каждом вызове).
+        """
+        self.path = path
+        self.flush_interval = flush_interval
+        self.leader_retry_interval = leader_retry_interval
+        self.outbox_rescan_interval = outbox_rescan_interval
+        self.refresh_interval = refresh_interval
+        self.is_leader = False
+        self._worker_id: str = uuid.uuid4().hex
+        self._worker_lock: Optional[IO[str]] = None
+        self._store: Optional[EventStore] = None
+        self._read_conn: Optional[sqlite3.Connection] = None
+        self._write_conn: Optional[sqlite3.Connection] = None
+        self._leader_lock: Optional[IO[str]] = None
+        self._leader_conn: Optional[sqlite3.Connection] = None
+        self._version: int = 0
+        self._data_version: Optional[int] = None
+        self._refreshed_at: float = float("-inf")
+        self._pending: List[_Pending] = []
+        self._confirmed: List[str] = []
+        self._has_pending = asyncio.Event()
+        self._flush_task: Optional[asyncio.Task] = None
+        self._leader_task: Optional[asyncio.Task] = None
+        self._stopping: bool = False
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self.path, isolation_level=None, check_same_thread=False, timeout=30
+        )
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=FULL")
+        return conn
+
+    def load(self, store: EventStore, outbox: Outbox) -> None:
+        """
+        Загружает все события; неподтверждённые сообщения outbox
+        восстанавливает только воркер-лидер.
+        """
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        self._read_conn = self._connect()
+        self._read_conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS events (
+                event_id TEXT PRIMARY KEY,
+                data TEXT NOT NULL,
+                version INTEGER NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS ix_events_version ON events (version);
+            CREATE TABLE IF NOT EXISTS outbox (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                id TEXT UNIQUE NOT NULL,
+                record TEXT NOT NULL,
+                owner TEXT
+            );
+            """
+        )
+        # Базы, созданные до появления владельца сообщений: строки без владельца
+        # считаются строками завершившегося воркера
+        columns = {name for _, name, *_ in self._read_conn.execute("PRAGMA table_info(outbox)")}
+        if "owner" not in columns:
+            try:
+                self._read_conn.execute("ALTER TABLE outbox ADD COLUMN owner TEXT")
+            except sqlite3.OperationalError:
+                # Колонку одновременно добавил другой воркер
+                pass
+        self._read_conn.execute("CREATE INDEX IF NOT EXISTS ix_outbox_owner ON outbox (owner)")
+
+        # Блокировка воркера держится, пока он жив: по ней лидер отличает
+        # сообщения работающих воркеров от сообщений завершившихся
+        self._worker_lock = open(self._worker_lock_path(self._worker_id), "a")
+        fcntl.flock(self._worker_lock, fcntl.LOCK_EX)
+
+        # Лидером становится воркер, первым взявший блокировку файла
+        self._leader_lock = open(self.path + ".leader", "a")
+        self.is_leader = self._try_lock_leader()
+
+        self._refresh(store)
+        if self.is_leader:
+            outbox.put(self._adopt_orphans())
+
+    async def start(self, store: EventStore, outbox: Outbox) -> None:
+        self._store = store
+        self._outbox = outbox
+        outbox.on_confirmed = self.confirm
+        self._write_conn = self._connect()
+        self._flush_task = asyncio.create_task(self._run())
+        self._leader_task = asyncio.create_task(self._lead())
+
+    def _try_lock_leader(self) -> bool:
+        """Пробует взять блокировку лидера (её снимает ОС, когда лидер завершается)."""
+        try:
+            fcntl.flock(self._leader_lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return False
+        return True
+
+    def _worker_lock_path(self, worker_id: str) -> str:
+        return f"{self.path}.worker.{worker_id}"
+
+    def _worker_alive(self, worker_id: Optional[str]) -> bool:
+        """Проверяет, держит ли воркер свою блокировку (её снимает ОС, когда воркер завершается)."""
+        if worker_id is None:
+            return False
+        try:
+            with open(self._worker_lock_path(worker_id)) as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except FileNotFoundError:
+            return False
+        except OSError:
+            return True
+        return False
+
+    def _adopt_orphans(self) -> List[OutboxMessage]:
+        """
+        Переписывает на текущего воркера неподтверждённые сообщения
+        завершившихся воркеров.
+
+        :return: Забранные сообщения (в порядке записи) для публикации.
+        """
+        if self._leader_conn is None:
+            self._leader_conn = self._connect()
+        conn = self._leader_conn
+        owners = [owner for owner, in conn.execute("SELECT DISTINCT owner FROM outbox")]
+        dead = [o for o in owners if o != self._worker_id and not self._worker_alive(o)]
+        if not dead:
+            return []
+
+        rows: List[Tuple[int, str]] = []
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for owner in dead:
+                rows.extend(conn.execute(
+                    "SELECT seq, record FROM outbox WHERE owner IS ?", (owner,)
+                ).fetchall())
+                conn.execute("UPDATE outbox SET owner = ? WHERE owner IS ?", (self._worker_id, owner))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        for owner in dead:
+            if owner is not None:
+                Path(self._worker_lock_path(owner)).unlink(missing_ok=True)
+
+        rows.sort()
+        logger.info("Adopted %d outbox messages of %d stopped workers.", len(rows), len(dead))
+        return [OutboxMessage.from_record(json.loads(record)) for _, record in rows]
+
+    async def _lead(self) -> None:
+        """
+        Не-лидер периодически пробует стать лидером; став им, догоняет изменения,
+        забирает неподтверждённые сообщения завершившихся воркеров и вызывает
+        on_leader (планировщик дедлайнов). Лидер повторяет поиск таких сообщений
+        раз в outbox_rescan_interval: воркер может завершиться в любой момент.
+        """
+        if not self.is_leader:
+            while not self._try_lock_leader():
+                await asyncio.sleep(self.leader_retry_interval)
+            self.is_leader = True
+            logger.info("Worker became the leader of the shared event store.")
+            self._refresh(self._store)
+            self._outbox.put(await asyncio.to_thread(self._adopt_orphans))
+            if self.on_leader is not None:
+                self.on_leader()
+
+        while True:
+            await asyncio.sleep(self.outbox_rescan_interval)
+            try:
+                self._outbox.put(await asyncio.to_thread(self._adopt_orphans))
+            except Exception:
+                logger.exception("Failed to adopt outbox messages of stopped workers.")
+
+    def refresh(self, store: EventStore) -> None:
+        # Проверка выполняется на цикле событий при каждом запросе, поэтому
+        # не чаще раза в refresh_interval (чужие изменения видны с этой задержкой)
+        now = time.monotonic()
+        if now - self._refreshed_at < self.refresh_interval:
+            return
+        self._refreshed_at = now
+        self._refresh(store)
+
+    def _refresh(self, store: EventStore) -> None:
+        # data_version меняется, только если базу изменило другое соединение
+        data_version = self._read_conn.execute("PRAGMA data_version").fetchone()[0]
+        if data_version == self._data_version:
+            return
+        self._data_version = data_version
+        rows = self._read_conn.execute(
+            "SELECT data, version FROM events WHERE version > ? ORDER BY version",
+            (self._version,),
+        ).fetchall()
+        self._apply(store, rows)
+
+    def _apply(self, store: EventStore, rows: List[Tuple[str, int]]) -> None:
+        for data, version in rows:
+            store.upsert(Event.parse_raw(data))
+            self._version = max(self._version, version)
+
+    async def commit(self, mutation: Mutation) -> List[EventChange]:
+        future: "asyncio.Future[List[EventChange]]" = asyncio.get_running_loop().create_future()
+        self._pending.append((mutation, future))
+        self._has_pending.set()
+        return await future
+
+    def confirm(self, message_ids: List[str]) -> None:
+        """
+        Удаляет подтверждённые сообщения из таблицы outbox со следующей записью.
+
+        :param message_ids: Идентификаторы подтверждённых сообщений.
+        """
+        self._confirmed.extend(message_ids)
+        self._has_pending.set()
+
+    async def stop(self) -> None:
+        if self._leader_task is not None:
+            self._leader_task.cancel()
+            try:
+                await self._leader_task
+            except asyncio.CancelledError:
+                pass
+            self._leader_task = None
+        if self._flush_task is not None:
+            self._stopping = True
+            self._has_pending.set()
+            await self._flush_task
+            self._flush_task = None
+        orphaned = self._read_conn is not None and self._read_conn.execute(
+            "SELECT 1 FROM outbox WHERE owner = ? LIMIT 1", (self._worker_id,)
+        ).fetchone() is not None
+        for conn in (self._write_conn, self._read_conn, self._leader_conn):
+            if conn is not None:
+                conn.close()
+        if self._leader_lock is not None:
+            self._leader_lock.close()
+        if self._worker_lock is not None:
+            # Неподтверждённые сообщения воркера заберёт лидер (и удалит файл блокировки)
+            if not orphaned:
+                Path(self._worker_lock_path(self._worker_id)).unlink(missing_ok=True)
+            self._worker_lock.close()
+            self._worker_lock = None
+
+    async def _run(self) -> None:
+        """Цикл групповой записи; при остановке дописывает остаток."""
+        while not self._stopping:
+            await self._has_pending.wait()
+            if self.flush_interval and not self._stopping:
+                await asyncio.sleep(self.flush_interval)
+            await self._flush()
+
+        if self._pending or self._confirmed:
+            await self._flush()
+
+    async def _flush(self) -> None:
+        """
+        Под блокировкой записи догоняет чужие изменения, применяет накопленные
+        изменения, записывает их одним коммитом и ставит их сообщения в outbox.
+        Если запись не удалась, изменения откатываются (чужие изменения,
+        прочитанные из базы, остаются).
+        """
+        batch, self._pending = self._pending, []
+        confirmed, self._confirmed = self._confirmed, []
+        self._has_pending.clear()
+
+        version_before = self._version
+        applied = False
+        try:
+            rows = await asyncio.to_thread(self._begin, version_before)
+            self._apply(self._store, rows)
+            version_before = self._version
+
+            self._store.savepoint()
+            applied = True
+            accepted = self._apply_batch(batch, lambda changes: changes)
+            records: List[Tuple[str, str, int]] = []
+            outbox_records: List[Tuple[str, str]] = []
+            for _, changes, _ in accepted:
+                for change in changes:
+                    self._version += 1
+                    records.append((
+                        change.event.event_id,
+                        change.event.json(encoder=_json_default),
+                        self._version,
+                    ))
+                outbox_records.extend(
+                    (m.id, json.dumps(m.to_record())) for m in _durable_messages(changes)
+                )
+
+            await asyncio.to_thread(self._write, records, outbox_records, confirmed)
+        except Exception as exc:
+            logger.exception("Failed to write %d changes to shared event store.", len(batch))
+            self._version = version_before
+            if applied:
+                self._store.rollback()
+            self._confirmed[:0] = confirmed
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(exc)
+            await asyncio.to_thread(self._rollback)
+            return
+        self._store.release()
+        self._resolve(accepted)
+
+    def _begin(self, version: int) -> List[Tuple[str, int]]:
+        """Берёт блокировку записи и возвращает изменения новее version."""
+        self._write_conn.execute("BEGIN IMMEDIATE")
+        return self._write_conn.execute(
+            "SELECT data, version FROM events WHERE version > ? ORDER BY version",
+            (version,),
+        ).fetchall()
+
+    def _write(
+        self,
+        records: List[Tuple[str, str, int]],
+        outbox_records: List[Tuple[str, str]],
+        confirmed: List[str],
+    ) -> None:
+        conn = self._write_conn
+        conn.executemany(
+            "INSERT OR REPLACE INTO events (event_id, data, version) VALUES (?, ?, ?)",
+            records,
+        )
+        conn.executemany(
+            "INSERT INTO outbox (id, record, owner) VALUES (?, ?, ?)",
+            [(message_id, record, self._worker_id) for message_id, record in outbox_records],
+        )
+        conn.executemany("DELETE FROM outbox WHERE id = ?", [(i,) for i in confirmed])
+        conn.execute("COMMIT")
+
+    def _rollback(self) -> None:
+        if self._write_conn.in_transaction:
+            self._write_conn.execute("ROLLBACK")
+
+
+def create_persistence() -> EventPersistence:
+    """
+    Создаёт слой персистентности по переменным окружения:
+    - EVENTS_DATA_DIR: каталог данных (если не задан — события не сохраняются);
+    - EVENTS_BACKEND: "file" (журнал и снимки) или "sqlite" (общее хранилище воркеров);
+    - EVENTS_SNAPSHOT_EVERY: количество записей журнала между снимками;
+    - EVENTS_WAL_FLUSH_MS: дополнительное время накопления группы записей;
+    - EVENTS_LEADER_RETRY_SECONDS: как часто воркер пробует стать лидером вместо завершившегося;
+    - EVENTS_OUTBOX_RESCAN_SECONDS: как часто лидер забирает сообщения завершившихся воркеров;
+    - EVENTS_REFRESH_MS: как часто воркер проверяет изменения других воркеров;
+    - LINE_PROVIDER_WORKERS: количество воркеров uvicorn.
+
+    :return: Слой персистентности.
+    :raises RuntimeError: если воркеров несколько, а общее хранилище не настроено.
+    """
+    data_dir = os.getenv("EVENTS_DATA_DIR")
+    backend = os.getenv("EVENTS_BACKEND", "file")
+    workers = int(os.getenv("LINE_PROVIDER_WORKERS", "1"))
+    flush_interval = float(os.getenv("EVENTS_WAL_FLUSH_MS", "0")) / 1000
+
+    if workers > 1 and (backend != "sqlite" or not data_dir):
+        raise RuntimeError(
+            "Several line_provider workers require EVENTS_BACKEND=sqlite and EVENTS_DATA_DIR"
+        )
+    if not data_dir:
+        return EventPersistence()
+    if backend == "sqlite":
+        return SqliteEventPersistence(
+            os.path.join(data_dir, "events.sqlite3"),
+            flush_interval=flush_interval,
+            leader_retry_interval=float(os.getenv("EVENTS_LEADER_RETRY_SECONDS", "5")),
+            outbox_rescan_interval=float(os.getenv("EVENTS_OUTBOX_RESCAN_SECONDS", "5")),
+            refresh_interval=float(os.getenv("EVENTS_REFRESH_MS", "20")) / 1000,
+        )
+    return FileEventPersistence(
+        data_dir,
+        snapshot_every=int(os.getenv("EVENTS_SNAPSHOT_EVERY", "10000")),
+        flush_interval=flush_interval,
+    )
@@ -0,0 +1,133 @@
+"""
+Модуль планировщика дедлайнов событий line_provider.
+
+Одна фоновая задача держит кучу (deadline, event_id) открытых событий
+и спит до ближайшего дедлайна. Проснувшись, она снимает с кучи все
+наступившие дедлайны сразу и передаёт их одним вызовом on_due, поэтому
+тысячи событий с дедлайном в одну секунду стоят одного пробуждения,
+а не отдельной задачи или таймера на событие.
+
+Дедлайн — целая секунда unix time: событие закрывается, как только
+наступает секунда deadline (так же, как оно пропадает из GET /events).
+"""
+import asyncio
+import heapq
+import logging
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from schemas import Event, EventState
+
+logger = logging.getLogger("line_provider")
+
+
+class DeadlineScheduler:
+    """
+    Планировщик закрытия событий по дедлайну.
+
+    Событие планируется при каждом изменении (schedule), если оно в статусе NEW
+    и у него есть дедлайн. Изменение дедлайна не требует удаления старой записи
+    из кучи: запись, не совпадающая с последним запланированным дедлайном
+    события, при снятии пропускается.
+    """
+
+    def __init__(
+        self,
+        on_due: Callable[[List[str]], Awaitable[None]],
+        max_sleep: float = 60.0,
+        before_tick: Optional[Callable[[], None]] = None,
+    ) -> None:
+        """
+        :param on_due: Колбэк с event_id событий, дедлайн которых наступил.
+        :param max_sleep: Максимальная пауза между проверками в секундах.
+        :param before_tick: Вызывается перед каждой проверкой (например, чтобы
+            догнать изменения других воркеров).
+        """
+        self.on_due = on_due
+        self.max_sleep = max_sleep
+        self.before_tick = before_tick
+        self._heap: List[Tuple[int, str]] = []
+        self._scheduled: Dict[str, int] = {}
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self._scheduled)
+
+    def schedule(self, event: Event) -> None:
+        """
+        Планирует (или снимает с плана) закрытие события после его изменения.
+
+        :param event: Событие после изменения.
+        """
+        if event.state != EventState.NEW or not event.deadline:
+            self._scheduled.pop(event.event_id, None)
+            return
+        if self._scheduled.get(event.event_id) == event.deadline:
+            return
+        self._scheduled[event.event_id] = event.deadline
+        if not self._heap or event.deadline < self._heap[0][0]:
+            # Новый ближайший дедлайн: задача должна проснуться раньше
+            self._wakeup.set()
+        heapq.heappush(self._heap, (event.deadline, event.event_id))
+        if len(self._heap) > 2 * len(self._scheduled) + 64:
+            self._heap = [(deadline, event_id) for event_id, deadline in self._scheduled.items()]
+            heapq.heapify(self._heap)
+
+    def pop_due(self, now: float) -> List[Tuple[int, str]]:
+        """
+        Снимает с плана все события с наступившим дедлайном.
+
+        :param now: Текущее время (unix time).
+        :return: Пары (deadline, event_id).
+        """
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            deadline, event_id = heapq.heappop(self._heap)
+            if self._scheduled.get(event_id) == deadline:
+                del self._scheduled[event_id]
+                due.append((deadline, event_id))
+        return due
+
+    def start(self) -> None:
+        """Запускает фоновую задачу."""
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Останавливает фоновую задачу."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        """Цикл: проверка наступивших дедлайнов и сон до ближайшего."""
+        while True:
+            self._wakeup.clear()
+            timeout = self.max_sleep
+            due: List[Tuple[int, str]] = []
+            try:
+                if self.before_tick is not None:
+                    self.before_tick()
+                due = self.pop_due(time.time())
+                if due:
+                    await self.on_due([event_id for _, event_id in due])
+            except Exception:
+                logger.exception("Deadline scheduler tick failed, retrying %d events.", len(due))
+                # Не закрытые события возвращаются в план (если их не изменили за это время)
+                for deadline, event_id in due:
+                    if event_id not in self._scheduled:
+                        self._scheduled[event_id] = deadline
+                        heapq.heappush(self._heap, (deadline, event_id))
+                # Пауза перед повтором, а не сон до (уже наступившего) дедлайна
+                timeout = min(timeout, 1.0)
+            else:
+                if self._heap:
+                    timeout = min(timeout, max(0.0, self._heap[0][0] - time.time()))
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
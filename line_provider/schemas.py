@@ -3,10 +3,16 @@
 и состояния событий (Event) в line_provider.
 """
 from enum import Enum
-from pydantic import BaseModel
+from pydantic import BaseModel, validator
 from typing import Optional
 import decimal
 
+#: Ограничения двоичного формата сообщений о событиях (protocol.py):
+#: длина event_id в байтах UTF-8, длина десятичной записи коэффициента, диапазон deadline
+EVENT_ID_MAX_BYTES: int = 0xFFFF
+COEFFICIENT_MAX_LENGTH: int = 0xFF
+DEADLINE_MAX: int = 2 ** 63 - 1
+
 
 class EventState(str, Enum):
     """
@@ -14,10 +20,12 @@ class EventState(str, Enum):
     - NEW: Событие активно и приём ставок открыт.
     - FINISHED_WIN: Событие завершилось с исходом "WIN".
     - FINISHED_LOSE: Событие завершилось с исходом "LOSE".
+    - CLOSED: Дедлайн наступил, приём ставок закрыт, исход ещё не известен.
     """
     NEW = "NEW"
     FINISHED_WIN = "FINISHED_WIN"
     FINISHED_LOSE = "FINISHED_LOSE"
+    CLOSED = "CLOSED"
 
 
 class Event(BaseModel):
@@ -29,8 +37,29 @@ class Event(BaseModel):
     - coefficient: Коэффициент для расчёта выигрыша (Decimal).
     - deadline: Временная метка (int), до которой принимаются ставки.
     - state: Текущее состояние события (EventState).
+
+    Значения, которые не помещаются в двоичный формат сообщений, отклоняются
+    при разборе запроса (422), а не при публикации изменения.
     """
     event_id: str
     coefficient: Optional[decimal.Decimal] = None
     deadline: Optional[int] = None
     state: Optional[EventState] = None
+
+    @validator("event_id")
+    def _event_id_fits(cls, value: str) -> str:
+        if len(value.encode()) > EVENT_ID_MAX_BYTES:
+            raise ValueError(f"event_id must be at most {EVENT_ID_MAX_BYTES} bytes in UTF-8")
+        return value
+
+    @validator("coefficient")
+    def _coefficient_fits(cls, value: Optional[decimal.Decimal]) -> Optional[decimal.Decimal]:
+        if value is not None and len(str(value)) > COEFFICIENT_MAX_LENGTH:
+            raise ValueError(f"coefficient must be at most {COEFFICIENT_MAX_LENGTH} characters long")
+        return value
+
+    @validator("deadline")
+    def _deadline_fits(cls, value: Optional[int]) -> Optional[int]:
+        if value is not None and not -DEADLINE_MAX - 1 <= value <= DEADLINE_MAX:
+            raise ValueError("deadline is out of range")
+        return value
@@ -0,0 +1,278 @@
+"""
+Модуль in-memory хранилища событий (Event) line_provider.
+
+Помимо словаря событий по event_id хранилище поддерживает:
+- кучу (heap) пар (deadline, event_id) с ленивым удалением устаревших записей;
+- словарь активных событий (deadline ещё не наступил).
+
+Истёкшие события снимаются с вершины кучи пачкой при очередном запросе,
+поэтому выборка активных событий не сравнивает дедлайн каждого события.
+Готовый JSON списка активных событий кэшируется до следующего изменения
+хранилища или наступления ближайшего дедлайна; JSON каждого события
+кэшируется отдельно, поэтому после изменения одного события пересобирается
+только итоговый массив. Сериализация выполняется через orjson.
+
+События не изменяются на месте: изменение заменяет объект события новым
+(copy-on-write), поэтому список событий, взятый для снимка, не меняется
+после его получения, а изменения можно откатить (savepoint/rollback),
+если их не удалось надёжно записать. Точки сохранения вкладываются: откат
+внутренней отменяет только изменения после неё. Об изменениях после точки
+сохранения on_change узнаёт только после фиксации внешней точки (release),
+поэтому лента изменений и планировщик не видят изменений, которые были
+откачены.
+
+ETag отдельного события — хэш его JSON, ETag списка активных событий —
+хэш множества активных событий (http_cache.set_etag, не зависит от порядка).
+Оба строятся только из содержимого, поэтому воркеры с одинаковыми данными
+отдают одинаковые ETag. JSON события, его хэш и ETag считаются вместе один
+раз после изменения события и кэшируются до следующего.
+"""
+import decimal
+import heapq
+import time
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+import orjson
+
+from http_cache import digest, digest_etag, set_etag
+from schemas import Event
+
+# Куча пересобирается, когда устаревших записей в ней становится больше живых
+_HEAP_COMPACT_RATIO: int = 2
+
+
+class _SerializedEvent(NamedTuple):
+    json: bytes
+    digest: int
+    etag: str
+
+
+def _orjson_default(value: Any) -> Any:
+    """Кодирует Decimal числом, как и Event.json()."""
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    raise TypeError
+
+
+def event_to_json(event: Event) -> bytes:
+    """
+    Сериализует событие в JSON (совместимый с Event.json()) через orjson.
+
+    :param event: Объект события (Event).
+    :return: JSON (bytes).
+    """
+    return orjson.dumps(event.dict(), default=_orjson_default)
+
+
+class EventStore:
+    """
+    Хранилище событий с индексом по дедлайну.
+
+    - events: Все события по event_id (включая истёкшие и завершённые).
+    - version: Номер последнего изменения хранилища.
+    """
+
+    def __init__(self) -> None:
+        self.events: Dict[str, Event] = {}
+        self.version: int = 0
+        self._active: Dict[str, Event] = {}
+        self._deadlines: List[Tuple[int, str]] = []
+        self._active_json: Optional[bytes] = None
+        self._active_etag: Optional[str] = None
+        # JSON события, его хэш и ETag (сбрасываются при изменении события)
+        self._event_json: Dict[str, _SerializedEvent] = {}
+        # Стек точек сохранения: исходные состояния событий, изменённых после
+        # каждой из них (None — событие создано)
+        self._undo: List[Dict[str, Optional[Event]]] = []
+        # Изменённые после каждой точки сохранения события (для on_change после фиксации)
+        self._deferred: List[List[Event]] = []
+        #: Колбэк с событием после каждого изменения (для ленты изменений);
+        #: изменения внутри точки сохранения передаются после её фиксации
+        self.on_change: Optional[Callable[[Event], None]] = None
+
+    def __len__(self) -> int:
+        return len(self.events)
+
+    def __contains__(self, event_id: str) -> bool:
+        return event_id in self.events
+
+    def get(self, event_id: str) -> Optional[Event]:
+        """
+        Возвращает событие по идентификатору.
+
+        :param event_id: Идентификатор события.
+        :return: Событие (Event) или None, если его нет.
+        """
+        return self.events.get(event_id)
+
+    def upsert(self, event: Event) -> Tuple[Event, bool]:
+        """
+        Создаёт новое событие или обновляет переданные поля существующего.
+
+        :param event: Событие; для существующего применяются только явно заданные поля.
+        :return: Пара (актуальное событие, True если событие было создано).
+        """
+        self.version += 1
+        previous = self.events.get(event.event_id)
+        if self._undo and event.event_id not in self._undo[-1]:
+            self._undo[-1][event.event_id] = previous
+        if previous is None:
+            self.events[event.event_id] = event
+            self._index(event)
+            self._changed(event)
+            return event, True
+
+        # Поля уже проверены при разборе запроса; dict() не нужен — копируем только заданные
+        existed_event = previous.copy(
+            update={field: getattr(event, field) for field in event.__fields_set__}
+        )
+        self.events[event.event_id] = existed_event
+        self._event_json.pop(event.event_id, None)
+
+        if existed_event.deadline != previous.deadline:
+            self._active.pop(event.event_id, None)
+            self._index(existed_event)
+        elif event.event_id in self._active:
+            self._active[event.event_id] = existed_event
+            self._invalidate_active()
+        self._changed(existed_event)
+        return existed_event, False
+
+    def savepoint(self) -> None:
+        """
+        Начинает запоминать исходные состояния изменяемых событий (для rollback).
+        Может вызываться внутри другой точки сохранения.
+        """
+        self._undo.append({})
+        self._deferred.append([])
+
+    def release(self) -> None:
+        """
+        Фиксирует изменения после последней точки сохранения; внутри другой
+        точки они остаются в ней (их откатит её rollback).
+        """
+        undo, deferred = self._undo.pop(), self._deferred.pop()
+        if self._undo:
+            parent = self._undo[-1]
+            for event_id, previous in undo.items():
+                parent.setdefault(event_id, previous)
+            self._deferred[-1].extend(deferred)
+            return
+        if self.on_change is not None:
+            for event in deferred:
+                self.on_change(event)
+
+    def rollback(self) -> None:
+        """
+        Возвращает события, изменённые после последней точки сохранения,
+        в исходное состояние; созданные после неё события удаляются.
+        on_change об откаченных изменениях не вызывается.
+        """
+        undo = self._undo.pop()
+        self._deferred.pop()
+        for event_id, previous in undo.items():
+            self.version += 1
+            self._active.pop(event_id, None)
+            self._event_json.pop(event_id, None)
+            if previous is None:
+                del self.events[event_id]
+                self._invalidate_active()
+                continue
+            self.events[event_id] = previous
+            self._index(previous)
+
+    def event_json(self, event_id: str) -> Optional[Tuple[bytes, str]]:
+        """
+        Возвращает готовый JSON события и его ETag.
+
+        :param event_id: Идентификатор события.
+        :return: Пара (JSON, ETag) или None, если события нет.
+        """
+        event = self.events.get(event_id)
+        if event is None:
+            return None
+        serialized = self._serialize(event)
+        return serialized.json, serialized.etag
+
+    def active_events(self, now: Optional[int] = None) -> List[Event]:
+        """
+        Возвращает события, у которых deadline ещё не наступил.
+
+        :param now: Текущее время (unix timestamp), по умолчанию time.time().
+        :return: Список активных событий.
+        """
+        self._expire(int(time.time()) if now is None else now)
+        return list(self._active.values())
+
+    def active_events_json(self, now: Optional[int] = None) -> bytes:
+        """
+        Возвращает активные события в виде готового JSON-массива.
+
+        :param now: Текущее время (unix timestamp), по умолчанию time.time().
+        :return: JSON (bytes), совпадающий с сериализацией списка Event.
+        """
+        self._expire(int(time.time()) if now is None else now)
+        if self._active_json is None:
+            self._active_json = (
+                b"[" + b",".join(self._serialize(e).json for e in self._active.values()) + b"]"
+            )
+        return self._active_json
+
+    def active_events_etag(self, now: Optional[int] = None) -> str:
+        """
+        Возвращает ETag списка активных событий.
+
+        :param now: Текущее время (unix timestamp), по умолчанию time.time().
+        :return: ETag, меняющийся при каждом изменении списка.
+        """
+        self._expire(int(time.time()) if now is None else now)
+        if self._active_etag is None:
+            self._active_etag = set_etag(self._serialize(e).digest for e in self._active.values())
+        return self._active_etag
+
+    def _invalidate_active(self) -> None:
+        self._active_json = None
+        self._active_etag = None
+
+    def _changed(self, event: Event) -> None:
+        if self._deferred:
+            self._deferred[-1].append(event)
+        elif self.on_change is not None:
+            self.on_change(event)
+
+    def _serialize(self, event: Event) -> _SerializedEvent:
+        """Возвращает JSON события с его хэшем и ETag, сериализуя его только после изменения."""
+        serialized = self._event_json.get(event.event_id)
+        if serialized is None:
+            body = event_to_json(event)
+            value = digest(body)
+            serialized = self._event_json[event.event_id] = _SerializedEvent(body, value, digest_etag(value))
+        return serialized
+
+    def _index(self, event: Event) -> None:
+        """Добавляет событие в индекс дедлайнов (если дедлайн ещё не наступил)."""
+        self._invalidate_active()
+        if not event.deadline or event.deadline <= int(time.time()):
+            return
+        self._active[event.event_id] = event
+        heapq.heappush(self._deadlines, (event.deadline, event.event_id))
+        if len(self._deadlines) > _HEAP_COMPACT_RATIO * len(self._active) + 64:
+            self._compact()
+
+    def _expire(self, now: int) -> None:
+        """Снимает с вершины кучи все записи с наступившим дедлайном."""
+        deadlines = self._deadlines
+        while deadlines and deadlines[0][0] <= now:
+            deadline, event_id = heapq.heappop(deadlines)
+            event = self._active.get(event_id)
+            # Запись устарела, если дедлайн события с тех пор изменился
+            if event is not None and event.deadline == deadline:
+                del self._active[event_id]
+                self._event_json.pop(event_id, None)
+                self.version += 1
+                self._invalidate_active()
+
+    def _compact(self) -> None:
+        """Пересобирает кучу только из актуальных записей."""
+        self._deadlines = [(e.deadline, e.event_id) for e in self._active.values()]
+        heapq.heapify(self._deadlines)
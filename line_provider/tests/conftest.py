@@ -0,0 +1,36 @@
+"""
+Модули line_provider импортируются по имени (schemas, store, persistence),
+как в контейнере, где рабочий каталог — каталог сервиса.
+
+bet_maker содержит модули с теми же именами (main, schemas, protocol, metrics),
+поэтому перед сбором каждого тестового модуля line_provider модули другого сервиса,
+импортированные ранее, убираются из sys.modules, а каталог сервиса ставится
+первым в sys.path: тесты обоих сервисов можно запускать одной командой,
+и уже собранные тесты продолжают ссылаться на свои модули.
+"""
+import os
+import sys
+from pathlib import Path
+
+SERVICE_DIR = str(Path(__file__).resolve().parent.parent)
+OTHER_SERVICE_DIR = str(Path(SERVICE_DIR).parent / "bet_maker")
+
+
+def _activate_service() -> None:
+    for name, module in list(sys.modules.items()):
+        if (getattr(module, "__file__", None) or "").startswith(OTHER_SERVICE_DIR + os.sep):
+            del sys.modules[name]
+    if OTHER_SERVICE_DIR in sys.path:
+        sys.path.remove(OTHER_SERVICE_DIR)
+    if SERVICE_DIR in sys.path:
+        sys.path.remove(SERVICE_DIR)
+    sys.path.insert(0, SERVICE_DIR)
+
+
+def pytest_collectstart(collector) -> None:
+    """Перед импортом тестового модуля этого сервиса делает его модули доступными."""
+    if str(collector.path).startswith(SERVICE_DIR + os.sep):
+        _activate_service()
+
+
+_activate_service()
@@ -4,6 +4,7 @@
 Перед запуском требуется, чтобы line_provider уже был запущен 
 (например, через docker-compose) и доступен на 8001 порту.
 """
+import asyncio
 import pytest
 import time
 from decimal import Decimal
@@ -54,3 +55,141 @@ async def test_create_and_update_event_integration() -> None:
         resp = await ac.get(f"/event/{unique_event_id}")
         assert resp.status_code == 200, f"Get Updated Event Response: {resp.status_code}, {resp.text}"
         assert resp.json()["state"] == "FINISHED_WIN"
+
+
+@pytest.mark.asyncio
+async def test_events_stream_integration() -> None:
+    """
+    Проверяет поток изменений GET /events/stream:
+    1) Первым приходит снимок активных событий.
+    2) После PUT /event приходит изменение с событием и новым курсором.
+    3) Продолжение с курсора снимка сразу отдаёт пропущенное изменение.
+    """
+    unique_event_id = f"test_event_{uuid4().hex}"
+
+    async def read_message(lines) -> dict:
+        message = {}
+        async for line in lines:
+            if not line:
+                return message
+            if not line.startswith(":"):
+                field, _, value = line.partition(": ")
+                message[field] = value
+
+    async with AsyncClient(base_url=LINE_PROVIDER_BASE_URL, timeout=10) as ac:
+        async with ac.stream("GET", "/events/stream") as resp:
+            assert resp.status_code == 200
+            lines = resp.aiter_lines()
+            snapshot = await read_message(lines)
+            assert snapshot["event"] == "snapshot"
+
+            resp_put = await ac.put("/event", json={
+                "event_id": unique_event_id,
+                "coefficient": "2.10",
+                "deadline": int(time.time()) + 300,
+                "state": "NEW"
+            })
+            assert resp_put.status_code == 200
+
+            update = await read_message(lines)
+            while unique_event_id not in update["data"]:
+                update = await read_message(lines)
+            assert update["event"] == "update"
+            assert update["id"] != snapshot["id"]
+
+        async with ac.stream("GET", "/events/stream", params={"since": snapshot["id"]}) as resp:
+            message = await read_message(resp.aiter_lines())
+            assert message["event"] == "update"
+
+
+@pytest.mark.asyncio
+async def test_conditional_get_integration() -> None:
+    """
+    Проверяет ETag и If-None-Match для GET /event/{id} и GET /events:
+    повторный запрос с тем же ETag получает 304, после изменения события — 200.
+    """
+    unique_event_id = f"test_event_{uuid4().hex}"
+
+    async with AsyncClient(base_url=LINE_PROVIDER_BASE_URL) as ac:
+        resp = await ac.put("/event", json={
+            "event_id": unique_event_id,
+            "coefficient": "1.40",
+            "deadline": int(time.time()) + 300,
+            "state": "NEW"
+        })
+        assert resp.status_code == 200
+
+        for path in (f"/event/{unique_event_id}", "/events"):
+            resp = await ac.get(path)
+            assert resp.status_code == 200
+            etag = resp.headers["ETag"]
+            resp = await ac.get(path, headers={"If-None-Match": etag})
+            assert resp.status_code == 304, path
+
+        resp = await ac.get(f"/event/{unique_event_id}")
+        etag = resp.headers["ETag"]
+        await ac.put("/event", json={"event_id": unique_event_id, "coefficient": "1.50"})
+        resp = await ac.get(f"/event/{unique_event_id}", headers={"If-None-Match": etag})
+        assert resp.status_code == 200
+        assert resp.headers["ETag"] != etag
+
+
+@pytest.mark.asyncio
+async def test_deadline_closes_event_integration() -> None:
+    """
+    Проверяет, что по наступлении дедлайна событие переходит в состояние CLOSED.
+    """
+    unique_event_id = f"test_event_{uuid4().hex}"
+
+    async with AsyncClient(base_url=LINE_PROVIDER_BASE_URL) as ac:
+        resp = await ac.put("/event", json={
+            "event_id": unique_event_id,
+            "coefficient": "1.40",
+            "deadline": int(time.time()) + 1,
+            "state": "NEW"
+        })
+        assert resp.status_code == 200
+
+        for _ in range(50):
+            resp = await ac.get(f"/event/{unique_event_id}")
+            if resp.json()["state"] == "CLOSED":
+                break
+            await asyncio.sleep(0.1)
+        assert resp.json()["state"] == "CLOSED"
+
+
+@pytest.mark.asyncio
+async def test_events_batch_integration() -> None:
+    """
+    Проверяет PUT /events:batch: JSON-массив и NDJSON применяются целиком,
+    а пачка с некорректным событием не применяется совсем.
+    """
+    prefix = f"test_batch_{uuid4().hex}"
+    deadline = int(time.time()) + 300
+
+    async with AsyncClient(base_url=LINE_PROVIDER_BASE_URL) as ac:
+        resp = await ac.put("/events:batch", json=[
+            {"event_id": f"{prefix}_{i}", "coefficient": "1.30", "deadline": deadline, "state": "NEW"}
+            for i in range(3)
+        ])
+        assert resp.status_code == 200, f"Response: {resp.status_code}, {resp.text}"
+        assert resp.json()["created"] == 3
+
+        ndjson = "\n".join(
+            f'{{"event_id": "{prefix}_{i}", "state": "FINISHED_WIN"}}' for i in range(3)
+        )
+        resp = await ac.put(
+            "/events:batch", content=ndjson, headers={"Content-Type": "application/x-ndjson"}
+        )
+        assert resp.status_code == 200
+        assert resp.json()["updated"] == 3
+        resp = await ac.get(f"/event/{prefix}_2")
+        assert resp.json()["state"] == "FINISHED_WIN"
+
+        resp = await ac.put("/events:batch", json=[
+            {"event_id": f"{prefix}_new", "coefficient": "1.30", "deadline": deadline},
+            {"event_id": f"{prefix}_bad", "deadline": "not a number"},
+        ])
+        assert resp.status_code == 422
+        resp = await ac.get(f"/event/{prefix}_new")
+        assert resp.status_code == 404
@@ -0,0 +1,324 @@
+"""
+Тесты слоя персистентности line_provider: восстановление из журнала
+и снимков, сохранность сообщений outbox при сбое, откат изменений,
+которые не удалось записать, и смена воркера-лидера общего хранилища.
+
+Сервисы не нужны: данные пишутся во временный каталог.
+"""
+import asyncio
+import contextlib
+import time
+from decimal import Decimal
+from pathlib import Path
+from typing import List, Tuple
+
+import pytest
+
+from outbox import Outbox, OutboxMessage
+from persistence import (
+    EventChange,
+    FileEventPersistence,
+    Mutation,
+    SNAPSHOT_FILE,
+    SqliteEventPersistence,
+)
+from schemas import Event, EventState
+from store import EventStore
+
+
+def finish(store: EventStore, event_id: str) -> Mutation:
+    """Изменение: событие создаётся завершённым, с долговечным уведомлением."""
+    def mutate() -> List[EventChange]:
+        event, created = store.upsert(Event(
+            event_id=event_id,
+            coefficient="1.50",
+            deadline=int(time.time()) + 600,
+            state=EventState.FINISHED_WIN,
+        ))
+        message = OutboxMessage(routing_key="event.finished", body=f"{event_id}:FINISHED_WIN".encode())
+        return [EventChange(event, created, [message])]
+    return mutate
+
+
+async def crash(persistence: FileEventPersistence) -> None:
+    """Останавливает запись без снимка и без дописывания (как при падении процесса)."""
+    if persistence._snapshot_task is not None:
+        await persistence._snapshot_task
+    persistence._flush_task.cancel()
+    with contextlib.suppress(asyncio.CancelledError):
+        await persistence._flush_task
+    persistence._file.close()
+
+
+def restore(data_dir: Path) -> Tuple[EventStore, Outbox]:
+    """Загружает сохранённое состояние в новые хранилище и outbox."""
+    store, outbox = EventStore(), Outbox()
+    FileEventPersistence(str(data_dir)).load(store, outbox)
+    return store, outbox
+
+
+@pytest.mark.asyncio
+async def test_restore_from_wal(tmp_path: Path) -> None:
+    """
+    События и неподтверждённые сообщения восстанавливаются из журнала;
+    подтверждённые сообщения не возвращаются в outbox.
+    """
+    store, outbox = EventStore(), Outbox()
+    persistence = FileEventPersistence(str(tmp_path))
+    persistence.load(store, outbox)
+    await persistence.start(store, outbox)
+
+    await persistence.commit(finish(store, "1"))
+    await persistence.commit(finish(store, "2"))
+    assert len(outbox) == 2
+    persistence.confirm([outbox.pending_durable()[0].id])
+    await persistence.commit(lambda: [])
+    await crash(persistence)
+
+    restored, restored_outbox = restore(tmp_path)
+    assert set(restored.events) == {"1", "2"}
+    assert restored.get("1").state == EventState.FINISHED_WIN
+    assert [m.body for m in restored_outbox.pending_durable()] == [b"2:FINISHED_WIN"]
+
+
+@pytest.mark.asyncio
+async def test_restore_from_snapshot_keeps_outbox(tmp_path: Path) -> None:
+    """
+    Снимок, сделанный сразу после записи пачки, содержит сообщения этой пачки:
+    после падения восстанавливаются все неподтверждённые сообщения,
+    хотя покрытые снимком сегменты журнала удалены.
+    """
+    store, outbox = EventStore(), Outbox()
+    persistence = FileEventPersistence(str(tmp_path), snapshot_every=3)
+    persistence.load(store, outbox)
+    await persistence.start(store, outbox)
+
+    for event_id in ("1", "2", "3"):
+        await persistence.commit(finish(store, event_id))
+    await crash(persistence)
+
+    assert (tmp_path / SNAPSHOT_FILE).exists()
+    assert persistence._segments() == [1]
+    restored, restored_outbox = restore(tmp_path)
+    assert set(restored.events) == {"1", "2", "3"}
+    assert len(restored_outbox) == len(outbox) == 3
+
+
+@pytest.mark.asyncio
+async def test_restore_from_snapshot_and_wal_tail(tmp_path: Path) -> None:
+    """Изменения после снимка восстанавливаются из хвоста журнала поверх снимка."""
+    store, outbox = EventStore(), Outbox()
+    persistence = FileEventPersistence(str(tmp_path), snapshot_every=2)
+    persistence.load(store, outbox)
+    await persistence.start(store, outbox)
+
+    await persistence.commit(finish(store, "1"))
+    await persistence.commit(finish(store, "2"))
+    await persistence.commit(lambda: [EventChange(*store.upsert(Event(event_id="1", coefficient="2.00")), [])])
+    await crash(persistence)
+
+    restored, _ = restore(tmp_path)
+    assert restored.get("1").coefficient == Decimal("2.00")
+    assert restored.get("2").state == EventState.FINISHED_WIN
+
+
+@pytest.mark.asyncio
+async def test_stop_writes_snapshot(tmp_path: Path) -> None:
+    """При остановке пишется снимок с событиями и неподтверждёнными сообщениями."""
+    store, outbox = EventStore(), Outbox()
+    persistence = FileEventPersistence(str(tmp_path))
+    persistence.load(store, outbox)
+    await persistence.start(store, outbox)
+    await persistence.commit(finish(store, "1"))
+    await persistence.stop()
+
+    assert persistence._segments() == [1]
+    restored, restored_outbox = restore(tmp_path)
+    assert set(restored.events) == {"1"}
+    assert len(restored_outbox) == 1
+
+
+@pytest.mark.asyncio
+async def test_failed_write_rolls_back(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    """
+    Если запись в журнал не удалась, изменение не остаётся в хранилище,
+    его сообщения не попадают в outbox, а on_change (лента изменений,
+    планировщик) о нём не узнаёт.
+    """
+    store, outbox = EventStore(), Outbox()
+    persistence = FileEventPersistence(str(tmp_path))
+    persistence.load(store, outbox)
+    await persistence.start(store, outbox)
+    changed: List[str] = []
+    store.on_change = lambda event: changed.append(event.event_id)
+    await persistence.commit(lambda: [EventChange(*store.upsert(Event(event_id="1", state=EventState.NEW)), [])])
+
+    def fail(data: str) -> None:
+        raise OSError("disk full")
+
+    monkeypatch.setattr(persistence, "_write", fail)
+    with pytest.raises(OSError):
+        await persistence.commit(finish(store, "1"))
+    with pytest.raises(OSError):
+        await persistence.commit(finish(store, "2"))
+
+    assert store.get("1").state == EventState.NEW
+    assert store.get("2") is None
+    assert len(outbox) == 0
+    assert changed == ["1"]
+    monkeypatch.undo()
+    await persistence.stop()
+
+
+@pytest.mark.asyncio
+async def test_sqlite_failed_write_rolls_back(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Общее хранилище: незаписанное изменение откатывается в памяти воркера."""
+    store, outbox = EventStore(), Outbox()
+    persistence = SqliteEventPersistence(str(tmp_path / "events.sqlite3"))
+    persistence.load(store, outbox)
+    await persistence.start(store, outbox)
+
+    def fail(*args: object) -> None:
+        raise OSError("disk full")
+
+    monkeypatch.setattr(persistence, "_write", fail)
+    with pytest.raises(OSError):
+        await persistence.commit(finish(store, "1"))
+    assert store.get("1") is None
+    assert len(outbox) == 0
+
+    monkeypatch.undo()
+    await persistence.commit(finish(store, "1"))
+    assert store.get("1").state == EventState.FINISHED_WIN
+    assert len(outbox) == 1
+    await persistence.stop()
+
+
+@pytest.mark.asyncio
+async def test_sqlite_leader_failover(tmp_path: Path) -> None:
+    """
+    Когда лидер завершается, другой воркер берёт блокировку лидера,
+    восстанавливает неподтверждённые сообщения и вызывает on_leader.
+    """
+    path = str(tmp_path / "events.sqlite3")
+    leader_store, leader_outbox = EventStore(), Outbox()
+    leader = SqliteEventPersistence(path)
+    leader.load(leader_store, leader_outbox)
+    await leader.start(leader_store, leader_outbox)
+
+    follower_store, follower_outbox = EventStore(), Outbox()
+    follower = SqliteEventPersistence(path, leader_retry_interval=0.01)
+    follower.load(follower_store, follower_outbox)
+    promoted = asyncio.Event()
+    follower.on_leader = promoted.set
+    await follower.start(follower_store, follower_outbox)
+    assert leader.is_leader and not follower.is_leader
+
+    await leader.commit(finish(leader_store, "1"))
+    await leader.stop()
+
+    await asyncio.wait_for(promoted.wait(), 5)
+    assert follower.is_leader
+    assert follower_store.get("1").state == EventState.FINISHED_WIN
+    assert [m.body for m in follower_outbox.pending_durable()] == [b"1:FINISHED_WIN"]
+    await follower.stop()
+
+
+@pytest.mark.asyncio
+async def test_sqlite_leader_adopts_outbox_of_stopped_worker(tmp_path: Path) -> None:
+    """
+    Сообщения работающего воркера публикует он сам; неподтверждённые сообщения
+    завершившегося воркера лидер забирает при очередном поиске.
+    """
+    path = str(tmp_path / "events.sqlite3")
+    leader_store, leader_outbox = EventStore(), Outbox()
+    leader = SqliteEventPersistence(path, outbox_rescan_interval=0.01)
+    leader.load(leader_store, leader_outbox)
+    await leader.start(leader_store, leader_outbox)
+
+    worker_store, worker_outbox = EventStore(), Outbox()
+    worker = SqliteEventPersistence(path)
+    worker.load(worker_store, worker_outbox)
+    await worker.start(worker_store, worker_outbox)
+
+    await worker.commit(finish(worker_store, "1"))
+    assert [m.body for m in worker_outbox.pending_durable()] == [b"1:FINISHED_WIN"]
+    await asyncio.sleep(0.05)
+    assert len(leader_outbox) == 0
+
+    await worker.stop()
+    for _ in range(100):
+        if len(leader_outbox):
+            break
+        await asyncio.sleep(0.01)
+    assert [m.body for m in leader_outbox.pending_durable()] == [b"1:FINISHED_WIN"]
+    await leader.stop()
+
+    # Забранные сообщения принадлежат лидеру: после его перезапуска они восстанавливаются
+    restored_outbox = Outbox()
+    restarted = SqliteEventPersistence(path)
+    restarted.load(EventStore(), restored_outbox)
+    assert [m.body for m in restored_outbox.pending_durable()] == [b"1:FINISHED_WIN"]
+
+
+@pytest.mark.asyncio
+async def test_sqlite_refresh_is_rate_limited(tmp_path: Path) -> None:
+    """refresh проверяет изменения других воркеров не чаще раза в refresh_interval."""
+    path = str(tmp_path / "events.sqlite3")
+    writer_store, writer_outbox = EventStore(), Outbox()
+    writer = SqliteEventPersistence(path)
+    writer.load(writer_store, writer_outbox)
+    await writer.start(writer_store, writer_outbox)
+
+    reader_store = EventStore()
+    reader = SqliteEventPersistence(path, refresh_interval=60)
+    reader.load(reader_store, Outbox())
+    reader.refresh(reader_store)
+
+    await writer.commit(finish(writer_store, "1"))
+    reader.refresh(reader_store)
+    assert reader_store.get("1") is None
+
+    reader.refresh_interval = 0
+    reader.refresh(reader_store)
+    assert reader_store.get("1").state == EventState.FINISHED_WIN
+    await writer.stop()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("backend", ["file", "sqlite"])
+async def test_failed_mutation_does_not_fail_group(tmp_path: Path, backend: str) -> None:
+    """
+    Изменение, завершившееся ошибкой, откатывается и передаёт её только
+    своему вызывающему; остальные изменения той же пачки записываются.
+    """
+    store, outbox = EventStore(), Outbox()
+    persistence = (
+        FileEventPersistence(str(tmp_path)) if backend == "file"
+        else SqliteEventPersistence(str(tmp_path / "events.sqlite3"))
+    )
+    persistence.load(store, outbox)
+    await persistence.start(store, outbox)
+
+    def broken() -> List[EventChange]:
+        store.upsert(Event(event_id="broken", state=EventState.NEW))
+        raise ValueError("bad event")
+
+    results = await asyncio.gather(
+        persistence.commit(finish(store, "1")),
+        persistence.commit(broken),
+        persistence.commit(finish(store, "2")),
+        return_exceptions=True,
+    )
+    assert isinstance(results[1], ValueError)
+    assert [changes[0].event.event_id for changes in (results[0], results[2])] == ["1", "2"]
+    assert set(store.events) == {"1", "2"}
+    assert len(outbox) == 2
+    await persistence.stop()
+
+    restored = EventStore()
+    if backend == "file":
+        FileEventPersistence(str(tmp_path)).load(restored, Outbox())
+    else:
+        SqliteEventPersistence(str(tmp_path / "events.sqlite3")).load(restored, Outbox())
+    assert set(restored.events) == {"1", "2"}
@@ -0,0 +1,94 @@
+"""
+Тесты планировщика дедлайнов (DeadlineScheduler): событие закрывается
+и уведомление публикуется один раз, а перенос дедлайна или завершение
+события снимают прежний план.
+
+Дедлайн — целая секунда, поэтому часы сдвигаются так, чтобы до неё
+оставалось около 50 мс, и тесты не ждут секундной границы.
+"""
+import asyncio
+import time
+from typing import AsyncIterator, List, Tuple
+
+import pytest
+
+from scheduler import DeadlineScheduler
+from schemas import Event, EventState
+from store import EventStore
+
+
+@pytest.fixture
+def deadline(monkeypatch: pytest.MonkeyPatch) -> int:
+    """Дедлайн, который наступит примерно через 50 мс (по сдвинутым часам)."""
+    real_time = time.time
+    now = real_time()
+    deadline = int(now) + 2
+    shift = deadline - 0.05 - now
+    monkeypatch.setattr(time, "time", lambda: real_time() + shift)
+    return deadline
+
+
+@pytest.fixture
+async def scheduled() -> AsyncIterator[Tuple[EventStore, List[List[str]]]]:
+    """
+    Хранилище, изменения которого планируются, как у воркера-лидера,
+    и список уведомлений о закрытии (по одному на пробуждение).
+    """
+    store = EventStore()
+    published: List[List[str]] = []
+
+    async def close_expired_events(event_ids: List[str]) -> None:
+        closed = []
+        for event_id in event_ids:
+            event = store.get(event_id)
+            if event.state == EventState.NEW and event.deadline <= time.time():
+                store.upsert(Event(event_id=event_id, state=EventState.CLOSED))
+                closed.append(event_id)
+        published.append(closed)
+
+    scheduler = DeadlineScheduler(close_expired_events, max_sleep=0.05)
+    store.on_change = scheduler.schedule
+    scheduler.start()
+    yield store, published
+    await scheduler.stop()
+    assert len(scheduler) == 0
+
+
+@pytest.mark.asyncio
+async def test_closed_and_published_once(deadline: int, scheduled) -> None:
+    """Событие закрывается по дедлайну одним уведомлением, повторов нет."""
+    store, published = scheduled
+    store.upsert(Event(event_id="1", deadline=deadline, state=EventState.NEW))
+    store.upsert(Event(event_id="2", deadline=deadline, state=EventState.NEW))
+
+    await asyncio.sleep(0.3)
+    assert published == [["1", "2"]]
+    assert store.get("1").state == store.get("2").state == EventState.CLOSED
+
+
+@pytest.mark.asyncio
+async def test_reschedule_cancels_old_deadline(deadline: int, scheduled) -> None:
+    """После переноса дедлайна событие закрывается только по новому."""
+    store, published = scheduled
+    store.upsert(Event(event_id="1", deadline=deadline, state=EventState.NEW))
+    store.upsert(Event(event_id="1", deadline=deadline + 1))
+
+    await asyncio.sleep(0.3)
+    assert published == []
+    assert store.get("1").state == EventState.NEW
+
+    await asyncio.sleep(1)
+    assert published == [["1"]]
+    assert store.get("1").state == EventState.CLOSED
+
+
+@pytest.mark.asyncio
+async def test_finish_cancels_deadline(deadline: int, scheduled) -> None:
+    """Событие, завершённое до дедлайна, не закрывается и уведомление не публикуется."""
+    store, published = scheduled
+    store.upsert(Event(event_id="1", deadline=deadline, state=EventState.NEW))
+    store.upsert(Event(event_id="1", state=EventState.FINISHED_WIN))
+
+    await asyncio.sleep(0.3)
+    assert published == []
+    assert store.get("1").state == EventState.FINISHED_WIN
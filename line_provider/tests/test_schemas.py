@@ -0,0 +1,41 @@
+"""
+Тесты схемы события: значения, которые не помещаются в двоичный формат
+сообщений, отклоняются при разборе запроса, а допустимые — кодируются.
+"""
+import time
+
+import pytest
+from pydantic import ValidationError
+
+import protocol
+from schemas import COEFFICIENT_MAX_LENGTH, DEADLINE_MAX, EVENT_ID_MAX_BYTES, Event
+
+
+def encode(event: Event) -> bytes:
+    return protocol.encode(protocol.KIND_UPDATED, [protocol.EventRecord(
+        event.event_id, None, event.coefficient, event.deadline, time.time_ns(),
+    )])
+
+
+@pytest.mark.parametrize("fields", [
+    {"event_id": "x" * (EVENT_ID_MAX_BYTES + 1)},
+    {"event_id": "я" * (EVENT_ID_MAX_BYTES // 2 + 1)},
+    {"event_id": "1", "coefficient": "1." + "0" * COEFFICIENT_MAX_LENGTH},
+    {"event_id": "1", "deadline": DEADLINE_MAX + 1},
+])
+def test_oversized_values_rejected(fields: dict) -> None:
+    with pytest.raises(ValidationError):
+        Event.parse_obj(fields)
+
+
+def test_largest_values_encode() -> None:
+    """Значения на границе ограничений проходят проверку и кодируются."""
+    event = Event(
+        event_id="я" * (EVENT_ID_MAX_BYTES // 2),
+        coefficient="1." + "0" * (COEFFICIENT_MAX_LENGTH - 2),
+        deadline=DEADLINE_MAX,
+    )
+    _, [record] = protocol.decode(encode(event))
+    assert (record.event_id, record.coefficient, record.deadline) == (
+        event.event_id, event.coefficient, event.deadline,
+    )
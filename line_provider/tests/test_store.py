@@ -0,0 +1,177 @@
+"""
+Тесты хранилища событий: ETag строится из содержимого, поэтому хранилища
+разных воркеров с одинаковыми событиями отдают одинаковые ETag; события
+снимаются из списка активных по дедлайну, в том числе после его изменения.
+"""
+import time
+from typing import List
+
+import pytest
+
+import store as store_module
+from http_cache import content_etag, digest, etag_matches
+from schemas import Event, EventState
+from store import EventStore
+
+
+def make_event(event_id: str, coefficient: str = "1.50") -> Event:
+    return Event(event_id=event_id, coefficient=coefficient, deadline=int(time.time()) + 600)
+
+
+def test_etags_match_across_stores() -> None:
+    """Одинаковые события в разном порядке и с разной историей дают те же ETag."""
+    first, second = EventStore(), EventStore()
+    first.upsert(make_event("1"))
+    first.upsert(make_event("2"))
+    second.upsert(make_event("2", coefficient="3.00"))
+    second.upsert(make_event("1"))
+    second.upsert(Event(event_id="2", coefficient="1.50"))
+
+    assert first.event_json("2") == second.event_json("2")
+    assert first.active_events_etag() == second.active_events_etag()
+    assert etag_matches(first.active_events_etag(), second.active_events_etag())
+
+
+def test_etag_changes_with_content() -> None:
+    """ETag меняется при изменении события и возвращается после отката."""
+    store = EventStore()
+    store.upsert(make_event("1"))
+    event_etag, active_etag = store.event_json("1")[1], store.active_events_etag()
+
+    store.savepoint()
+    store.upsert(Event(event_id="1", coefficient="2.00"))
+    assert store.event_json("1")[1] != event_etag
+    assert store.active_events_etag() != active_etag
+
+    store.rollback()
+    assert store.event_json("1")[1] == event_etag
+    assert store.active_events_etag() == active_etag
+
+
+def test_event_etag_cached_with_json(monkeypatch: pytest.MonkeyPatch) -> None:
+    """
+    JSON события хэшируется один раз после изменения: ETag события и ETag
+    списка берутся из кэша, а ETag совпадает с content_etag его JSON.
+    """
+    hashed = []
+
+    def counting_digest(body: bytes) -> int:
+        hashed.append(body)
+        return digest(body)
+
+    monkeypatch.setattr(store_module, "digest", counting_digest)
+    store = EventStore()
+    store.upsert(make_event("1"))
+
+    body, etag = store.event_json("1")
+    assert etag == content_etag(body)
+    assert store.event_json("1") == (body, etag)
+    store.active_events_etag()
+    assert len(hashed) == 1
+
+    store.upsert(Event(event_id="1", coefficient="2.00"))
+    assert store.event_json("1")[1] != etag
+    assert len(hashed) == 2
+
+
+def test_on_change_after_release_only() -> None:
+    """
+    Изменения внутри точки сохранения передаются on_change только после
+    фиксации внешней точки; об откаченных изменениях on_change не узнаёт.
+    """
+    store = EventStore()
+    changed = []
+    store.on_change = lambda event: changed.append((event.event_id, str(event.coefficient)))
+
+    store.savepoint()
+    store.upsert(make_event("1"))
+    store.savepoint()
+    store.upsert(make_event("2"))
+    store.rollback()
+    store.savepoint()
+    store.upsert(make_event("1", coefficient="2.00"))
+    store.release()
+    assert changed == []
+
+    store.release()
+    assert changed == [("1", "1.50"), ("1", "2.00")]
+
+    store.savepoint()
+    store.upsert(make_event("3"))
+    store.rollback()
+    assert changed == [("1", "1.50"), ("1", "2.00")]
+    assert store.get("3") is None
+
+
+def deadline_ids(store: EventStore, now: int) -> List[str]:
+    return sorted(e.event_id for e in store.active_events(now))
+
+
+def test_expiry_in_deadline_order() -> None:
+    """События снимаются с кучи по мере наступления их дедлайнов, независимо от порядка вставки."""
+    base = int(time.time()) + 1000
+    store = EventStore()
+    for event_id, offset in (("c", 30), ("a", 10), ("b", 20)):
+        store.upsert(Event(event_id=event_id, deadline=base + offset))
+
+    assert deadline_ids(store, base) == ["a", "b", "c"]
+    version, listing = store.version, store.active_events_json(base)
+    assert deadline_ids(store, base + 10) == ["b", "c"]
+    assert store.version == version + 1
+    assert store.active_events_json(base + 10) != listing
+    assert deadline_ids(store, base + 29) == ["c"]
+    assert deadline_ids(store, base + 30) == []
+    assert store.active_events_json(base + 30) == b"[]"
+    assert store._deadlines == []
+    # Истёкшие события остаются доступны по event_id
+    assert store.get("a").deadline == base + 10
+
+
+def test_reupsert_with_changed_deadline() -> None:
+    """
+    Запись кучи со старым дедлайном устаревает: событие снимается по новому
+    дедлайну (позже или раньше старого), а куча не растёт от повторных изменений.
+    """
+    base = int(time.time()) + 1000
+    store = EventStore()
+    store.upsert(Event(event_id="later", deadline=base + 10))
+    store.upsert(Event(event_id="later", deadline=base + 50))
+    store.upsert(Event(event_id="earlier", deadline=base + 50))
+    store.upsert(Event(event_id="earlier", deadline=base + 5))
+
+    assert deadline_ids(store, base + 5) == ["later"]
+    assert deadline_ids(store, base + 10) == ["later"]
+    assert deadline_ids(store, base + 49) == ["later"]
+    assert deadline_ids(store, base + 50) == []
+
+    for offset in range(500):
+        store.upsert(Event(event_id="moving", deadline=base + 100 + offset))
+    assert len(store._deadlines) <= 2 * len(store._active) + 64 + 1
+    assert deadline_ids(store, base + 598) == ["moving"]
+    assert deadline_ids(store, base + 599) == []
+
+
+def test_finished_events_leave_active_set() -> None:
+    """
+    Активность определяется дедлайном (как в GET /events): завершённое событие
+    видно в списке с новым состоянием до своего дедлайна и снимается по нему;
+    событие с уже наступившим дедлайном в список не попадает.
+    """
+    now = int(time.time())
+    base = now + 1000
+    store = EventStore()
+    store.upsert(Event(event_id="1", deadline=base + 10, state=EventState.NEW))
+    assert b'"NEW"' in store.active_events_json(base)
+
+    store.upsert(Event(event_id="1", state=EventState.FINISHED_WIN))
+    [listed] = store.active_events(base)
+    assert listed.state == EventState.FINISHED_WIN
+    assert b'"FINISHED_WIN"' in store.active_events_json(base)
+
+    assert deadline_ids(store, base + 10) == []
+    assert store.get("1").state == EventState.FINISHED_WIN
+    assert b'"FINISHED_WIN"' in store.event_json("1")[0]
+
+    store.upsert(Event(event_id="past", deadline=now - 1, state=EventState.FINISHED_LOSE))
+    assert deadline_ids(store, now) == []
+    assert store._deadlines == []